@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from dispositivo import Dispositivo, DispositivoDAO
+
+# Nombre de los backups en el directorio plano: backup_<nombre limpio>_<AAAAMMDD_HHMMSS>.cfg
+PATRON_BACKUP_PLANO = re.compile(r"^backup_(.+)_(\d{8}_\d{6})\.cfg$")
+
+
+def limpiar_nombre(nombre: str) -> str:
+    """Nombre del dispositivo apto para nombres de archivo"""
+    return "".join(c if c.isalnum() else "_" for c in nombre)
+
+
+def normalizar_lineas(lineas):
+    """
+    Quita espacios al final de cada línea y las líneas vacías finales para que
+    configs iguales den el mismo hash. Procesa línea a línea sin cargar todo el texto
+    """
+    vacias = 0
+    for linea in lineas:
+        linea = linea.rstrip()
+        if not linea:
+            vacias += 1
+            continue
+        yield "\n" * vacias + linea + "\n"
+        vacias = 0
+
+
+def normalizar_configuracion(configuracion: str) -> str:
+    return "".join(normalizar_lineas(io.StringIO(configuracion, newline=None)))
+
+
+class AlmacenDeduplicado:
+    """
+    Almacén direccionado por contenido: cada configuración normalizada se guarda
+    una sola vez bajo su hash SHA-256 y cada backup es solo una fila de historial
+    que la referencia. Un backup sin cambios cuesta un hash y una fila
+    """
+
+    def __init__(self, db_path='dispositivos.db', directorio='backups'):
+        self.db_path = db_path
+        self.directorio_objetos = os.path.join(directorio, "objetos")
+        os.makedirs(self.directorio_objetos, exist_ok=True)
+        self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS historial_backups (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                dispositivo_id INTEGER NOT NULL,
+                                fecha REAL NOT NULL,
+                                hash TEXT NOT NULL,
+                                tamano INTEGER NOT NULL
+                              )''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_historial_dispositivo_fecha
+                              ON historial_backups (dispositivo_id, fecha)''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_hash ON historial_backups (hash)')
+            conn.commit()
+
+    @contextmanager
+    def _transaccion(self):
+        """
+        Transacción de escritura: BEGIN IMMEDIATE serializa, también entre procesos, el alta
+        de objetos con el borrado de huérfanos para que nunca se registre uno que se está borrando
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn.cursor()
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def ruta_objeto(self, hash_contenido: str) -> str:
+        # Dos niveles de directorio para no acumular miles de entradas en uno solo
+        return os.path.join(self.directorio_objetos, hash_contenido[:2], hash_contenido[2:])
+
+    def guardar(self, dispositivo: Dispositivo, configuracion: str, fecha: float = None) -> str:
+        """Guarda la configuración (si no existía ya) y registra el backup. Devuelve la ruta del objeto"""
+        return self._guardar_lineas(dispositivo, io.StringIO(configuracion, newline=None), fecha)
+
+    def guardar_archivo(self, dispositivo: Dispositivo, ruta_archivo: str, fecha: float = None) -> str:
+        """Igual que guardar, leyendo la configuración de un archivo por líneas"""
+        with open(ruta_archivo, 'r', encoding='utf-8', errors='ignore') as f:
+            return self._guardar_lineas(dispositivo, f, fecha)
+
+    def guardar_normalizado(self, dispositivo: Dispositivo, ruta_archivo: str, tamano: int, hash_contenido: str,
+                            fecha: float = None) -> str:
+        """
+        Registra una configuración ya normalizada con su hash calculado (p.ej. por
+        procesar_captura) sin volver a leerla. Si el objeto es nuevo, el archivo pasa al almacén
+        """
+        return self._guardar_objeto(dispositivo, ruta_archivo, hash_contenido, tamano, fecha)
+
+    def _guardar_lineas(self, dispositivo, lineas, fecha):
+        # Se normaliza y se calcula el hash mientras se escribe a un temporal
+        digest = hashlib.sha256()
+        tamano = 0
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio_objetos, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                for linea in normalizar_lineas(lineas):
+                    datos = linea.encode('utf-8')
+                    digest.update(datos)
+                    f.write(datos)
+                    tamano += len(datos)
+            return self._guardar_objeto(dispositivo, temporal, digest.hexdigest(), tamano, fecha)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+
+    def _guardar_objeto(self, dispositivo, temporal, hash_contenido, tamano, fecha):
+        ruta = self.ruta_objeto(hash_contenido)
+        with self._transaccion() as cursor:
+            if not os.path.exists(ruta):
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                os.replace(temporal, ruta)
+            cursor.execute('''INSERT INTO historial_backups (dispositivo_id, fecha, hash, tamano)
+                              VALUES (?, ?, ?, ?)''',
+                           (dispositivo.id, fecha or time.time(), hash_contenido, tamano))
+        return ruta
+
+    def leer(self, hash_contenido: str) -> str:
+        with open(self.ruta_objeto(hash_contenido), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def historial(self, dispositivo_id) -> list[tuple]:
+        """Backups del dispositivo como (id, fecha, hash, tamano), del más reciente al más antiguo"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT id, fecha, hash, tamano FROM historial_backups
+                              WHERE dispositivo_id = ? ORDER BY fecha DESC''', (dispositivo_id,))
+            return cursor.fetchall()
+
+    def ultima_configuracion(self, dispositivo_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT hash FROM historial_backups WHERE dispositivo_id = ?
+                              ORDER BY fecha DESC LIMIT 1''', (dispositivo_id,))
+            row = cursor.fetchone()
+        return self.leer(row[0]) if row else None
+
+    def limpiar_antiguos(self, dispositivo: Dispositivo, dias_retencion: int = 30) -> int:
+        """Borra el historial vencido del dispositivo y los objetos que ya nadie referencia"""
+        fecha_limite = (datetime.now() - timedelta(days=dias_retencion)).timestamp()
+        with self._transaccion() as cursor:
+            cursor.execute('''SELECT DISTINCT hash FROM historial_backups
+                              WHERE dispositivo_id = ? AND fecha < ?''', (dispositivo.id, fecha_limite))
+            candidatos = [row[0] for row in cursor.fetchall()]
+            cursor.execute('DELETE FROM historial_backups WHERE dispositivo_id = ? AND fecha < ?',
+                           (dispositivo.id, fecha_limite))
+            eliminados = cursor.rowcount
+            # Dentro de la transacción: un guardado del mismo hash espera a que termine y vuelve a escribirlo
+            for hash_contenido in candidatos:
+                cursor.execute('SELECT 1 FROM historial_backups WHERE hash = ? LIMIT 1', (hash_contenido,))
+                if cursor.fetchone() is None:
+                    try:
+                        os.remove(self.ruta_objeto(hash_contenido))
+                    except FileNotFoundError:
+                        pass
+        return eliminados
+
+    def migrar_directorio(self, dao: DispositivoDAO, directorio='backups', eliminar_originales=False):
+        """
+        Importa al almacén los backups planos (backup_<nombre>_<fecha>.cfg) existentes.
+        Devuelve (migrados, omitidos); se omiten los archivos sin dispositivo reconocible y
+        los ya migrados en una ejecución anterior, así que se puede repetir sin duplicar el historial
+        """
+        por_nombre = {limpiar_nombre(d.nombre): d for d in dao.obtener_todos()}
+        migrados = omitidos = 0
+        for archivo in sorted(os.listdir(directorio)):
+            coincidencia = PATRON_BACKUP_PLANO.match(archivo)
+            dispositivo = coincidencia and por_nombre.get(coincidencia.group(1))
+            if not dispositivo:
+                omitidos += 1
+                continue
+            ruta = os.path.join(directorio, archivo)
+            fecha = datetime.strptime(coincidencia.group(2), "%Y%m%d_%H%M%S").timestamp()
+            if self._registrado(dispositivo.id, fecha):
+                omitidos += 1
+            else:
+                self.guardar_archivo(dispositivo, ruta, fecha=fecha)
+                migrados += 1
+            if eliminar_originales:
+                os.remove(ruta)
+        return migrados, omitidos
+
+    def _registrado(self, dispositivo_id, fecha: float) -> bool:
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM historial_backups WHERE dispositivo_id = ? AND fecha = ? LIMIT 1',
+                           (dispositivo_id, fecha))
+            return cursor.fetchone() is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra el directorio de backups planos al almacén deduplicado")
+    parser.add_argument("--db", default="dispositivos.db", help="Ruta de la base de datos de dispositivos")
+    parser.add_argument("--directorio", default="backups", help="Directorio con los backups .cfg")
+    parser.add_argument("--eliminar", action="store_true", help="Elimina los .cfg una vez migrados")
+    args = parser.parse_args()
+
+    almacen = AlmacenDeduplicado(args.db, args.directorio)
+    migrados, omitidos = almacen.migrar_directorio(DispositivoDAO(args.db), args.directorio, args.eliminar)
+    print(f"[*] {migrados} backups migrados, {omitidos} archivos omitidos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import io
+import lzma
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from dispositivo import Dispositivo
+
+TAMANO_BLOQUE = 64 * 1024
+
+# Registro del índice: fecha, offset en el paquete, bytes comprimidos, bytes originales, codec
+REGISTRO_INDICE = struct.Struct("<dQQQ8s")
+
+
+class CodecZlib:
+    def __init__(self, nivel: int = 6):
+        self.nivel = nivel
+
+    def compresor(self):
+        return zlib.compressobj(self.nivel)
+
+    def descompresor(self):
+        return zlib.decompressobj()
+
+
+class CodecLzma:
+    def __init__(self, preset: int = 6):
+        self.preset = preset
+
+    def compresor(self):
+        return lzma.LZMACompressor(preset=self.preset)
+
+    def descompresor(self):
+        return lzma.LZMADecompressor()
+
+
+class _SinCompresion:
+    def compress(self, datos):
+        return datos
+
+    def flush(self):
+        return b""
+
+    def decompress(self, datos):
+        return datos
+
+
+class CodecNinguno:
+    def compresor(self):
+        return _SinCompresion()
+
+    def descompresor(self):
+        return _SinCompresion()
+
+
+# Codecs disponibles por nombre (máximo 8 caracteres, se guarda en cada registro del índice)
+CODECS = {
+    "zlib": CodecZlib(),
+    "lzma": CodecLzma(),
+    "ninguno": CodecNinguno(),
+}
+
+
+def registrar_codec(nombre: str, codec) -> None:
+    """Añade un codec con métodos compresor() y descompresor() al estilo de zlib"""
+    if len(nombre.encode()) > 8:
+        raise ValueError("El nombre del codec no puede superar 8 caracteres")
+    CODECS[nombre] = codec
+
+
+class AlmacenComprimido:
+    """
+    Guarda el historial de cada dispositivo en un paquete de solo-añadir
+    (paquetes/<id>.pack) donde cada versión se comprime por separado, más un
+    índice de offsets (paquetes/<id>.idx). Leer una versión descomprime solo esa versión
+    """
+
+    def __init__(self, directorio='backups', codec: str = "zlib"):
+        if codec not in CODECS:
+            raise ValueError(f"Codec desconocido: {codec}")
+        self.codec = codec
+        self.directorio_paquetes = os.path.join(directorio, "paquetes")
+        os.makedirs(self.directorio_paquetes, exist_ok=True)
+        self._locks = {}
+        self._lock_global = threading.Lock()
+
+    def _lock(self, dispositivo_id) -> threading.Lock:
+        with self._lock_global:
+            return self._locks.setdefault(dispositivo_id, threading.Lock())
+
+    def _rutas(self, dispositivo_id) -> tuple[str, str]:
+        base = os.path.join(self.directorio_paquetes, str(dispositivo_id))
+        return f"{base}.pack", f"{base}.idx"
+
+    def guardar(self, dispositivo: Dispositivo, configuracion: str, fecha: float = None) -> str:
+        """Añade una versión al paquete del dispositivo. Devuelve la ruta del paquete"""
+        datos = configuracion.encode('utf-8')
+        return self._guardar_bloques(dispositivo, (datos[i:i + TAMANO_BLOQUE]
+                                                   for i in range(0, len(datos), TAMANO_BLOQUE)), fecha)
+
+    def guardar_archivo(self, dispositivo: Dispositivo, ruta_archivo: str, fecha: float = None) -> str:
+        """Igual que guardar, comprimiendo el archivo por bloques mientras se lee"""
+        with open(ruta_archivo, 'rb') as f:
+            return self._guardar_bloques(dispositivo, iter(lambda: f.read(TAMANO_BLOQUE), b""), fecha)
+
+    def guardar_comprimido(self, dispositivo: Dispositivo, ruta_comprimida: str, tamano: int,
+                           fecha: float = None) -> str:
+        """Añade una versión ya comprimida con el codec del almacén (p.ej. en otro proceso) de `tamano` bytes"""
+        with open(ruta_comprimida, 'rb') as f:
+            return self._guardar_bloques(dispositivo, iter(lambda: f.read(TAMANO_BLOQUE), b""), fecha, tamano)
+
+    def _guardar_bloques(self, dispositivo, bloques, fecha, tamano_original: int = None):
+        """Con tamano_original los bloques ya vienen comprimidos y se copian tal cual"""
+        ruta_paquete, ruta_indice = self._rutas(dispositivo.id)
+        compresor = CODECS[self.codec].compresor() if tamano_original is None else _SinCompresion()
+        with self._lock(dispositivo.id):
+            with open(ruta_paquete, 'ab') as paquete:
+                offset = paquete.tell()
+                tamano = 0
+                for bloque in bloques:
+                    tamano += len(bloque)
+                    paquete.write(compresor.compress(bloque))
+                paquete.write(compresor.flush())
+                comprimido = paquete.tell() - offset
+                if tamano_original is not None:
+                    tamano = tamano_original
+                paquete.flush()
+                os.fsync(paquete.fileno())
+            # El índice se escribe después: una versión a medio escribir nunca queda referenciada
+            with open(ruta_indice, 'ab') as indice:
+                indice.write(REGISTRO_INDICE.pack(fecha or time.time(), offset, comprimido, tamano,
+                                                  self.codec.encode()))
+        return ruta_paquete
+
+    def historial(self, dispositivo_id) -> list[tuple]:
+        """
+        Versiones del dispositivo, de la más antigua a la más reciente, como
+        (fecha, offset, bytes comprimidos, bytes originales, codec)
+        """
+        self._completar_compactacion(dispositivo_id)
+        _, ruta_indice = self._rutas(dispositivo_id)
+        try:
+            with open(ruta_indice, 'rb') as f:
+                contenido = f.read()
+        except FileNotFoundError:
+            return []
+        # Un registro incompleto al final (escritura interrumpida) se ignora
+        completos = len(contenido) - len(contenido) % REGISTRO_INDICE.size
+        return [(fecha, offset, comprimido, tamano, codec.rstrip(b"\0").decode())
+                for fecha, offset, comprimido, tamano, codec in REGISTRO_INDICE.iter_unpack(contenido[:completos])]
+
+    def leer_version_en(self, dispositivo_id, version: int, destino) -> int:
+        """
+        Escribe en destino (archivo binario) la versión indicada; -1 es la última.
+        Solo se lee y descomprime el tramo del paquete de esa versión. Devuelve los bytes escritos
+        """
+        _, offset, comprimido, _, codec = self.historial(dispositivo_id)[version]
+        ruta_paquete, _ = self._rutas(dispositivo_id)
+        descompresor = CODECS[codec].descompresor()
+        escritos = 0
+        with open(ruta_paquete, 'rb') as paquete:
+            paquete.seek(offset)
+            restante = comprimido
+            while restante:
+                bloque = paquete.read(min(TAMANO_BLOQUE, restante))
+                if not bloque:
+                    raise Exception(f"Paquete truncado para el dispositivo {dispositivo_id}")
+                restante -= len(bloque)
+                datos = descompresor.decompress(bloque)
+                destino.write(datos)
+                escritos += len(datos)
+        return escritos
+
+    def leer_version(self, dispositivo_id, version: int = -1) -> str:
+        destino = io.BytesIO()
+        self.leer_version_en(dispositivo_id, version, destino)
+        return destino.getvalue().decode('utf-8', errors='ignore')
+
+    def limpiar_antiguos(self, dispositivo: Dispositivo, dias_retencion: int = 30) -> int:
+        """Compacta el paquete quitando las versiones más antiguas que la retención"""
+        fecha_limite = (datetime.now() - timedelta(days=dias_retencion)).timestamp()
+        return self.compactar(dispositivo.id, lambda registro: registro[0] >= fecha_limite)
+
+    def compactar(self, dispositivo_id, conservar) -> int:
+        """
+        Reescribe el paquete con las versiones para las que conservar(registro) es verdadero,
+        copiando los datos comprimidos tal cual. Devuelve cuántas versiones se eliminaron
+        """
+        ruta_paquete, ruta_indice = self._rutas(dispositivo_id)
+        with self._lock(dispositivo_id):
+            registros = self.historial(dispositivo_id)
+            conservados = [r for r in registros if conservar(r)]
+            if len(conservados) == len(registros):
+                return 0
+
+            with open(ruta_paquete, 'rb') as origen, \
+                    open(f"{ruta_paquete}.tmp", 'wb') as paquete, \
+                    open(f"{ruta_indice}.tmp", 'wb') as indice:
+                for fecha, offset, comprimido, tamano, codec in conservados:
+                    nuevo_offset = paquete.tell()
+                    origen.seek(offset)
+                    restante = comprimido
+                    while restante:
+                        bloque = origen.read(min(TAMANO_BLOQUE, restante))
+                        paquete.write(bloque)
+                        restante -= len(bloque)
+                    indice.write(REGISTRO_INDICE.pack(fecha, nuevo_offset, comprimido, tamano, codec.encode()))
+            os.replace(f"{ruta_paquete}.tmp", ruta_paquete)
+            self._completar_compactacion(dispositivo_id)
+            return len(registros) - len(conservados)
+
+    def _completar_compactacion(self, dispositivo_id):
+        """
+        Si el paquete compactado ya reemplazó al original pero el índice nuevo no
+        (p.ej. por una caída entre ambos renombrados), termina de instalar el índice
+        """
+        ruta_paquete, ruta_indice = self._rutas(dispositivo_id)
+        if os.path.exists(f"{ruta_indice}.tmp") and not os.path.exists(f"{ruta_paquete}.tmp"):
+            try:
+                os.replace(f"{ruta_indice}.tmp", ruta_indice)
+            except FileNotFoundError:
+                pass
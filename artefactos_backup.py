@@ -0,0 +1,85 @@
+import hashlib
+import sqlite3
+import time
+import zlib
+from datetime import datetime, timedelta
+from dispositivo import Dispositivo
+
+
+class ArtefactosBackup:
+    """
+    Salidas de los comandos adicionales de cada backup (show version, show inventory...),
+    comprimidas en SQLite junto a la configuración que guarda el almacén
+    """
+
+    def __init__(self, db_path='dispositivos.db'):
+        self.db_path = db_path
+        self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS artefactos_backup (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                dispositivo_id INTEGER NOT NULL,
+                                fecha REAL NOT NULL,
+                                comando TEXT NOT NULL,
+                                tamano INTEGER NOT NULL,
+                                hash TEXT NOT NULL,
+                                contenido BLOB NOT NULL
+                              )''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_artefactos_dispositivo
+                              ON artefactos_backup (dispositivo_id, comando, fecha)''')
+            conn.commit()
+
+    def guardar_archivo(self, dispositivo: Dispositivo, comando: str, ruta_archivo: str, fecha: float = None) -> None:
+        with open(ruta_archivo, 'rb') as f:
+            datos = f.read()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''INSERT INTO artefactos_backup (dispositivo_id, fecha, comando, tamano, hash, contenido)
+                              VALUES (?, ?, ?, ?, ?, ?)''',
+                           (dispositivo.id, fecha or time.time(), comando, len(datos),
+                            hashlib.sha256(datos).hexdigest(), zlib.compress(datos)))
+            conn.commit()
+
+    def artefactos(self, dispositivo_id, comando: str = None) -> list[tuple]:
+        """Artefactos del dispositivo como (fecha, comando, tamano, hash), del más reciente al más antiguo"""
+        condiciones = ["dispositivo_id = ?"]
+        parametros = [dispositivo_id]
+        if comando:
+            condiciones.append("comando = ?")
+            parametros.append(comando)
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''SELECT fecha, comando, tamano, hash FROM artefactos_backup
+                               WHERE {' AND '.join(condiciones)} ORDER BY fecha DESC''', parametros)
+            return cursor.fetchall()
+
+    def leer(self, dispositivo_id, comando: str, fecha: float = None) -> str:
+        """Salida del comando en el backup indicado (por defecto el último)"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            if fecha is None:
+                cursor.execute('''SELECT contenido FROM artefactos_backup WHERE dispositivo_id = ? AND comando = ?
+                                  ORDER BY fecha DESC LIMIT 1''', (dispositivo_id, comando))
+            else:
+                cursor.execute('''SELECT contenido FROM artefactos_backup
+                                  WHERE dispositivo_id = ? AND comando = ? AND fecha = ?''',
+                               (dispositivo_id, comando, fecha))
+            row = cursor.fetchone()
+        return zlib.decompress(row[0]).decode('utf-8', errors='ignore') if row else None
+
+    def limpiar_antiguos(self, dispositivo: Dispositivo, dias_retencion: int = 30) -> int:
+        """Borra los artefactos vencidos; de cada comando se conserva siempre el último"""
+        fecha_limite = (datetime.now() - timedelta(days=dias_retencion)).timestamp()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''DELETE FROM artefactos_backup
+                              WHERE dispositivo_id = ? AND fecha < ?
+                                AND fecha < (SELECT MAX(fecha) FROM artefactos_backup ultimo
+                                             WHERE ultimo.dispositivo_id = artefactos_backup.dispositivo_id
+                                               AND ultimo.comando = artefactos_backup.comando)''',
+                           (dispositivo.id, fecha_limite))
+            conn.commit()
+            return cursor.rowcount
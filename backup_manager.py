@@ -1,19 +1,77 @@
 import paramiko
+import functools
+import io
 import os
+import select
+import socket
+import tempfile
+import time
 from datetime import datetime, timedelta
 import logging
+import re
+from concurrent.futures import Future
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import dataclass
 from dispositivo import Dispositivo
+from almacen_backups import PATRON_BACKUP_PLANO, limpiar_nombre
+from cortacircuitos import (ERROR_AUTH, ERROR_OTRO, ERROR_RECHAZADO, ERROR_SSH, ERROR_TIMEOUT, OMITIR,
+                            SONDEAR)
+from perfiles import PerfilDispositivo, perfil_para
+from pool_ssh import PoolAgotado
+from postproceso import procesar_captura
+from registro import configurar_registro, dispositivo_actual
+from transporte_ssh import AjustesTransporte, conectar
+
+# Estados posibles de un backup
+EXITOSO = "exitoso"
+FALLIDO = "fallido"
+TIMEOUT = "timeout"
+OMITIDO = "omitido"  # Circuito abierto (el dispositivo sigue en espera tras sus últimos fallos) o pool SSH agotado
+SIN_CAMBIOS = "sin_cambios"  # La sonda de cambios coincide con la del último backup: no se descarga nada
+
+TIMEOUT_CONEXION = 15  # Segundos; con cortacircuitos se ajusta a la latencia de cada dispositivo
+
+TAMANO_BLOQUE = 64 * 1024  # Bytes leídos del canal SSH en cada iteración
+MAX_STDERR = 64 * 1024  # Solo se conserva el inicio de stderr para el mensaje de error
+# Secuencias ANSI, retornos de carro y los retrocesos con que se borra un "--More--" en el shell interactivo
+CONTROL_TERMINAL = re.compile(rb"\x1b\[[0-9;?]*[A-Za-z]|\r| *\x08+")
+
+
+@dataclass
+class CapturaBackup:
+    """Lo descargado de un dispositivo, pendiente de normalizar y guardar"""
+    dispositivo: Dispositivo
+    perfil: PerfilDispositivo
+    capturas: list  # [(comando, ruta temporal, bytes)]; la primera es la configuración
+    huella: str = None
+    latencia: float = None
+    fin_descarga: float = None
+
+    @property
+    def temporal(self) -> str:
+        return self.capturas[0][1]
 
 class BackupManager:
-    def __init__(self):
+    def __init__(self, pool=None, almacen=None, catalogo=None, indice=None, max_tamano_backup: int = None,
+                 timeout_comando: float = 60, metricas=None, artefactos=None, cortacircuitos=None,
+                 huellas=None, postproceso=None, transporte=None):
         self.backup_dir = "backups"
-        self._crear_directorio_backup()
-        logging.basicConfig(
-            filename='backup.log',
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        self.max_tamano_backup = max_tamano_backup  # Bytes; None para no limitar
+        self.timeout_comando = timeout_comando  # Segundos sin recibir datos antes de abortar
+        self.pool = pool  # PoolSesionesSSH opcional para reutilizar conexiones
+        self.almacen = almacen  # Almacén opcional (p.ej. AlmacenDeduplicado) en lugar de archivos .cfg
+        self.catalogo = catalogo  # CatalogoBackups opcional para registrar los .cfg y aplicar la retención
+        self.indice = indice  # IndiceConfiguraciones opcional para la búsqueda de texto completo
+        self.metricas = metricas  # MetricasBackup opcional con los tiempos de cada fase
+        self.artefactos = artefactos  # ArtefactosBackup opcional; sin él solo se captura la configuración
+        self.cortacircuitos = cortacircuitos  # CortacircuitosDispositivos opcional con esperas tras fallos
+        self.huellas = huellas  # HuellasConfiguracion opcional para no descargar configuraciones sin cambios
+        self.postproceso = postproceso  # PostprocesadorBackups opcional: normaliza y comprime en otros procesos
+        self.transporte = transporte  # TransporteDispositivos opcional: compresión, algoritmos y clave por dispositivo
+        # Sin efecto si el programa ya configuró el registro (archivo, rotación, consola)
+        configurar_registro()
         self.logger = logging.getLogger(__name__)
+        self._crear_directorio_backup()
     
     def _crear_directorio_backup(self):
         """Crea el directorio de backups si no existe"""
@@ -24,102 +82,507 @@ class BackupManager:
     def _generar_nombre_backup(self, dispositivo: Dispositivo) -> str:
         """Genera un nombre de archivo único para el backup"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        nombre_limpio = "".join(c if c.isalnum() else "_" for c in dispositivo.nombre)
         return os.path.join(
             self.backup_dir,
-            f"backup_{nombre_limpio}_{timestamp}.cfg"
+            f"backup_{limpiar_nombre(dispositivo.nombre)}_{timestamp}.cfg"
         )
     
-    def _obtener_comando_backup(self, dispositivo: Dispositivo) -> str:
-        """Devuelve el comando adecuado según el tipo de dispositivo"""
-        comandos = {
-            "Router": "/export compact" if "mikrotik" in dispositivo.nombre.lower() else "show running-config",
-            "Switch": "show running-config",
-            "Firewall": "show configuration",
-            "Servidor": "cat /etc/network/interfaces",
-            "Otro": "show configuration"
-        }
-        return comandos.get(dispositivo.tipo, "show running-config")
-    
-    def _ejecutar_comando_ssh(self, ssh, comando: str) -> str:
-        """Ejecuta un comando remoto via SSH y devuelve la salida"""
+    def _comandos_a_capturar(self, perfil: PerfilDispositivo) -> list[str]:
+        """Comandos del perfil; los adicionales solo si hay dónde guardar sus salidas"""
+        return perfil.comandos if self.artefactos else perfil.comandos[:1]
+    
+    def _ejecutar_comando_ssh(self, ssh, comando: str, destino, dispositivo: Dispositivo = None) -> int:
+        """
+        Ejecuta un comando remoto via SSH y escribe la salida en destino por bloques,
+        vaciando stderr a la vez para que el canal nunca se bloquee. Devuelve los bytes escritos
+        """
+        inicio = time.perf_counter()
+        primer_dato = None
         stdin, stdout, stderr = ssh.exec_command(comando)
-        salida = stdout.read().decode('utf-8', errors='ignore')
-        error = stderr.read().decode('utf-8', errors='ignore')
+        canal = stdout.channel
+        escritos = 0
+        error = bytearray()
+        ultimo_dato = time.monotonic()
         
-        if error and not salida:
-            raise Exception(f"Error en comando: {error.strip()}")
-        return salida
+        while True:
+            hubo_datos = False
+            while canal.recv_stderr_ready():
+                bloque = canal.recv_stderr(TAMANO_BLOQUE)
+                if len(error) < MAX_STDERR:
+                    error += bloque[:MAX_STDERR - len(error)]
+                hubo_datos = True
+            
+            if canal.recv_ready():
+                bloque = canal.recv(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                if primer_dato is None:
+                    primer_dato = time.perf_counter()
+                escritos += len(bloque)
+                if self.max_tamano_backup and escritos > self.max_tamano_backup:
+                    raise Exception(f"La salida supera el tamaño máximo de {self.max_tamano_backup} bytes")
+                destino.write(bloque)
+                hubo_datos = True
+            elif canal.eof_received and not canal.recv_ready():
+                break
+            
+            if hubo_datos:
+                ultimo_dato = time.monotonic()
+            elif time.monotonic() - ultimo_dato > self.timeout_comando:
+                raise socket.timeout(f"Sin respuesta del comando en {self.timeout_comando}s")
+            else:
+                # stderr no despierta el descriptor del canal: se espera en intervalos cortos
+                select.select([canal], [], [], 0.1)
+        
+        # Lo que quede en stderr tras el EOF de stdout
+        while canal.recv_stderr_ready() and len(error) < MAX_STDERR:
+            error += canal.recv_stderr(TAMANO_BLOQUE)
+        
+        if dispositivo and (self.metricas or self.logger.isEnabledFor(logging.DEBUG)):
+            # comando: hasta el primer byte de salida; transferencia: el resto
+            fin = time.perf_counter()
+            primer_dato = primer_dato or fin
+            self._registrar_fase("comando", dispositivo, primer_dato - inicio)
+            self._registrar_fase("transferencia", dispositivo, fin - primer_dato)
+        
+        if error and not escritos:
+            raise Exception(f"Error en comando: {error.decode('utf-8', errors='ignore').strip()}")
+        return escritos
     
-    def realizar_backup(self, dispositivo: Dispositivo) -> bool:
+    def _capturar_a_temporal(self, ssh, comando: str, dispositivo: Dispositivo = None) -> tuple[str, int]:
+        """Vuelca la salida del comando a un archivo temporal en backup_dir. Devuelve (ruta, bytes)"""
+        descriptor, temporal = tempfile.mkstemp(dir=self.backup_dir, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                escritos = self._ejecutar_comando_ssh(ssh, comando, f, dispositivo)
+            return temporal, escritos
+        except BaseException:
+            os.remove(temporal)
+            raise
+    
+    def _capturar(self, ssh, perfil: PerfilDispositivo, comandos: list[str],
+                  dispositivo: Dispositivo) -> list[tuple[str, str, int]]:
+        """Ejecuta los comandos en la sesión abierta. Devuelve [(comando, ruta temporal, bytes)]"""
+        if len(comandos) == 1:
+            return [(comandos[0], *self._capturar_a_temporal(ssh, comandos[0], dispositivo))]
+        return self._capturar_shell(ssh, perfil, comandos, dispositivo)
+    
+    def _capturar_shell(self, ssh, perfil: PerfilDispositivo, comandos: list[str],
+                        dispositivo: Dispositivo) -> list[tuple[str, str, int]]:
+        """
+        Ejecuta todos los comandos en un único shell interactivo: la paginación se
+        desactiva una vez y la salida de cada comando va a su propio archivo temporal
+        """
+        capturas = []
+        canal = ssh.invoke_shell(width=511)
+        try:
+            self._leer_hasta_prompt(canal, perfil)  # banner y primer prompt
+            if perfil.desactivar_paginacion:
+                canal.sendall(perfil.desactivar_paginacion + "\n")
+                self._leer_hasta_prompt(canal, perfil)
+            for comando in comandos:
+                descriptor, temporal = tempfile.mkstemp(dir=self.backup_dir, suffix=".tmp")
+                try:
+                    with os.fdopen(descriptor, 'wb') as f, self._medir("comando", dispositivo):
+                        canal.sendall(comando + "\n")
+                        escritos = self._leer_hasta_prompt(canal, perfil, f)
+                except BaseException:
+                    os.remove(temporal)
+                    raise
+                capturas.append((comando, temporal, escritos))
+            return capturas
+        except BaseException:
+            for _, temporal, _ in capturas:
+                os.remove(temporal)
+            raise
+        finally:
+            canal.close()
+    
+    def _leer_hasta_prompt(self, canal, perfil: PerfilDispositivo, destino=None) -> int:
+        """
+        Lee del shell hasta que vuelve a aparecer el prompt. Si hay destino, escribe en él las
+        líneas recibidas sin el eco del comando ni el prompt final. Devuelve los bytes escritos
+        """
+        pendiente = b""  # Última línea, todavía incompleta
+        saltar_eco = destino is not None
+        escritos = 0
+        ultimo_dato = time.monotonic()
+        
+        while True:
+            if canal.recv_ready():
+                bloque = canal.recv(TAMANO_BLOQUE)
+                if not bloque:
+                    raise Exception("El dispositivo cerró la sesión")
+                ultimo_dato = time.monotonic()
+                pendiente += bloque
+                corte = pendiente.rfind(b"\n")
+                if corte < 0:
+                    continue
+                completas, pendiente = pendiente[:corte + 1], pendiente[corte + 1:]
+                if saltar_eco:
+                    completas = completas.partition(b"\n")[2]
+                    saltar_eco = False
+                if destino is not None and completas:
+                    completas = CONTROL_TERMINAL.sub(b"", completas)
+                    escritos += len(completas)
+                    if self.max_tamano_backup and escritos > self.max_tamano_backup:
+                        raise Exception(f"La salida supera el tamaño máximo de {self.max_tamano_backup} bytes")
+                    destino.write(completas)
+                continue
+            if canal.closed or canal.eof_received:
+                raise Exception("El dispositivo cerró la sesión")
+            
+            ultima = CONTROL_TERMINAL.sub(b"", pendiente).decode('utf-8', errors='ignore')
+            if perfil.patron_paginador.search(ultima):
+                canal.sendall(" ")
+                pendiente = b""
+            elif perfil.patron_prompt.match(ultima):
+                # Una línea de la salida cortada justo en un bloque podría parecer un prompt
+                select.select([canal], [], [], 0.1)
+                if not canal.recv_ready():
+                    return escritos
+            elif time.monotonic() - ultimo_dato > self.timeout_comando:
+                raise socket.timeout(f"Sin prompt del dispositivo en {self.timeout_comando}s")
+            else:
+                select.select([canal], [], [], 0.1)
+    
+    def realizar_backup(self, dispositivo: Dispositivo, forzar: bool = False) -> bool:
         """
         Realiza el backup de la configuración del dispositivo via SSH
-        Devuelve True si fue exitoso, False si falló
+        Devuelve True si fue exitoso (o la configuración no había cambiado), False si falló
+        """
+        return self.ejecutar_backup(dispositivo, forzar) in (EXITOSO, SIN_CAMBIOS)
+
+    def ejecutar_backup(self, dispositivo: Dispositivo, forzar: bool = False) -> str:
+        """
+        Igual que realizar_backup, pero devuelve el estado del backup
+        (EXITOSO, SIN_CAMBIOS, FALLIDO, TIMEOUT u OMITIDO) para los reportes de ejecuciones masivas.
+        Con forzar=True se intenta aunque el cortacircuitos tenga el dispositivo en espera y
+        se descarga la configuración aunque la sonda indique que no ha cambiado
+        """
+        return self.iniciar_backup(dispositivo, forzar).result()
+    
+    def iniciar_backup(self, dispositivo: Dispositivo, forzar: bool = False) -> Future:
+        """
+        Como ejecutar_backup, pero devuelve un Future con el estado. La descarga se hace en
+        este hilo; con postproceso, la normalización y el guardado siguen en el pool y el
+        hilo queda libre para el siguiente dispositivo sin esperar a la CPU
         """
+        futuro = Future()
+        inicio = time.perf_counter()
+        estado = FALLIDO
+        # Todos los registros de este hilo hasta terminar llevan el id del dispositivo
+        marca = dispositivo_actual.set(dispositivo)
+        try:
+            captura = self._capturar_backup(dispositivo, forzar)
+            if isinstance(captura, CapturaBackup):
+                continuar = functools.partial(self._continuar_backup, futuro, captura, inicio)
+                volatiles = tuple(captura.perfil.lineas_volatiles)
+                if self.postproceso:
+                    self.postproceso.enviar(captura.temporal, volatiles, self._codec_precomprimido(), continuar)
+                else:
+                    # Sin pool, la misma normalización en este hilo
+                    continuar(functools.partial(procesar_captura, captura.temporal, volatiles,
+                                                self._codec_precomprimido()))
+                estado = None  # Lo termina _continuar_backup
+            else:
+                estado = captura
+        finally:
+            if estado is not None:
+                self._terminar_backup(futuro, dispositivo, estado, inicio)
+            dispositivo_actual.reset(marca)
+        return futuro
+    
+    def _continuar_backup(self, futuro: Future, captura: CapturaBackup, inicio: float, postprocesar) -> None:
+        """Guarda la captura con el resultado de postprocesar() y resuelve el Future del backup"""
+        estado = FALLIDO
+        marca = dispositivo_actual.set(captura.dispositivo)
+        try:
+            estado = self._completar_backup(captura, postprocesar)
+        finally:
+            self._terminar_backup(futuro, captura.dispositivo, estado, inicio)
+            dispositivo_actual.reset(marca)
+    
+    def _terminar_backup(self, futuro: Future, dispositivo: Dispositivo, estado: str, inicio: float) -> None:
+        segundos = time.perf_counter() - inicio
+        try:
+            if self.metricas:
+                self.metricas.finalizar_backup(dispositivo, estado, segundos)
+            self._log(f"Backup de {dispositivo.nombre}: {estado} ({segundos:.2f}s)",
+                      level="info" if estado in (EXITOSO, SIN_CAMBIOS, OMITIDO) else "error",
+                      fase="total", duracion=round(segundos, 3), estado=estado)
+        finally:
+            futuro.set_result(estado)
+    
+    def _codec_precomprimido(self):
+        # Precomprimida solo si el almacén sabe guardar lo que comprime el postproceso
+        return self.almacen.codec if hasattr(self.almacen, "guardar_comprimido") else None
+    
+    def _medir(self, fase: str, dispositivo: Dispositivo):
+        """Span de la fase si hay métricas o el registro está en DEBUG; si no, un contexto vacío"""
+        if self.metricas or self.logger.isEnabledFor(logging.DEBUG):
+            return self._medir_fase(fase, dispositivo)
+        return nullcontext()
+    
+    @contextmanager
+    def _medir_fase(self, fase: str, dispositivo: Dispositivo):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._registrar_fase(fase, dispositivo, time.perf_counter() - inicio)
+    
+    def _registrar_fase(self, fase: str, dispositivo: Dispositivo, segundos: float) -> None:
+        if self.metricas:
+            self.metricas.registrar(fase, dispositivo, segundos)
+        self.logger.debug(f"{fase} de {dispositivo.nombre}: {segundos:.3f}s",
+                          extra={"fase": fase, "duracion": round(segundos, 3)})
+
+    def _capturar_backup(self, dispositivo: Dispositivo, forzar: bool = False):
+        """
+        Conecta y descarga la configuración (y los artefactos) a temporales. Devuelve la
+        CapturaBackup pendiente de guardar o, si no hay nada que guardar, el estado final
+        """
+        timeout = TIMEOUT_CONEXION
+        if self.cortacircuitos:
+            decision = self.cortacircuitos.decidir(dispositivo)
+            if decision == OMITIR and not forzar:
+                self._log(f"Omitido {dispositivo.nombre}: en espera tras fallos anteriores")
+                return OMITIDO
+            timeout = self.cortacircuitos.timeout_conexion(dispositivo)
+            if decision == SONDEAR or (decision == OMITIR and forzar):
+                # Antes del intento completo, una conexión TCP barata para ver si ya responde
+                estado = self._sondear_puerto(dispositivo, timeout)
+                if estado:
+                    return estado
+        
         try:
             self._log(f"Iniciando backup de {dispositivo.nombre} ({dispositivo.ip}:{dispositivo.puerto_ssh})...")
             
-            # Configuración de conexión SSH
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            # Conexión al dispositivo
-            ssh.connect(
-                hostname=dispositivo.ip,
-                port=dispositivo.puerto_ssh,
-                username=dispositivo.usuario,
-                password=dispositivo.contraseña,
-                timeout=15,
-                look_for_keys=False,
-                allow_agent=False
-            )
-            
-            # Obtener comando específico para el dispositivo
-            comando = self._obtener_comando_backup(dispositivo)
-            self._log(f"Ejecutando comando: {comando}")
-            
-            # Ejecutar comando y obtener configuración
-            configuracion = self._ejecutar_comando_ssh(ssh, comando)
-            
-            if not configuracion:
-                raise Exception("El comando no devolvió resultados")
+            # Comandos del perfil del dispositivo, todos en la misma sesión
+            perfil = perfil_para(dispositivo)
+            comandos = self._comandos_a_capturar(perfil)
+            ajustes = self.transporte.elegir(dispositivo) if self.transporte else None
+            with self._sesion_ssh(dispositivo, timeout, ajustes) as ssh:
+                # Solo las conexiones nuevas (no las reutilizadas del pool) traen su duración
+                latencia = vars(ssh).pop("duracion_conexion", None)
+                huella = self._sondear_cambios(ssh, perfil, dispositivo)
+                if huella and not forzar and self.huellas.sin_cambios(dispositivo.id, perfil.sonda_cambios, huella):
+                    capturas = None
+                else:
+                    self._log(f"Ejecutando comando{'s' if len(comandos) > 1 else ''}: {', '.join(comandos)}")
+                    
+                    # Ejecutar comandos y volcar las salidas a disco
+                    inicio_descarga = time.monotonic()
+                    capturas = self._capturar(ssh, perfil, comandos, dispositivo)
+                    if self.transporte:
+                        self.transporte.registrar(dispositivo.id, ajustes, sum(t for _, _, t in capturas),
+                                                  time.monotonic() - inicio_descarga)
             
-            # Guardar backup localmente
-            archivo_backup = self._generar_nombre_backup(dispositivo)
-            with open(archivo_backup, 'w', encoding='utf-8') as f:
-                f.write(configuracion)
+            if capturas is None:
+                self._log(f"Sin cambios en {dispositivo.nombre} desde el último backup; no se descarga")
+                if self.cortacircuitos:
+                    self.cortacircuitos.registrar_exito(dispositivo, latencia)
+                return SIN_CAMBIOS
+            return CapturaBackup(dispositivo, perfil, capturas, huella, latencia, time.perf_counter())
+        except Exception as e:
+            return self._estado_por_error(dispositivo, e)
+    
+    def _completar_backup(self, captura: CapturaBackup, postprocesar) -> str:
+        """
+        Guarda, indexa y aplica la retención a la captura. postprocesar() devuelve la
+        configuración ya normalizada (ver procesar_captura), calculada en el pool o en este hilo
+        """
+        dispositivo = captura.dispositivo
+        try:
+            temporales = [ruta for _, ruta, _ in captura.capturas]
+            try:
+                temporal, tamano, hash_contenido, comprimida = postprocesar()
+                temporales += [temporal, comprimida]
+                if self.metricas or self.logger.isEnabledFor(logging.DEBUG):
+                    # Desde el fin de la descarga: incluye la espera en la cola del pool
+                    self._registrar_fase("postproceso", dispositivo, time.perf_counter() - captura.fin_descarga)
+                if not tamano:
+                    raise Exception("El comando no devolvió resultados")
+                
+                with self._medir("escritura", dispositivo):
+                    if comprimida:
+                        archivo_backup = self.almacen.guardar_comprimido(dispositivo, comprimida, tamano)
+                    elif hasattr(self.almacen, "guardar_normalizado"):
+                        # Ya normalizada y con su hash: el almacén no la vuelve a procesar
+                        archivo_backup = self.almacen.guardar_normalizado(dispositivo, temporal, tamano,
+                                                                          hash_contenido)
+                    elif self.almacen:
+                        archivo_backup = self.almacen.guardar_archivo(dispositivo, temporal)
+                    else:
+                        # Guardar backup localmente (el renombrado es atómico)
+                        archivo_backup = self._generar_nombre_backup(dispositivo)
+                        os.replace(temporal, archivo_backup)
+                        if self.catalogo:
+                            self.catalogo.registrar(dispositivo.id, archivo_backup, time.time(), tamano, hash_contenido)
+                
+                if self.indice:
+                    # El texto normalizado sigue en el temporal, salvo que el almacén se lo haya quedado
+                    legible = temporal if os.path.exists(temporal) else archivo_backup
+                    with self._medir("indexado", dispositivo):
+                        self._indexar(dispositivo, legible, hash_contenido)
+                
+                if len(captura.capturas) > 1:
+                    self._guardar_artefactos(dispositivo, captura.capturas[1:])
+            finally:
+                for ruta in temporales:
+                    if ruta and os.path.exists(ruta):
+                        os.remove(ruta)
             
             self._log(f"Backup guardado en: {os.path.abspath(archivo_backup)}")
             
             # Limpiar backups antiguos
-            self._limpiar_backups_antiguos(dispositivo)
+            with self._medir("retencion", dispositivo):
+                if self.indice:
+                    self.indice.limpiar_antiguos(dispositivo)
+                if self.artefactos:
+                    self.artefactos.limpiar_antiguos(dispositivo)
+                if self.almacen:
+                    self.almacen.limpiar_antiguos(dispositivo)
+                elif self.catalogo:
+                    self._aplicar_retencion_catalogo(dispositivo)
+                else:
+                    self._limpiar_backups_antiguos(dispositivo)
             
-            return True
-            
-        except paramiko.AuthenticationException:
+            if captura.huella:
+                # La sonda se leyó antes de la descarga: si algo cambió entre medias, la próxima no coincidirá
+                self.huellas.guardar(dispositivo.id, captura.perfil.sonda_cambios, captura.huella)
+            if self.cortacircuitos:
+                self.cortacircuitos.registrar_exito(dispositivo, captura.latencia)
+            return EXITOSO
+        except Exception as e:
+            return self._estado_por_error(dispositivo, e)
+    
+    def _estado_por_error(self, dispositivo: Dispositivo, e: Exception) -> str:
+        """Registra el error del backup y devuelve su estado"""
+        if isinstance(e, PoolAgotado):
+            # Saturación propia: no cuenta como fallo del dispositivo ni ajusta su timeout de conexión
+            self._log(f"Omitido {dispositivo.nombre}: {str(e)}", level="warning")
+            return OMITIDO
+        if isinstance(e, paramiko.AuthenticationException):
             self._log(f"Error de autenticación en {dispositivo.nombre}", level="error")
-            return False
-        except paramiko.SSHException as e:
+            return self._registrar_fallo(dispositivo, ERROR_AUTH, FALLIDO)
+        if isinstance(e, socket.timeout):
+            self._log(f"Tiempo de espera agotado en {dispositivo.nombre}", level="error")
+            return self._registrar_fallo(dispositivo, ERROR_TIMEOUT, TIMEOUT)
+        if isinstance(e, paramiko.SSHException):
             self._log(f"Error SSH en {dispositivo.nombre}: {str(e)}", level="error")
-            return False
+            return self._registrar_fallo(dispositivo, ERROR_SSH, FALLIDO)
+        self._log(f"Error inesperado en {dispositivo.nombre}: {str(e)}", level="error")
+        rechazado = isinstance(e, (ConnectionRefusedError, paramiko.ssh_exception.NoValidConnectionsError))
+        return self._registrar_fallo(dispositivo, ERROR_RECHAZADO if rechazado else ERROR_OTRO, FALLIDO)
+    
+    def _sondear_cambios(self, ssh, perfil: PerfilDispositivo, dispositivo: Dispositivo):
+        """Huella de la salida de la sonda de cambios del perfil, o None si no hay sonda o falló"""
+        if not self.huellas or not perfil.sonda_cambios or dispositivo.id is None:
+            return None
+        salida = io.BytesIO()
+        try:
+            with self._medir("sonda", dispositivo):
+                self._ejecutar_comando_ssh(ssh, perfil.sonda_cambios, salida)
+        except (socket.timeout, paramiko.SSHException):
+            raise
         except Exception as e:
-            self._log(f"Error inesperado en {dispositivo.nombre}: {str(e)}", level="error")
-            return False
+            # Una sonda que el equipo no entiende no impide el backup completo
+            self._log(f"Sonda de cambios fallida en {dispositivo.nombre}: {str(e)}", level="error")
+            return None
+        if not salida.getvalue().strip():
+            return None
+        return self.huellas.calcular(salida.getvalue())
+    
+    def _registrar_fallo(self, dispositivo: Dispositivo, clase: str, estado: str) -> str:
+        if self.cortacircuitos:
+            try:
+                self.cortacircuitos.registrar_fallo(dispositivo, clase)
+            except Exception as e:
+                self._log(f"Error registrando el fallo de {dispositivo.nombre}: {str(e)}", level="error")
+        return estado
+    
+    def _sondear_puerto(self, dispositivo: Dispositivo, timeout: float):
+        """Conexión TCP al puerto SSH. Devuelve None si responde o el estado del fallo, ya registrado"""
+        try:
+            socket.create_connection((dispositivo.ip, dispositivo.puerto_ssh), timeout=timeout).close()
+            return None
+        except socket.timeout:
+            self._log(f"{dispositivo.nombre} sigue sin responder", level="error")
+            return self._registrar_fallo(dispositivo, ERROR_TIMEOUT, TIMEOUT)
+        except ConnectionRefusedError:
+            self._log(f"{dispositivo.nombre} sigue rechazando conexiones", level="error")
+            return self._registrar_fallo(dispositivo, ERROR_RECHAZADO, FALLIDO)
+        except OSError as e:
+            self._log(f"{dispositivo.nombre} sigue inalcanzable: {str(e)}", level="error")
+            return self._registrar_fallo(dispositivo, ERROR_OTRO, FALLIDO)
+    
+    @contextmanager
+    def _sesion_ssh(self, dispositivo: Dispositivo, timeout: float = TIMEOUT_CONEXION,
+                    ajustes: AjustesTransporte = None):
+        """Entrega una conexión SSH al dispositivo con esos ajustes de transporte, del pool si está configurado"""
+        if self.pool:
+            with ExitStack() as pila:
+                with self._medir("sesion_pool", dispositivo):
+                    ssh = pila.enter_context(self.pool.sesion(dispositivo, timeout=timeout, ajustes=ajustes))
+                yield ssh
+            return
+        
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            inicio = time.monotonic()
+            # La conexión TCP se abre aparte para medirla por separado del intercambio de claves y la autenticación
+            with self._medir("tcp", dispositivo):
+                sock = socket.create_connection((dispositivo.ip, dispositivo.puerto_ssh), timeout=timeout)
+            with self._medir("negociacion_ssh", dispositivo):
+                conectar(ssh, dispositivo, ajustes, timeout, sock=sock)
+            ssh.duracion_conexion = time.monotonic() - inicio
+            yield ssh
         finally:
             try:
-                if 'ssh' in locals():
-                    ssh.close()
+                ssh.close()
             except Exception:
                 pass
     
+    def _indexar(self, dispositivo: Dispositivo, ruta: str, hash_contenido: str) -> None:
+        """Actualiza el índice de búsqueda; un fallo aquí no invalida el backup"""
+        try:
+            self.indice.indexar_archivo(dispositivo, ruta, hash_contenido)
+        except Exception as e:
+            self._log(f"Error indexando backup de {dispositivo.nombre}: {str(e)}", level="error")
+    
+    def _guardar_artefactos(self, dispositivo: Dispositivo, capturas: list) -> None:
+        """Guarda la salida de los comandos adicionales; un fallo aquí no invalida el backup"""
+        fecha = time.time()
+        for comando, ruta, _ in capturas:
+            try:
+                self.artefactos.guardar_archivo(dispositivo, comando, ruta, fecha)
+            except Exception as e:
+                self._log(f"Error guardando '{comando}' de {dispositivo.nombre}: {str(e)}", level="error")
+    
+    def _aplicar_retencion_catalogo(self, dispositivo: Dispositivo) -> None:
+        """Elimina los backups que el catálogo marca como vencidos, sin recorrer el directorio"""
+        try:
+            for ruta in self.catalogo.aplicar_retencion(dispositivo.id):
+                try:
+                    os.remove(ruta)
+                    self._log(f"Eliminado backup antiguo: {os.path.basename(ruta)}")
+                except FileNotFoundError:
+                    pass
+        except Exception as e:
+            self._log(f"Error limpiando backups: {str(e)}", level="error")
+    
     def _limpiar_backups_antiguos(self, dispositivo: Dispositivo, dias_retencion: int = 30) -> None:
         """Elimina backups más antiguos que el período de retención"""
         try:
-            prefix = f"backup_{dispositivo.nombre}_"
+            nombre_limpio = limpiar_nombre(dispositivo.nombre)
             fecha_limite = datetime.now() - timedelta(days=dias_retencion)
             
             for archivo in os.listdir(self.backup_dir):
-                if archivo.startswith(prefix):
+                coincidencia = PATRON_BACKUP_PLANO.match(archivo)
+                if coincidencia and coincidencia.group(1) == nombre_limpio:
                     ruta_completa = os.path.join(self.backup_dir, archivo)
                     fecha_archivo = datetime.fromtimestamp(os.path.getctime(ruta_completa))
                     
@@ -129,14 +592,11 @@ class BackupManager:
         except Exception as e:
             self._log(f"Error limpiando backups: {str(e)}", level="error")
     
-    def _log(self, mensaje: str, level: str = "info") -> None:
-        """Registra mensajes en log y consola"""
+    def _log(self, mensaje: str, level: str = "info", **campos) -> None:
+        """
+        Registra el mensaje (en el archivo y, si está activada, en consola). Los campos
+        (fase, duracion, estado...) van como claves propias del registro JSON
+        """
         log_func = getattr(self.logger, level.lower(), self.logger.info)
-        log_func(mensaje)
-        
-        # Formato especial para consola
-        if level == "error":
-            print(f"[!] {mensaje}")
-        else:
-            print(f"[*] {mensaje}")
+        log_func(mensaje, extra=campos or None)
             
@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import paramiko
+from dispositivo import COLUMNAS_DISPOSITIVO, Dispositivo, DispositivoDAO
+from pool_ssh import PoolSesionesSSH
+from transporte_ssh import TransporteDispositivos
+
+SSH_OK = "ssh_ok"
+ALCANZABLE = "alcanzable"  # responde con banner SSH; no se comprobó la autenticación
+AUTH_FALLIDA = "auth_fallida"
+SIN_SSH = "sin_ssh"  # el puerto acepta conexiones pero no presenta banner SSH
+RECHAZADO = "rechazado"
+INALCANZABLE = "inalcanzable"
+ERROR = "error"
+
+
+async def sondear_ssh(ip: str, puerto: int, timeout: float) -> tuple:
+    """
+    Conexión TCP al puerto y lectura del banner SSH.
+    Devuelve (estado, latencia_ms de la conexión TCP, detalle)
+    """
+    inicio = time.perf_counter()
+    try:
+        lector, escritor = await asyncio.wait_for(asyncio.open_connection(ip, puerto), timeout)
+    except asyncio.TimeoutError:
+        return INALCANZABLE, None, f"Sin respuesta en {timeout}s"
+    except ConnectionRefusedError:
+        return RECHAZADO, (time.perf_counter() - inicio) * 1000, "Conexión rechazada"
+    except OSError as e:
+        return INALCANZABLE, None, str(e)
+    latencia = (time.perf_counter() - inicio) * 1000
+    try:
+        # El servidor puede enviar alguna línea antes del banner (RFC 4253, 4.2)
+        for _ in range(5):
+            linea = await asyncio.wait_for(lector.readline(), timeout)
+            if not linea:
+                break
+            if linea.startswith(b"SSH-"):
+                return ALCANZABLE, latencia, linea.decode('ascii', errors='replace').strip()
+        return SIN_SSH, latencia, "El puerto no presenta banner SSH"
+    except (asyncio.TimeoutError, OSError):
+        return SIN_SSH, latencia, "El puerto no presenta banner SSH"
+    finally:
+        escritor.close()
+
+
+class BarridoAlcanzabilidad:
+    """
+    Comprueba la alcanzabilidad de muchos dispositivos a la vez: primero una conexión
+    TCP asíncrona al puerto SSH con alta concurrencia y, solo para los que responden
+    con banner SSH, la autenticación. Los resultados se guardan en el DAO
+    """
+
+    def __init__(self, dao: DispositivoDAO, pool: PoolSesionesSSH = None, concurrencia_tcp: int = 500,
+                 concurrencia_ssh: int = 32, timeout_tcp: float = 2, timeout_ssh: float = 10,
+                 verificar_auth: bool = True, transporte: TransporteDispositivos = None):
+        if concurrencia_tcp < 1 or concurrencia_ssh < 1:
+            raise ValueError("La concurrencia debe ser mayor que 0")
+        self.dao = dao
+        self.pool = pool or PoolSesionesSSH(max_sesiones=concurrencia_ssh)
+        self.concurrencia_tcp = concurrencia_tcp
+        self.concurrencia_ssh = concurrencia_ssh
+        self.timeout_tcp = timeout_tcp
+        self.timeout_ssh = timeout_ssh
+        self.verificar_auth = verificar_auth
+        self.transporte = transporte  # Para autenticar con la clave o los algoritmos de cada dispositivo
+
+    def ejecutar(self, dispositivos: list[Dispositivo] = None, al_progresar=None) -> dict:
+        """
+        Barre los dispositivos indicados (por defecto todos). al_progresar(dispositivo, estado, latencia_ms)
+        se llama desde el hilo del barrido según se conoce el resultado final de cada dispositivo.
+        Devuelve {dispositivo_id: (estado, latencia_ms, detalle)}
+        """
+        if dispositivos is None:
+            dispositivos = self.dao.obtener_todos()
+        notificar = al_progresar or (lambda dispositivo, estado, latencia: None)
+        resultados = asyncio.run(self._sondear_todos(dispositivos, notificar))
+
+        alcanzables = [d for d in dispositivos if resultados[d.id][0] == ALCANZABLE]
+        if self.verificar_auth and alcanzables:
+            with ThreadPoolExecutor(max_workers=self.concurrencia_ssh) as ejecutor:
+                for dispositivo, (estado, detalle) in zip(alcanzables, ejecutor.map(self._autenticar, alcanzables)):
+                    latencia = resultados[dispositivo.id][1]
+                    resultados[dispositivo.id] = (estado, latencia, detalle)
+                    notificar(dispositivo, estado, latencia)
+
+        ahora = time.time()
+        self.dao.guardar_alcanzabilidad([(id_dispositivo, ahora, *resultado)
+                                         for id_dispositivo, resultado in resultados.items()])
+        return resultados
+
+    async def _sondear_todos(self, dispositivos, notificar):
+        semaforo = asyncio.Semaphore(self.concurrencia_tcp)
+
+        async def sondear(dispositivo):
+            async with semaforo:
+                try:
+                    resultado = await sondear_ssh(dispositivo.ip, dispositivo.puerto_ssh, self.timeout_tcp)
+                except Exception as e:
+                    resultado = (ERROR, None, str(e))
+            # Los alcanzables se notifican tras comprobar la autenticación
+            if resultado[0] != ALCANZABLE or not self.verificar_auth:
+                notificar(dispositivo, resultado[0], resultado[1])
+            return dispositivo.id, resultado
+
+        return dict(await asyncio.gather(*(sondear(d) for d in dispositivos)))
+
+    def _autenticar(self, dispositivo: Dispositivo) -> tuple:
+        try:
+            ajustes = self.transporte.ajustes(dispositivo.id) if self.transporte else None
+            with self.pool.sesion(dispositivo, timeout=self.timeout_ssh, ajustes=ajustes):
+                pass
+            return SSH_OK, "Autenticación correcta"
+        except paramiko.AuthenticationException:
+            return AUTH_FALLIDA, "Credenciales rechazadas"
+        except Exception as e:
+            return ERROR, str(e) or type(e).__name__
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comprueba la alcanzabilidad SSH de los dispositivos")
+    parser.add_argument("--db", default="dispositivos.db", help="Ruta de la base de datos de dispositivos")
+    parser.add_argument("--tipo", help="Solo dispositivos de este tipo")
+    parser.add_argument("--frecuencia", help="Solo dispositivos con esta frecuencia de backup")
+    parser.add_argument("--sin-auth", action="store_true", help="Solo conexión TCP y banner, sin autenticar")
+    parser.add_argument("--concurrencia", type=int, default=500, help="Conexiones TCP simultáneas")
+    parser.add_argument("--timeout", type=float, default=2, help="Timeout de la conexión TCP en segundos")
+    parser.add_argument("--fallidos", action="store_true", help="Lista los dispositivos que no respondieron bien")
+    args = parser.parse_args()
+
+    dao = DispositivoDAO(args.db, persistente=True)
+    try:
+        dispositivos = list(dao.iterar(COLUMNAS_DISPOSITIVO, tipo=args.tipo or "", frecuencia=args.frecuencia or ""))
+        barrido = BarridoAlcanzabilidad(dao, concurrencia_tcp=args.concurrencia, timeout_tcp=args.timeout,
+                                        verificar_auth=not args.sin_auth, transporte=TransporteDispositivos(args.db))
+        inicio = time.monotonic()
+        resultados = barrido.ejecutar(dispositivos)
+        duracion = time.monotonic() - inicio
+        barrido.pool.cerrar_todo()
+    finally:
+        dao.cerrar()
+
+    if args.fallidos:
+        for d in dispositivos:
+            estado, _, detalle = resultados[d.id]
+            if estado not in (SSH_OK, ALCANZABLE):
+                print(f"{d.nombre} ({d.ip}:{d.puerto_ssh}): {estado} - {detalle}")
+    conteo = Counter(estado for estado, _, _ in resultados.values())
+    print(f"[*] {len(dispositivos)} dispositivos en {duracion:.1f}s: "
+          + ", ".join(f"{total} {estado}" for estado, total in conteo.most_common()))
+
+
+if __name__ == "__main__":
+    main()
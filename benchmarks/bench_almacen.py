@@ -0,0 +1,119 @@
+"""
+Compara el almacenamiento plano (un .cfg por backup) con los paquetes comprimidos:
+espacio en disco, número de archivos y rendimiento de escritura y lectura aleatoria.
+
+    python benchmarks/bench_almacen.py --dispositivos 50 --versiones 30
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from almacen_backups import limpiar_nombre
+from almacen_comprimido import AlmacenComprimido
+from dispositivo import Dispositivo
+
+
+def generar_configuracion(rng: random.Random, lineas: int) -> list[str]:
+    config = ["hostname router", "!"]
+    for i in range(lineas // 6):
+        config += [
+            f"interface GigabitEthernet0/{i}",
+            f" description enlace-{rng.randint(1, 9999)}",
+            f" ip address 10.{i % 256}.{rng.randint(0, 255)}.1 255.255.255.0",
+            " no shutdown",
+            "!",
+            f"vlan {i + 1}",
+        ]
+    return config
+
+
+def versiones_dispositivo(rng: random.Random, lineas: int, versiones: int):
+    """Genera versiones sucesivas que cambian unas pocas líneas cada vez"""
+    config = generar_configuracion(rng, lineas)
+    for _ in range(versiones):
+        for _ in range(rng.randint(0, 3)):
+            config[rng.randrange(len(config))] = f" description cambio-{rng.randint(1, 99999)}"
+        yield "\n".join(config) + "\n"
+
+
+def tamano_directorio(directorio: str) -> tuple[int, int]:
+    total = archivos = 0
+    for raiz, _, nombres in os.walk(directorio):
+        for nombre in nombres:
+            total += os.path.getsize(os.path.join(raiz, nombre))
+            archivos += 1
+    return total, archivos
+
+
+def medir(nombre, escribir, leer, directorio, datos_totales, lecturas):
+    inicio = time.perf_counter()
+    escribir()
+    t_escritura = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    leidos = sum(len(leer(d, v)) for d, v in lecturas)
+    t_lectura = time.perf_counter() - inicio
+
+    tamano, archivos = tamano_directorio(directorio)
+    print(f"{nombre:<14} {tamano / 1e6:>10.2f} MB {archivos:>9} archivos "
+          f"{datos_totales / 1e6 / t_escritura:>9.1f} MB/s escr. {leidos / 1e6 / t_lectura:>9.1f} MB/s lect.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dispositivos", type=int, default=50)
+    parser.add_argument("--versiones", type=int, default=30)
+    parser.add_argument("--lineas", type=int, default=3000, help="Líneas por configuración")
+    parser.add_argument("--lecturas", type=int, default=200, help="Versiones leídas al azar")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    dispositivos = [Dispositivo(id=i + 1, nombre=f"router-{i + 1}") for i in range(args.dispositivos)]
+    historial = {d.id: list(versiones_dispositivo(rng, args.lineas, args.versiones)) for d in dispositivos}
+    datos_totales = sum(len(v.encode()) for versiones in historial.values() for v in versiones)
+    lecturas = [(rng.choice(dispositivos), rng.randrange(args.versiones)) for _ in range(args.lecturas)]
+    print(f"{args.dispositivos} dispositivos x {args.versiones} versiones = {datos_totales / 1e6:.2f} MB de configuraciones\n")
+
+    base = tempfile.mkdtemp(prefix="bench_almacen_")
+    try:
+        directorio = os.path.join(base, "plano")
+        os.makedirs(directorio)
+        rutas = {}
+
+        def escribir_plano():
+            for d in dispositivos:
+                for v, config in enumerate(historial[d.id]):
+                    ruta = os.path.join(directorio, f"backup_{limpiar_nombre(d.nombre)}_{v:08d}_000000.cfg")
+                    with open(ruta, 'w', encoding='utf-8') as f:
+                        f.write(config)
+                    rutas[d.id, v] = ruta
+
+        def leer_plano(d, v):
+            with open(rutas[d.id, v], 'rb') as f:
+                return f.read()
+
+        medir("plano", escribir_plano, leer_plano, directorio, datos_totales, lecturas)
+
+        for codec in ("zlib", "lzma"):
+            directorio = os.path.join(base, codec)
+            almacen = AlmacenComprimido(directorio, codec=codec)
+
+            def escribir_paquetes():
+                for d in dispositivos:
+                    for v, config in enumerate(historial[d.id]):
+                        almacen.guardar(d, config, fecha=v + 1)
+
+            medir(f"paquete-{codec}", escribir_paquetes, lambda d, v: almacen.leer_version(d.id, v),
+                  directorio, datos_totales, lecturas)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
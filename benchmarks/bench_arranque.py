@@ -0,0 +1,112 @@
+"""
+Mide el tiempo de arranque: la importación de cada punto de entrada sin interfaz
+(que no debe cargar ninguna biblioteca gráfica) y, si hay pantalla, el tiempo hasta
+que la interfaz es usable y hasta que terminan de cargarse los servicios de backup.
+
+    python benchmarks/bench_arranque.py --repeticiones 5
+
+Termina con código 1 si algún punto de entrada sin interfaz importa tkinter, PIL o ttkbootstrap.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIN_INTERFAZ = ["programador", "inventario", "barrido", "catalogo_backups", "indice_busqueda",
+                "almacen_backups", "metricas"]
+MODULOS_GRAFICOS = ("tkinter", "_tkinter", "PIL", "ttkbootstrap")
+
+IMPORTAR = """
+import json, sys, time
+inicio = time.perf_counter()
+import {modulo}
+print(json.dumps({{"segundos": time.perf_counter() - inicio,
+                  "graficos": sorted(m for m in sys.modules if m.split(".")[0] in {graficos!r})}}))
+"""
+
+INTERFAZ = """
+import json, sys, time
+inicio = time.perf_counter()
+import main
+import ttkbootstrap as tb
+root = tb.Window(themename="minty")
+root.withdraw()
+splash = main.mostrar_splash(root)
+splash.update()
+app = main.BackupApp(root)
+splash.destroy()
+root.deiconify()
+root.update()
+interactiva = time.perf_counter() - inicio
+app._servicios.result()
+print(json.dumps({"interactiva": interactiva, "servicios": time.perf_counter() - inicio}))
+root.destroy()
+"""
+
+
+def ejecutar(codigo: str, directorio: str) -> tuple[float, dict]:
+    """Lanza un intérprete nuevo; devuelve (segundos de pared totales, JSON que imprimió)"""
+    inicio = time.perf_counter()
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=directorio, capture_output=True, text=True,
+                            env={**os.environ, "PYTHONPATH": RAIZ})
+    total = time.perf_counter() - inicio
+    if salida.returncode != 0:
+        raise RuntimeError(salida.stderr.strip().splitlines()[-1] if salida.stderr.strip() else "sin salida")
+    return total, json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def hay_pantalla() -> bool:
+    return sys.platform in ("win32", "darwin") or bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="bench_arranque_")
+    violaciones = {}
+    try:
+        print(f"{'punto de entrada':<20} {'importación':>12} {'proceso':>10}")
+        for modulo in SIN_INTERFAZ:
+            importaciones, procesos = [], []
+            for _ in range(args.repeticiones):
+                try:
+                    total, datos = ejecutar(IMPORTAR.format(modulo=modulo, graficos=MODULOS_GRAFICOS), directorio)
+                except RuntimeError as e:
+                    print(f"{modulo:<20} no se pudo importar: {e}")
+                    break
+                importaciones.append(datos["segundos"])
+                procesos.append(total)
+                if datos["graficos"]:
+                    violaciones[modulo] = datos["graficos"]
+            else:
+                print(f"{modulo:<20} {statistics.median(importaciones) * 1000:>10.0f}ms "
+                      f"{statistics.median(procesos) * 1000:>8.0f}ms")
+
+        if hay_pantalla():
+            interactiva, servicios = [], []
+            for _ in range(args.repeticiones):
+                total, datos = ejecutar(INTERFAZ, directorio)
+                interactiva.append(datos["interactiva"])
+                servicios.append(datos["servicios"])
+            print(f"\nInterfaz usable en {statistics.median(interactiva) * 1000:.0f}ms; "
+                  f"servicios de backup cargados en {statistics.median(servicios) * 1000:.0f}ms (medianas)")
+        else:
+            print("\nSin pantalla: se omite la medición de la interfaz gráfica")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    for modulo, graficos in violaciones.items():
+        print(f"[!] {modulo} importa bibliotecas gráficas: {', '.join(graficos)}")
+    sys.exit(1 if violaciones else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Reparte una granja de dispositivos simulados (ver bench_granja.py) entre varios
+procesos colectores que comparten la cola de trabajos de la misma base de datos,
+y comprueba que cada dispositivo se respalda una sola vez en el ciclo. Con --matar
+se mata (SIGKILL) un colector a mitad de la ejecución: sus trabajos deben pasar a
+los demás cuando venza el arriendo.
+
+    python benchmarks/bench_cola.py --dispositivos 300 --colectores 4
+    python benchmarks/bench_cola.py --colectores 3 --matar 2 --arriendo 5
+
+Termina con código 1 si algún dispositivo se queda sin su trabajo completado.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_manager import BackupManager
+from catalogo_backups import CatalogoBackups
+from cola_trabajos import HECHO, ColaTrabajos, ColectorCola
+from dispositivo import Dispositivo, DispositivoDAO
+from motor_backup import MotorBackup
+from pool_ssh import PoolSesionesSSH
+from registro import configurar_registro
+from bench_granja import PerfilSimulado, ejecutar_granja, generar_configuracion
+
+
+def ejecutar_colector(db_path: str, nodo: str, trabajadores: int, arriendo: float) -> None:
+    """Proceso colector: el mismo montaje que programador.py --cola, hasta recibir SIGTERM"""
+    configurar_registro(f"{nodo}.log", consola=False)
+    dao = DispositivoDAO(db_path, persistente=True)
+    manager = BackupManager(pool=PoolSesionesSSH(max_sesiones=trabajadores), catalogo=CatalogoBackups(db_path))
+    motor = MotorBackup(manager, dao, max_trabajadores=trabajadores, max_por_subred=trabajadores)
+    colector = ColectorCola(ColaTrabajos(db_path, duracion_arriendo=arriendo), dao, motor, nodo=nodo,
+                            intervalo=0.2, intervalo_encolar=2)
+    signal.signal(signal.SIGTERM, lambda *_: colector.detener())
+    colector.ejecutar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dispositivos", type=int, default=200)
+    parser.add_argument("--tamano", type=int, default=50_000, help="Bytes de configuración por dispositivo")
+    parser.add_argument("--latencia", type=float, default=0.2, help="Segundos que tarda el comando en responder")
+    parser.add_argument("--colectores", type=int, default=3)
+    parser.add_argument("--trabajadores", type=int, default=8, help="Backups simultáneos por colector")
+    parser.add_argument("--arriendo", type=float, default=10, help="Segundos de validez de un trabajo reclamado")
+    parser.add_argument("--matar", type=float, metavar="SEGUNDOS",
+                        help="Mata el primer colector pasados estos segundos")
+    parser.add_argument("--limite", type=float, default=300, help="Segundos máximos de espera")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    perfiles = [PerfilSimulado(configuracion=generar_configuracion(rng, args.tamano), latencia=args.latencia)
+                for _ in range(args.dispositivos)]
+    receptor, emisor = multiprocessing.Pipe(duplex=False)
+    granja = multiprocessing.Process(target=ejecutar_granja, args=(perfiles, emisor), daemon=True)
+    granja.start()
+    puertos = receptor.recv()
+
+    base = tempfile.mkdtemp(prefix="bench_cola_")
+    directorio_original = os.getcwd()
+    os.chdir(base)  # BackupManager escribe backups/ y un log por colector en el directorio actual
+    colectores = []
+    try:
+        db_path = os.path.join(base, "dispositivos.db")
+        dao = DispositivoDAO(db_path)
+        dao.guardar_muchos([Dispositivo(nombre=f"sim-{i + 1}", ip="127.0.0.1", usuario="admin", contraseña="admin",
+                                        tipo="Router", frecuencia_backup="Diario", puerto_ssh=puerto)
+                            for i, puerto in enumerate(puertos)])
+        cola = ColaTrabajos(db_path, duracion_arriendo=args.arriendo)
+        CatalogoBackups(db_path)  # Las tablas se crean antes de que los colectores compitan por ellas
+
+        inicio = time.monotonic()
+        for i in range(args.colectores):
+            colector = multiprocessing.Process(target=ejecutar_colector,
+                                               args=(db_path, f"colector-{i + 1}", args.trabajadores, args.arriendo))
+            colector.start()
+            colectores.append(colector)
+
+        matado = False
+        while time.monotonic() - inicio < args.limite:
+            if args.matar is not None and not matado and time.monotonic() - inicio >= args.matar:
+                os.kill(colectores[0].pid, signal.SIGKILL)
+                matado = True
+                print(f"colector-1 matado a los {time.monotonic() - inicio:.1f}s")
+            if cola.contar().get(HECHO, 0) >= args.dispositivos:
+                break
+            time.sleep(0.2)
+        duracion = time.monotonic() - inicio
+
+        with sqlite3.connect(db_path) as conn:
+            por_nodo = conn.execute(f'''SELECT nodo, COUNT(*) FROM trabajos_backup WHERE estado = '{HECHO}'
+                                        GROUP BY nodo ORDER BY nodo''').fetchall()
+            duplicados = conn.execute('''SELECT COUNT(*) FROM (SELECT dispositivo_id FROM catalogo_backups
+                                         GROUP BY dispositivo_id HAVING COUNT(*) > 1)''').fetchone()[0]
+        estados = cola.contar()
+        hechos = estados.get(HECHO, 0)
+        print(f"{hechos}/{args.dispositivos} trabajos completados en {duracion:.1f}s "
+              f"({hechos / duracion:.1f} disp/s); estados: {estados}")
+        for nodo, cantidad in por_nodo:
+            print(f"  {nodo:<12} {cantidad:>6}")
+        # Solo un colector muerto con un backup ya escrito pero sin completar puede provocar un segundo backup
+        print(f"Dispositivos respaldados más de una vez: {duplicados}")
+    finally:
+        for colector in colectores:
+            if colector.is_alive():
+                colector.terminate()
+        for colector in colectores:
+            colector.join(30)
+        os.chdir(directorio_original)
+        granja.terminate()
+        shutil.rmtree(base, ignore_errors=True)
+
+    sys.exit(0 if hechos >= args.dispositivos else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Mide el rendimiento de los backups contra una granja de dispositivos simulados:
+un servidor SSH local (paramiko.ServerInterface) con un puerto por dispositivo,
+tamaño de configuración y latencia del comando configurables, y una fracción de
+dispositivos que rechazan la autenticación o dejan la sesión colgada.
+
+    python benchmarks/bench_granja.py --dispositivos 200 --trabajadores 32 --tamano 200000
+    python benchmarks/bench_granja.py --fallos-auth 0.05 --colgados 0.02 --timeout-comando 5
+    python benchmarks/bench_granja.py --rondas 2 --detectar-cambios
+
+La granja corre en otro proceso para que el RSS y el GIL medidos sean solo los del colector.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import re
+import resource
+import selectors
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import paramiko
+
+from almacen_backups import AlmacenDeduplicado
+from almacen_comprimido import AlmacenComprimido
+from artefactos_backup import ArtefactosBackup
+from backup_manager import BackupManager
+from catalogo_backups import CatalogoBackups
+from dispositivo import Dispositivo, DispositivoDAO
+from huellas_configuracion import HuellasConfiguracion
+from motor_backup import MotorBackup
+from pool_ssh import PoolSesionesSSH
+from postproceso import PostprocesadorBackups
+from registro import configurar_registro
+
+TAMANO_ENVIO = 32 * 1024
+# Sin una espera mínima el canal podría cerrarse antes de que paramiko confirme la petición exec
+ESPERA_MINIMA = 0.01
+
+
+@dataclass
+class PerfilSimulado:
+    configuracion: bytes
+    latencia: float = 0.0  # Segundos antes de empezar a responder al comando
+    falla_auth: bool = False
+    colgado: bool = False  # Acepta el comando y nunca responde ni cierra el canal
+    ancho_banda: float = 0.0  # Bytes/s de bajada del enlace simulado (0 = sin límite)
+    retardo: float = 0.0  # Segundos que tarda en llegar a la granja lo que envía el colector
+
+
+class EnlaceSimulado:
+    """
+    Socket de la granja tras un enlace WAN: lo que envía sale a `ancho_banda` bytes/s
+    (ya cifrado y, si se negoció, comprimido) y lo que recibe llega `retardo` segundos
+    tarde, así los WINDOW_ADJUST del colector se retrasan como con ese RTT
+    """
+
+    def __init__(self, sock: socket.socket, ancho_banda: float = 0.0, retardo: float = 0.0):
+        self._sock = sock
+        self.ancho_banda = ancho_banda
+        self.retardo = retardo
+        self._libre = 0.0  # Instante en que el enlace termina de enviar lo anterior
+        self._timeout = None
+        self._pendiente = b""
+        self._recibidos = queue.Queue()
+        # El socket real queda bloqueante: lo lee este hilo y los envíos no se cortan a medias por el timeout
+        threading.Thread(target=self._leer, daemon=True).start()
+
+    def __getattr__(self, nombre):
+        return getattr(self._sock, nombre)
+
+    def _leer(self):
+        while True:
+            try:
+                datos = self._sock.recv(TAMANO_ENVIO)
+            except OSError:
+                datos = b""
+            self._recibidos.put((time.monotonic() + self.retardo, datos))
+            if not datos:
+                return
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def recv(self, n):
+        if not self._pendiente:
+            try:
+                llegada, datos = self._recibidos.get(timeout=self._timeout)
+            except queue.Empty:
+                raise socket.timeout()
+            if not datos:
+                self._recibidos.put((0, b""))  # Las siguientes lecturas también ven el cierre
+                return b""
+            time.sleep(max(llegada - time.monotonic(), 0))
+            self._pendiente = datos
+        datos, self._pendiente = self._pendiente[:n], self._pendiente[n:]
+        return datos
+
+    def send(self, datos):
+        datos = bytes(datos[:TAMANO_ENVIO])
+        if self.ancho_banda:
+            ahora = time.monotonic()
+            self._libre = max(self._libre, ahora) + len(datos) / self.ancho_banda
+            time.sleep(self._libre - ahora)
+        self._sock.sendall(datos)
+        return len(datos)
+
+
+class ServidorSimulado(paramiko.ServerInterface):
+    def __init__(self, perfil: PerfilSimulado):
+        self.perfil = perfil
+
+    def get_allowed_auths(self, username):
+        return "publickey,password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_FAILED if self.perfil.falla_auth else paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_FAILED if self.perfil.falla_auth else paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        if not self.perfil.colgado:
+            threading.Thread(target=self._responder, args=(channel, command), daemon=True).start()
+        return True
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        if not self.perfil.colgado:
+            threading.Thread(target=self._shell, args=(channel,), daemon=True).start()
+        return True
+
+    def _enviar_configuracion(self, canal, separador=b"\n"):
+        time.sleep(max(self.perfil.latencia, ESPERA_MINIMA))
+        datos = memoryview(self.perfil.configuracion.replace(b"\n", separador))
+        for inicio in range(0, len(datos), TAMANO_ENVIO):
+            canal.sendall(datos[inicio:inicio + TAMANO_ENVIO])
+
+    def _responder(self, canal, comando):
+        try:
+            if b"| include " in comando:
+                # Sonda de cambios: solo las líneas que coinciden
+                time.sleep(max(self.perfil.latencia, ESPERA_MINIMA))
+                patron = re.compile(comando.split(b"| include ", 1)[1].strip())
+                canal.sendall(b"".join(linea for linea in self.perfil.configuracion.splitlines(keepends=True)
+                                       if patron.search(linea)))
+            else:
+                self._enviar_configuracion(canal)
+            canal.send_exit_status(0)
+        except Exception:
+            pass
+        finally:
+            canal.close()
+
+    def _shell(self, canal):
+        """CLI mínima al estilo IOS: eco de cada comando, salida con CRLF y prompt"""
+        try:
+            canal.sendall(b"Acceso autorizado\r\n\r\nsim#")
+            linea = b""
+            while True:
+                datos = canal.recv(1024)
+                if not datos:
+                    break
+                linea += datos
+                while b"\n" in linea:
+                    comando, linea = linea.split(b"\n", 1)
+                    comando = comando.strip()
+                    canal.sendall(comando + b"\r\n")
+                    if comando == b"show running-config":
+                        self._enviar_configuracion(canal, b"\r\n")
+                    elif comando.startswith(b"show "):
+                        canal.sendall(b"Simulado " + comando[5:] + b" 1.0\r\n")
+                    canal.sendall(b"sim#")
+        except Exception:
+            pass
+        finally:
+            canal.close()
+
+
+def generar_configuracion(rng: random.Random, tamano: int) -> bytes:
+    lineas = [f"! Last configuration change at 10:{rng.randint(0, 59):02d}:00 UTC by admin", "hostname simulado", "!"]
+    total = 0
+    i = 0
+    while total < tamano:
+        bloque = (f"interface GigabitEthernet0/{i}\n description enlace-{rng.randint(1, 9999)}\n"
+                  f" ip address 10.{i % 256}.{rng.randint(0, 255)}.1 255.255.255.0\n no shutdown\n!")
+        lineas.append(bloque)
+        total += len(bloque) + 1
+        i += 1
+    return ("\n".join(lineas) + "\n").encode()
+
+
+def ejecutar_granja(perfiles: list[PerfilSimulado], conexion) -> None:
+    """Proceso de la granja: un socket de escucha por dispositivo; envía los puertos y atiende hasta morir"""
+    # Las conexiones que se cierran sin negociar (sondeos TCP) no son errores de la granja
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    clave = paramiko.RSAKey.generate(2048)
+    selector = selectors.DefaultSelector()
+    puertos = []
+    for perfil in perfiles:
+        servidor = socket.socket()
+        servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        servidor.bind(("127.0.0.1", 0))
+        servidor.listen(64)
+        selector.register(servidor, selectors.EVENT_READ, perfil)
+        puertos.append(servidor.getsockname()[1])
+    conexion.send(puertos)
+
+    while True:
+        for clave_selector, _ in selector.select():
+            cliente, _ = clave_selector.fileobj.accept()
+            perfil = clave_selector.data
+            if perfil.ancho_banda or perfil.retardo:
+                cliente = EnlaceSimulado(cliente, perfil.ancho_banda, perfil.retardo)
+            transporte = paramiko.Transport(cliente)
+            transporte.add_server_key(clave)
+            transporte.use_compression(True)  # Solo se comprime si el colector lo pide
+            try:
+                transporte.start_server(server=ServidorSimulado(perfil))
+            except Exception:
+                transporte.close()
+
+
+def percentil(valores: list[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def contar_archivos(directorio: str) -> int:
+    return sum(len(nombres) for _, _, nombres in os.walk(directorio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dispositivos", type=int, default=100)
+    parser.add_argument("--tamano", type=int, default=100_000, help="Bytes de configuración por dispositivo")
+    parser.add_argument("--variacion-tamano", type=float, default=0.5,
+                        help="Variación relativa del tamaño entre dispositivos (0 = todos iguales)")
+    parser.add_argument("--latencia", type=float, default=0.05, help="Segundos que tarda el comando en responder")
+    parser.add_argument("--fallos-auth", type=float, default=0.0, help="Fracción de dispositivos que rechazan la clave")
+    parser.add_argument("--colgados", type=float, default=0.0, help="Fracción de dispositivos con la sesión colgada")
+    parser.add_argument("--trabajadores", type=int, default=32)
+    parser.add_argument("--por-subred", type=int, default=32,
+                        help="Backups simultáneos por subred (toda la granja está en 127.0.0.1)")
+    parser.add_argument("--timeout-comando", type=float, default=10)
+    parser.add_argument("--almacen", choices=["plano", "deduplicado", "comprimido"], default="plano")
+    parser.add_argument("--artefactos", action="store_true",
+                        help="Captura también show version y show inventory en un shell interactivo")
+    parser.add_argument("--detectar-cambios", action="store_true",
+                        help="Sondea la fecha del último cambio y no descarga las configuraciones que no cambiaron")
+    parser.add_argument("--procesos", type=int, default=0,
+                        help="Normaliza, calcula el hash y comprime en este número de procesos (0 = en los hilos)")
+    parser.add_argument("--rondas", type=int, default=1,
+                        help="Ejecuciones sobre la misma granja (la 2ª reutiliza el pool y, con --detectar-cambios, "
+                             "no descarga nada)")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    perfiles = []
+    for _ in range(args.dispositivos):
+        tamano = int(args.tamano * (1 + rng.uniform(-args.variacion_tamano, args.variacion_tamano)))
+        perfiles.append(PerfilSimulado(configuracion=generar_configuracion(rng, max(tamano, 1)),
+                                       latencia=args.latencia,
+                                       falla_auth=rng.random() < args.fallos_auth,
+                                       colgado=rng.random() < args.colgados))
+
+    receptor, emisor = multiprocessing.Pipe(duplex=False)
+    granja = multiprocessing.Process(target=ejecutar_granja, args=(perfiles, emisor), daemon=True)
+    granja.start()
+    puertos = receptor.recv()
+    datos_totales = sum(len(p.configuracion) for p in perfiles)
+    print(f"Granja: {args.dispositivos} dispositivos, {datos_totales / 1e6:.1f} MB de configuraciones, "
+          f"{sum(p.falla_auth for p in perfiles)} con fallo de auth, {sum(p.colgado for p in perfiles)} colgados\n")
+
+    base = tempfile.mkdtemp(prefix="bench_granja_")
+    directorio_original = os.getcwd()
+    os.chdir(base)  # BackupManager escribe backups/ y backup.log en el directorio actual
+    configurar_registro(consola=False)  # Solo el archivo: la consola es para los resultados
+    try:
+        db_path = os.path.join(base, "dispositivos.db")
+        dao = DispositivoDAO(db_path, persistente=True)
+        dao.guardar_muchos([Dispositivo(nombre=f"sim-{i + 1}", ip="127.0.0.1", usuario="admin", contraseña="admin",
+                                        tipo="Router", frecuencia_backup="Diario", puerto_ssh=puerto)
+                            for i, puerto in enumerate(puertos)])
+        almacen = None
+        if args.almacen == "deduplicado":
+            almacen = AlmacenDeduplicado(db_path)
+        elif args.almacen == "comprimido":
+            almacen = AlmacenComprimido()
+        pool = PoolSesionesSSH(max_sesiones=args.trabajadores)
+        manager = BackupManager(pool=pool, almacen=almacen, catalogo=CatalogoBackups(db_path),
+                                timeout_comando=args.timeout_comando,
+                                artefactos=ArtefactosBackup(db_path) if args.artefactos else None,
+                                huellas=HuellasConfiguracion(db_path) if args.detectar_cambios else None,
+                                postproceso=PostprocesadorBackups(args.procesos) if args.procesos else None)
+
+        latencias = []
+        iniciar_backup = manager.iniciar_backup
+
+        def iniciar_medido(dispositivo, forzar=False):
+            # Hasta que el backup queda guardado, aunque el postproceso lo termine en otro hilo
+            inicio = time.perf_counter()
+            futuro = iniciar_backup(dispositivo, forzar)
+            futuro.add_done_callback(lambda _: latencias.append(time.perf_counter() - inicio))
+            return futuro
+
+        manager.iniciar_backup = iniciar_medido
+        motor = MotorBackup(manager, dao, max_trabajadores=args.trabajadores, max_por_subred=args.por_subred)
+
+        print(f"{'ronda':<6} {'disp/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}  resultado")
+        for ronda in range(1, args.rondas + 1):
+            latencias.clear()
+            resumen = motor.respaldar_todos().esperar()
+            print(f"{ronda:<6} {resumen.procesados / resumen.duracion:>8.1f} "
+                  f"{percentil(latencias, 50):>7.3f}s {percentil(latencias, 95):>7.3f}s "
+                  f"{percentil(latencias, 99):>7.3f}s  {resumen}")
+
+        pool.cerrar_todo()
+        if manager.postproceso:
+            manager.postproceso.cerrar()
+        dao.cerrar()
+        pico_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss está en KiB en Linux
+        print(f"\nRSS pico del colector: {pico_rss:.0f} MiB; archivos en el almacén: {contar_archivos('backups')}")
+    finally:
+        os.chdir(directorio_original)
+        granja.terminate()
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
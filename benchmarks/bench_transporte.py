@@ -0,0 +1,110 @@
+"""
+Compara los ajustes de transporte SSH contra una granja simulada (ver bench_granja.py)
+detrás de enlaces WAN lentos: cada dispositivo tiene su propio enlace con el ancho de
+banda y el retardo indicados. Se respalda la granja varias rondas con cada modo:
+
+    base          sin ajustes (como siempre)
+    compresion    compresión zlib del transporte en todos los dispositivos
+    ventana       ventana de canal grande en todos los dispositivos
+    autoajuste    cada dispositivo prueba las variantes y se queda con la más rápida
+
+    python benchmarks/bench_transporte.py --dispositivos 20 --ancho-banda 256 --retardo 0.05
+    python benchmarks/bench_transporte.py --modos base autoajuste --rondas 8
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_manager import BackupManager
+from catalogo_backups import CatalogoBackups
+from dispositivo import Dispositivo, DispositivoDAO
+from motor_backup import MotorBackup
+from pool_ssh import PoolSesionesSSH
+from registro import configurar_registro
+from transporte_ssh import VENTANA_GRANDE, AjustesTransporte, TransporteDispositivos
+from bench_granja import PerfilSimulado, ejecutar_granja, generar_configuracion
+
+MODOS = ["base", "compresion", "ventana", "autoajuste"]
+
+
+def ejecutar_modo(modo: str, puertos: list[int], args) -> None:
+    """Respalda la granja `args.rondas` veces con los ajustes del modo, en una base de datos nueva"""
+    base = tempfile.mkdtemp(prefix=f"bench_transporte_{modo}_")
+    os.chdir(base)
+    try:
+        db_path = os.path.join(base, "dispositivos.db")
+        dao = DispositivoDAO(db_path, persistente=True)
+        dispositivos = [Dispositivo(nombre=f"sim-{i + 1}", ip="127.0.0.1", usuario="admin", contraseña="admin",
+                                    tipo="Router", frecuencia_backup="Diario", puerto_ssh=puerto)
+                        for i, puerto in enumerate(puertos)]
+        dao.guardar_muchos(dispositivos)
+        transporte = None
+        if modo != "base":
+            transporte = TransporteDispositivos(db_path, autoajuste=modo == "autoajuste",
+                                                muestras_minimas=args.muestras)
+            fijos = {"compresion": AjustesTransporte(compresion=True),
+                     "ventana": AjustesTransporte(tamano_ventana=VENTANA_GRANDE)}
+            if modo in fijos:
+                for dispositivo in dispositivos:
+                    transporte.guardar(dispositivo.id, fijos[modo])
+        pool = PoolSesionesSSH(max_sesiones=args.trabajadores)
+        manager = BackupManager(pool=pool, catalogo=CatalogoBackups(db_path), transporte=transporte)
+        motor = MotorBackup(manager, dao, max_trabajadores=args.trabajadores, max_por_subred=args.trabajadores)
+
+        for ronda in range(1, args.rondas + 1):
+            variantes = Counter(transporte.elegir(d).variante for d in dispositivos) if transporte else None
+            resumen = motor.respaldar_todos().esperar()
+            descripcion = ", ".join(f"{variante} x{n}" for variante, n in variantes.most_common()) if variantes else "-"
+            print(f"{modo:<11} {ronda:<6} {resumen.duracion:>8.1f}s {resumen.procesados / resumen.duracion:>8.2f}  "
+                  f"{resumen.exitosos:>3} ok  {descripcion}")
+        pool.cerrar_todo()
+        dao.cerrar()
+    finally:
+        os.chdir(args.directorio_original)
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dispositivos", type=int, default=20)
+    parser.add_argument("--tamano", type=int, default=500_000, help="Bytes de configuración por dispositivo")
+    parser.add_argument("--ancho-banda", type=float, default=256, help="KiB/s de bajada del enlace de cada dispositivo")
+    parser.add_argument("--retardo", type=float, default=0.05, help="Segundos de retardo en la subida de cada enlace")
+    parser.add_argument("--latencia", type=float, default=0.05, help="Segundos que tarda el comando en responder")
+    parser.add_argument("--trabajadores", type=int, default=8)
+    parser.add_argument("--rondas", type=int, default=6, help="Rondas por modo; el autoajuste explora en las primeras")
+    parser.add_argument("--muestras", type=int, default=1, help="Descargas de cada variante antes de elegir")
+    parser.add_argument("--modos", nargs="+", choices=MODOS, default=MODOS)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    perfiles = [PerfilSimulado(configuracion=generar_configuracion(rng, args.tamano), latencia=args.latencia,
+                               ancho_banda=args.ancho_banda * 1024, retardo=args.retardo)
+                for _ in range(args.dispositivos)]
+    receptor, emisor = multiprocessing.Pipe(duplex=False)
+    granja = multiprocessing.Process(target=ejecutar_granja, args=(perfiles, emisor), daemon=True)
+    granja.start()
+    puertos = receptor.recv()
+    print(f"Granja: {args.dispositivos} dispositivos de {args.tamano / 1e3:.0f} kB, enlaces de "
+          f"{args.ancho_banda:.0f} KiB/s con {args.retardo * 1000:.0f} ms de retardo\n")
+
+    args.directorio_original = os.getcwd()
+    configurar_registro(os.path.join(tempfile.gettempdir(), "bench_transporte.log"), consola=False)
+    try:
+        print(f"{'modo':<11} {'ronda':<6} {'duración':>9} {'disp/s':>8}  {'':>6}  variantes usadas")
+        for modo in args.modos:
+            ejecutar_modo(modo, puertos, args)
+    finally:
+        granja.terminate()
+
+
+if __name__ == "__main__":
+    main()
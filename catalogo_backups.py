@@ -0,0 +1,163 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from almacen_backups import PATRON_BACKUP_PLANO, limpiar_nombre
+from dispositivo import DispositivoDAO
+
+
+@dataclass
+class PoliticaRetencion:
+    """
+    Retención abuelo-padre-hijo: se conserva el backup más reciente de cada uno
+    de los últimos `diarios` días, `semanales` semanas y `mensuales` meses con backups
+    """
+    diarios: int = 7
+    semanales: int = 4
+    mensuales: int = 12
+
+
+class CatalogoBackups:
+    """
+    Catálogo en SQLite de los backups guardados como archivos .cfg. La retención
+    pasa a ser una consulta por índice en lugar de recorrer el directorio de backups
+    """
+
+    def __init__(self, db_path='dispositivos.db', dias_retencion: int = 30, politica: PoliticaRetencion = None):
+        self.db_path = db_path
+        self.dias_retencion = dias_retencion
+        self.politica = politica
+        self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS catalogo_backups (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                dispositivo_id INTEGER NOT NULL,
+                                fecha REAL NOT NULL,
+                                ruta TEXT NOT NULL UNIQUE,
+                                tamano INTEGER NOT NULL,
+                                hash TEXT
+                              )''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_catalogo_dispositivo_fecha
+                              ON catalogo_backups (dispositivo_id, fecha)''')
+            conn.commit()
+
+    def registrar(self, dispositivo_id, ruta: str, fecha: float, tamano: int, hash_contenido: str = None):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''INSERT OR REPLACE INTO catalogo_backups (dispositivo_id, fecha, ruta, tamano, hash)
+                              VALUES (?, ?, ?, ?, ?)''', (dispositivo_id, fecha, ruta, tamano, hash_contenido))
+            conn.commit()
+
+    def backups(self, dispositivo_id) -> list[tuple]:
+        """Backups del dispositivo como (fecha, ruta, tamano, hash), del más reciente al más antiguo"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT fecha, ruta, tamano, hash FROM catalogo_backups
+                              WHERE dispositivo_id = ? ORDER BY fecha DESC''', (dispositivo_id,))
+            return cursor.fetchall()
+
+    def ultimo_backup(self, dispositivo_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT fecha, ruta, tamano, hash FROM catalogo_backups
+                              WHERE dispositivo_id = ? ORDER BY fecha DESC LIMIT 1''', (dispositivo_id,))
+            return cursor.fetchone()
+
+    def aplicar_retencion(self, dispositivo_id) -> list[str]:
+        """Quita del catálogo los backups vencidos del dispositivo y devuelve sus rutas para borrarlas"""
+        if self.politica:
+            return self._retencion_gfs(dispositivo_id)
+
+        fecha_limite = (datetime.now() - timedelta(days=self.dias_retencion)).timestamp()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT ruta FROM catalogo_backups
+                              WHERE dispositivo_id = ? AND fecha < ?''', (dispositivo_id, fecha_limite))
+            rutas = [row[0] for row in cursor.fetchall()]
+            cursor.execute('DELETE FROM catalogo_backups WHERE dispositivo_id = ? AND fecha < ?',
+                           (dispositivo_id, fecha_limite))
+            conn.commit()
+        return rutas
+
+    def _retencion_gfs(self, dispositivo_id) -> list[str]:
+        registros = [(fecha, ruta) for fecha, ruta, _, _ in self.backups(dispositivo_id)]
+        conservar = set()
+        if registros:
+            conservar.add(registros[0][1])  # el último backup nunca se borra
+        periodos = (
+            (self.politica.diarios, lambda f: f.date()),
+            (self.politica.semanales, lambda f: f.isocalendar()[:2]),
+            (self.politica.mensuales, lambda f: (f.year, f.month)),
+        )
+        for cantidad, periodo in periodos:
+            vistos = set()
+            # Los registros van del más reciente al más antiguo: el primero de cada periodo es el que se conserva
+            for fecha, ruta in registros:
+                clave = periodo(datetime.fromtimestamp(fecha))
+                if clave in vistos:
+                    continue
+                if len(vistos) >= cantidad:
+                    break
+                vistos.add(clave)
+                conservar.add(ruta)
+
+        rutas = [ruta for _, ruta in registros if ruta not in conservar]
+        if rutas:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.executemany('DELETE FROM catalogo_backups WHERE ruta = ?', [(r,) for r in rutas])
+                conn.commit()
+        return rutas
+
+    def reconstruir(self, dao: DispositivoDAO, directorio='backups') -> tuple[int, int]:
+        """
+        Vuelve a generar el catálogo a partir de los .cfg del directorio.
+        Devuelve (registrados, omitidos); se omiten los archivos sin dispositivo reconocible
+        """
+        por_nombre = {limpiar_nombre(d.nombre): d for d in dao.obtener_todos()}
+        filas = []
+        omitidos = 0
+        for archivo in os.listdir(directorio):
+            coincidencia = PATRON_BACKUP_PLANO.match(archivo)
+            dispositivo = coincidencia and por_nombre.get(coincidencia.group(1))
+            if not dispositivo:
+                omitidos += 1
+                continue
+            ruta = os.path.join(directorio, archivo)
+            fecha = datetime.strptime(coincidencia.group(2), "%Y%m%d_%H%M%S").timestamp()
+            filas.append((dispositivo.id, fecha, ruta, os.path.getsize(ruta), _hash_archivo(ruta)))
+
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM catalogo_backups')
+            cursor.executemany('''INSERT OR REPLACE INTO catalogo_backups (dispositivo_id, fecha, ruta, tamano, hash)
+                                  VALUES (?, ?, ?, ?, ?)''', filas)
+            conn.commit()
+        return len(filas), omitidos
+
+
+def _hash_archivo(ruta: str) -> str:
+    digest = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye el catálogo de backups a partir del directorio")
+    parser.add_argument("--db", default="dispositivos.db", help="Ruta de la base de datos de dispositivos")
+    parser.add_argument("--directorio", default="backups", help="Directorio con los backups .cfg")
+    args = parser.parse_args()
+
+    registrados, omitidos = CatalogoBackups(args.db).reconstruir(DispositivoDAO(args.db), args.directorio)
+    print(f"[*] {registrados} backups catalogados, {omitidos} archivos omitidos")
+
+
+if __name__ == "__main__":
+    main()
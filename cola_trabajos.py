@@ -0,0 +1,362 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from backup_manager import EXITOSO, OMITIDO, SIN_CAMBIOS
+from dispositivo import Dispositivo, DispositivoDAO
+from motor_backup import CANCELADO, MotorBackup
+from programador import INTERVALO_LIMPIEZA, INTERVALOS
+
+# Estados de un trabajo de la cola
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+HECHO = "hecho"
+AGOTADO = "agotado"  # Sin éxito tras max_intentos dentro del ciclo
+REEMPLAZADO = "reemplazado"  # Empezó otro ciclo, o el dispositivo pasó a "Manual", antes de completarse
+
+
+@dataclass
+class Trabajo:
+    dispositivo_id: int
+    ciclo: int  # Inicio del ciclo (epoch): hay como mucho un trabajo por dispositivo y ciclo
+    arriendo: str  # Identifica el reclamo vigente; tras una toma de control el anterior ya no vale
+    intentos: int = 1
+
+
+class ColaTrabajos:
+    """
+    Cola de trabajos de backup en SQLite compartida por varios colectores. Cada
+    dispositivo tiene un trabajo por ciclo de su frecuencia_backup, y un colector lo
+    reclama con un arriendo de duración limitada que renueva mientras el backup sigue
+    en curso. Si el colector muere, el arriendo vence y otro retoma el trabajo.
+    Solo el titular del arriendo vigente puede completar el trabajo, así que cada
+    ciclo queda registrado una sola vez.
+
+    El backend SQLite es para colectores de un solo equipo: el modo WAL necesita memoria
+    compartida y no funciona sobre sistemas de archivos de red (NFS, SMB). Para repartir
+    los backups entre varios equipos hace falta otro backend (p.ej. un servidor de base
+    de datos), que solo necesita los mismos métodos; los relojes de esos equipos deben
+    estar sincronizados (NTP) con un margen muy inferior a la duración del arriendo
+    """
+
+    def __init__(self, db_path='dispositivos.db', duracion_arriendo: float = 300, max_intentos: int = 3,
+                 ventana_dispersion: float = 3600):
+        self.db_path = db_path
+        self.duracion_arriendo = duracion_arriendo
+        self.max_intentos = max_intentos
+        self.ventana_dispersion = ventana_dispersion
+        self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS trabajos_backup (
+                                dispositivo_id INTEGER NOT NULL,
+                                ciclo INTEGER NOT NULL,
+                                estado TEXT NOT NULL,
+                                disponible REAL NOT NULL,
+                                intentos INTEGER NOT NULL DEFAULT 0,
+                                nodo TEXT,
+                                arriendo TEXT,
+                                arriendo_hasta REAL,
+                                resultado TEXT,
+                                actualizado REAL NOT NULL,
+                                PRIMARY KEY (dispositivo_id, ciclo)
+                              )''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_trabajos_disponibles
+                              ON trabajos_backup (estado, disponible)''')
+            conn.commit()
+
+    @contextmanager
+    def _transaccion(self):
+        """Transacción de escritura: BEGIN IMMEDIATE serializa los reclamos de todos los colectores"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn.cursor()
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def ciclo_actual(self, dispositivo: Dispositivo, ahora: float = None):
+        """
+        Inicio del ciclo en curso del dispositivo, o None si no se programa. Los ciclos
+        forman una rejilla fija desplazada por la fase del dispositivo dentro de la ventana
+        de dispersión, así todos los colectores calculan el mismo sin coordinarse
+        """
+        intervalo = INTERVALOS.get(dispositivo.frecuencia_backup)
+        if intervalo is None:
+            return None
+        ahora = ahora or time.time()
+        ventana = self.ventana_dispersion
+        fase = zlib.crc32(str(dispositivo.id).encode()) % ventana if ventana else 0
+        return int(fase + (ahora - fase) // intervalo * intervalo)
+
+    def encolar_ciclo(self, dispositivos, ahora: float = None) -> int:
+        """
+        Crea el trabajo del ciclo en curso de cada dispositivo que aún no lo tenga y da por
+        reemplazados sus trabajos pendientes de otros ciclos. Es idempotente: todos los
+        colectores pueden llamarlo. Devuelve cuántos trabajos nuevos se crearon
+        """
+        ahora = ahora or time.time()
+        nuevos, manuales = [], []
+        for dispositivo in dispositivos:
+            ciclo = self.ciclo_actual(dispositivo, ahora)
+            if ciclo is None:
+                manuales.append((ahora, dispositivo.id))
+            else:
+                nuevos.append((dispositivo.id, ciclo, ciclo, ahora))
+        with self._transaccion() as cursor:
+            cursor.executemany(f'''INSERT OR IGNORE INTO trabajos_backup
+                                       (dispositivo_id, ciclo, estado, disponible, actualizado)
+                                   VALUES (?, ?, '{PENDIENTE}', ?, ?)''', nuevos)
+            creados = cursor.rowcount
+            cursor.executemany(f'''UPDATE trabajos_backup SET estado = '{REEMPLAZADO}', actualizado = ?
+                                   WHERE dispositivo_id = ? AND ciclo <> ? AND estado = '{PENDIENTE}' ''',
+                               [(ahora, dispositivo_id, ciclo) for dispositivo_id, ciclo, _, _ in nuevos])
+            cursor.executemany(f'''UPDATE trabajos_backup SET estado = '{REEMPLAZADO}', actualizado = ?
+                                   WHERE dispositivo_id = ? AND estado = '{PENDIENTE}' ''', manuales)
+        return creados
+
+    def reclamar(self, nodo: str, limite: int, ahora: float = None) -> list[Trabajo]:
+        """Toma hasta `limite` trabajos disponibles o con el arriendo vencido, por orden de antigüedad"""
+        if limite < 1:
+            return []
+        ahora = ahora or time.time()
+        with self._transaccion() as cursor:
+            cursor.execute(f'''SELECT dispositivo_id, ciclo, intentos FROM trabajos_backup
+                               WHERE (estado = '{PENDIENTE}' AND disponible <= ?)
+                                  OR (estado = '{EN_CURSO}' AND arriendo_hasta < ?)
+                               ORDER BY disponible LIMIT ?''', (ahora, ahora, limite))
+            trabajos = [Trabajo(dispositivo_id, ciclo, uuid.uuid4().hex, intentos + 1)
+                        for dispositivo_id, ciclo, intentos in cursor.fetchall()]
+            cursor.executemany(f'''UPDATE trabajos_backup
+                                   SET estado = '{EN_CURSO}', intentos = ?, nodo = ?, arriendo = ?,
+                                       arriendo_hasta = ?, actualizado = ?
+                                   WHERE dispositivo_id = ? AND ciclo = ?''',
+                               [(t.intentos, nodo, t.arriendo, ahora + self.duracion_arriendo, ahora,
+                                 t.dispositivo_id, t.ciclo) for t in trabajos])
+        return trabajos
+
+    def renovar(self, trabajos: list[Trabajo], ahora: float = None) -> list[Trabajo]:
+        """Extiende los arriendos. Devuelve los trabajos cuyo arriendo ya no es nuestro"""
+        ahora = ahora or time.time()
+        perdidos = []
+        with self._transaccion() as cursor:
+            for trabajo in trabajos:
+                cursor.execute(f'''UPDATE trabajos_backup SET arriendo_hasta = ?, actualizado = ?
+                                   WHERE dispositivo_id = ? AND ciclo = ? AND arriendo = ?
+                                     AND estado = '{EN_CURSO}' ''',
+                               (ahora + self.duracion_arriendo, ahora, trabajo.dispositivo_id, trabajo.ciclo,
+                                trabajo.arriendo))
+                if not cursor.rowcount:
+                    perdidos.append(trabajo)
+        return perdidos
+
+    def _cerrar(self, trabajo: Trabajo, asignaciones: str, parametros: tuple) -> bool:
+        with self._transaccion() as cursor:
+            cursor.execute(f'''UPDATE trabajos_backup SET {asignaciones}, arriendo = NULL, arriendo_hasta = NULL
+                               WHERE dispositivo_id = ? AND ciclo = ? AND arriendo = ?
+                                 AND estado = '{EN_CURSO}' ''',
+                           (*parametros, trabajo.dispositivo_id, trabajo.ciclo, trabajo.arriendo))
+            return cursor.rowcount > 0
+
+    def completar(self, trabajo: Trabajo, resultado: str) -> bool:
+        """Marca el ciclo como hecho. False si el arriendo venció y el trabajo lo retomó otro colector"""
+        return self._cerrar(trabajo, f"estado = '{HECHO}', resultado = ?, actualizado = ?",
+                            (resultado, time.time()))
+
+    def reintentar(self, trabajo: Trabajo, resultado: str, disponible: float, contar: bool = True) -> bool:
+        """
+        Devuelve el trabajo a la cola para intentarlo desde `disponible`, o lo da por agotado
+        tras max_intentos. Con contar=False el intento no cuenta (p.ej. omitido por el cortacircuitos)
+        """
+        intentos = trabajo.intentos if contar else trabajo.intentos - 1
+        estado = AGOTADO if intentos >= self.max_intentos else PENDIENTE
+        return self._cerrar(trabajo, "estado = ?, intentos = ?, resultado = ?, disponible = ?, actualizado = ?",
+                            (estado, intentos, resultado, disponible, time.time()))
+
+    def liberar(self, trabajo: Trabajo) -> bool:
+        """Devuelve el trabajo sin contar el intento (p.ej. al detener el colector)"""
+        return self.reintentar(trabajo, None, time.time(), contar=False)
+
+    def descartar(self, trabajo: Trabajo) -> None:
+        """Elimina el trabajo (el dispositivo ya no existe)"""
+        with self._transaccion() as cursor:
+            cursor.execute('DELETE FROM trabajos_backup WHERE dispositivo_id = ? AND ciclo = ? AND arriendo = ?',
+                           (trabajo.dispositivo_id, trabajo.ciclo, trabajo.arriendo))
+
+    def contar(self, desde: float = None) -> dict:
+        """Trabajos por estado, opcionalmente solo los de ciclos que empezaron después de `desde`"""
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT estado, COUNT(*) FROM trabajos_backup WHERE ciclo >= ?
+                              GROUP BY estado''', (desde or 0,))
+            return dict(cursor.fetchall())
+
+    def limpiar_antiguos(self, dias: int = 60) -> int:
+        """Borra los trabajos terminados de ciclos antiguos"""
+        fecha_limite = time.time() - dias * 24 * 3600
+        with self._transaccion() as cursor:
+            cursor.execute(f'''DELETE FROM trabajos_backup WHERE ciclo < ?
+                               AND estado IN ('{HECHO}', '{AGOTADO}', '{REEMPLAZADO}')''', (fecha_limite,))
+            return cursor.rowcount
+
+
+class ColectorCola:
+    """
+    Un nodo colector: encola los ciclos que empiezan, reclama tantos trabajos como
+    huecos libres tiene su motor, los respalda y renueva sus arriendos mientras tanto.
+    Se pueden lanzar tantos colectores como se quiera contra la misma cola (con SQLite,
+    procesos del mismo equipo)
+    """
+
+    def __init__(self, cola: ColaTrabajos, dao: DispositivoDAO, motor: MotorBackup, nodo: str = None,
+                 intervalo: float = 5, intervalo_encolar: float = 60, espera_reintento: float = 900):
+        self.cola = cola
+        self.dao = dao
+        self.motor = motor
+        self.nodo = nodo or f"{socket.gethostname()}:{os.getpid()}"
+        self.intervalo = intervalo
+        self.intervalo_encolar = intervalo_encolar
+        self.espera_reintento = espera_reintento
+        self.logger = logging.getLogger(__name__)
+        self._en_curso = {}  # dispositivo_id -> Trabajo
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._detenido = False
+        self._ejecuciones = []
+        self._seq = 0
+        self._ultima_limpieza = None
+        self._seq_limpieza = None  # Cambios ya leídos en la limpieza anterior
+
+    def ejecutar(self) -> None:
+        """Bucle principal hasta detener(); al salir devuelve a la cola lo que no llegó a empezar"""
+        self._seq = self.dao.ultimo_cambio()
+        ultimo_encolado = ultima_renovacion = 0
+        while not self._detenido:
+            ahora = time.monotonic()
+            if ahora - ultimo_encolado >= self.intervalo_encolar:
+                creados = self.cola.encolar_ciclo(self.dao.iterar(("id", "frecuencia_backup")))
+                if creados:
+                    self.logger.info(f"[{self.nodo}] {creados} trabajos nuevos en la cola")
+                ultimo_encolado = ahora
+            else:
+                self._aplicar_cambios()
+            if ahora - ultima_renovacion >= self.cola.duracion_arriendo / 3:
+                self._renovar()
+                ultima_renovacion = ahora
+            self._reclamar()
+            self._limpiar_antiguos()
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+
+        for ejecucion in self._ejecuciones:
+            ejecucion.cancelar()
+        for ejecucion in self._ejecuciones:
+            ejecucion.esperar()
+
+    def detener(self) -> None:
+        self._detenido = True
+        self._despertar.set()
+
+    def _reclamar(self):
+        with self._lock:
+            libres = self.motor.max_trabajadores - len(self._en_curso)
+        trabajos = self.cola.reclamar(self.nodo, libres)
+        if not trabajos:
+            return
+        dispositivos = []
+        for trabajo in trabajos:
+            dispositivo = self.dao.obtener_por_id(trabajo.dispositivo_id)
+            if dispositivo is None:
+                self.cola.descartar(trabajo)
+                continue
+            dispositivos.append(dispositivo)
+            with self._lock:
+                self._en_curso[dispositivo.id] = trabajo
+        if not dispositivos:
+            return
+        self._ejecuciones = [e for e in self._ejecuciones if not e.resumen.fin]
+        self._ejecuciones.append(self.motor.respaldar(dispositivos, al_progresar=self._al_completar))
+
+    def _renovar(self):
+        with self._lock:
+            trabajos = list(self._en_curso.values())
+        if trabajos:
+            for trabajo in self.cola.renovar(trabajos):
+                self.logger.warning(f"[{self.nodo}] Arriendo perdido del dispositivo {trabajo.dispositivo_id}")
+
+    def _aplicar_cambios(self):
+        """Los dispositivos nuevos o editados se encolan sin esperar a la próxima vuelta completa"""
+        ids, self._seq = self.dao.obtener_cambios_desde(self._seq)
+        if not ids:
+            return
+        dispositivos = [d for d in (self.dao.obtener_por_id(i) for i in ids) if d]
+        self.cola.encolar_ciclo(dispositivos)
+        backup_manager = self.motor.backup_manager
+        if backup_manager.cortacircuitos:
+            backup_manager.cortacircuitos.reiniciar(ids)
+        if backup_manager.huellas:
+            backup_manager.huellas.olvidar(ids)
+        if backup_manager.transporte:
+            # Con otra IP o puerto las medidas anteriores ya no valen: el autoajuste vuelve a empezar
+            backup_manager.transporte.olvidar_rendimiento(ids)
+
+    def _limpiar_antiguos(self):
+        """Una vez al día purga los trabajos terminados, los tiempos de backup vencidos y el registro de cambios ya leído"""
+        if self._ultima_limpieza is not None and time.monotonic() - self._ultima_limpieza < INTERVALO_LIMPIEZA:
+            return
+        self._ultima_limpieza = time.monotonic()
+        try:
+            eliminados = self.cola.limpiar_antiguos()
+            if eliminados:
+                self.logger.info(f"[{self.nodo}] {eliminados} trabajos antiguos eliminados de la cola")
+        except Exception as e:
+            self.logger.error(f"[{self.nodo}] Error limpiando la cola: {str(e)}")
+        if self._seq_limpieza is not None:
+            # Lo que ya se había leído hace un día también lo leyeron la GUI y los demás consumidores
+            try:
+                eliminados = self.dao.limpiar_cambios(self._seq_limpieza)
+                if eliminados:
+                    self.logger.info(f"[{self.nodo}] {eliminados} cambios de dispositivos antiguos eliminados")
+            except Exception as e:
+                self.logger.error(f"[{self.nodo}] Error limpiando el registro de cambios: {str(e)}")
+        self._seq_limpieza = self._seq
+        metricas = self.motor.backup_manager.metricas
+        if metricas:
+            try:
+                eliminados = metricas.limpiar_antiguos()
+                if eliminados:
+                    self.logger.info(f"[{self.nodo}] {eliminados} tiempos de backup antiguos eliminados")
+            except Exception as e:
+                self.logger.error(f"[{self.nodo}] Error limpiando métricas antiguas: {str(e)}")
+
+    def _al_completar(self, dispositivo, estado, resumen):
+        # Se ejecuta en los hilos del motor
+        with self._lock:
+            trabajo = self._en_curso.pop(dispositivo.id, None)
+        if trabajo is None:
+            return
+        if estado in (EXITOSO, SIN_CAMBIOS):
+            registrado = self.cola.completar(trabajo, estado)
+        elif estado == CANCELADO:
+            registrado = self.cola.liberar(trabajo)
+        else:
+            cortacircuitos = self.motor.backup_manager.cortacircuitos
+            proximo = cortacircuitos and cortacircuitos.proximo_intento(dispositivo.id)
+            registrado = self.cola.reintentar(trabajo, estado, proximo or time.time() + self.espera_reintento,
+                                              contar=estado != OMITIDO)
+        if not registrado:
+            self.logger.warning(f"[{self.nodo}] {dispositivo.nombre}: otro colector retomó el trabajo")
+        self._despertar.set()
@@ -0,0 +1,148 @@
+import random
+import sqlite3
+import time
+from dispositivo import Dispositivo
+
+# Clases de error que se registran por dispositivo
+ERROR_AUTH = "auth"
+ERROR_TIMEOUT = "timeout"
+ERROR_RECHAZADO = "rechazado"
+ERROR_SSH = "ssh"
+ERROR_OTRO = "otro"
+
+# Decisiones antes de intentar un backup
+PERMITIR = "permitir"
+SONDEAR = "sondear"  # circuito abierto y espera vencida: se comprueba el puerto antes del intento completo
+OMITIR = "omitir"
+
+
+class CortacircuitosDispositivos:
+    """
+    Seguimiento en SQLite de los fallos de cada dispositivo. Tras cada fallo el
+    dispositivo espera un tiempo que crece exponencialmente (con jitter) antes del
+    siguiente intento; a partir de `umbral_apertura` fallos seguidos el circuito se
+    abre y, vencida la espera, se sondea el puerto antes de repetir el backup completo.
+    También estima el timeout de conexión de cada dispositivo a partir de sus latencias
+    """
+
+    def __init__(self, db_path='dispositivos.db', umbral_apertura: int = 3, espera_base: float = 60,
+                 espera_base_auth: float = 3600, espera_maxima: float = 6 * 3600,
+                 timeout_minimo: float = 3, timeout_maximo: float = 15):
+        self.db_path = db_path
+        self.umbral_apertura = umbral_apertura
+        self.espera_base = espera_base
+        self.espera_base_auth = espera_base_auth  # Unas credenciales erróneas no se arreglan solas
+        self.espera_maxima = espera_maxima
+        self.timeout_minimo = timeout_minimo
+        self.timeout_maximo = timeout_maximo
+        self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS salud_dispositivos (
+                                dispositivo_id INTEGER PRIMARY KEY,
+                                fallos_consecutivos INTEGER NOT NULL DEFAULT 0,
+                                ultimo_error TEXT,
+                                ultimo_fallo REAL,
+                                reintentar_despues REAL,
+                                latencia_media REAL,
+                                latencia_variacion REAL
+                              )''')
+            conn.commit()
+
+    def _leer(self, dispositivo_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT fallos_consecutivos, reintentar_despues, latencia_media, latencia_variacion
+                              FROM salud_dispositivos WHERE dispositivo_id = ?''', (dispositivo_id,))
+            return cursor.fetchone()
+
+    def decidir(self, dispositivo: Dispositivo, ahora: float = None) -> str:
+        """PERMITIR, SONDEAR u OMITIR el backup del dispositivo en este momento"""
+        fila = self._leer(dispositivo.id)
+        if not fila or not fila[0]:
+            return PERMITIR
+        fallos, reintentar_despues, _, _ = fila
+        if reintentar_despues and (ahora or time.time()) < reintentar_despues:
+            return OMITIR
+        return SONDEAR if fallos >= self.umbral_apertura else PERMITIR
+
+    def timeout_conexion(self, dispositivo: Dispositivo) -> float:
+        """Timeout de conexión según el historial de latencias (media + 4 desviaciones, como el RTO de TCP)"""
+        fila = self._leer(dispositivo.id)
+        if not fila or fila[2] is None:
+            return self.timeout_maximo
+        media, variacion = fila[2], fila[3]
+        return min(max(media + 4 * variacion, self.timeout_minimo), self.timeout_maximo)
+
+    def registrar_exito(self, dispositivo: Dispositivo, latencia: float = None) -> None:
+        """Cierra el circuito y, si se midió, incorpora la latencia de conexión a la estimación"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT latencia_media, latencia_variacion FROM salud_dispositivos
+                              WHERE dispositivo_id = ?''', (dispositivo.id,))
+            fila = cursor.fetchone()
+            media, variacion = fila if fila else (None, None)
+            if latencia is not None:
+                if media is None:
+                    media, variacion = latencia, latencia / 2
+                else:
+                    variacion = 0.75 * variacion + 0.25 * abs(media - latencia)
+                    media = 0.875 * media + 0.125 * latencia
+            cursor.execute('''INSERT INTO salud_dispositivos (dispositivo_id, fallos_consecutivos, ultimo_error,
+                                  reintentar_despues, latencia_media, latencia_variacion)
+                              VALUES (?, 0, NULL, NULL, ?, ?)
+                              ON CONFLICT (dispositivo_id) DO UPDATE SET
+                                  fallos_consecutivos = 0, ultimo_error = NULL, reintentar_despues = NULL,
+                                  latencia_media = excluded.latencia_media,
+                                  latencia_variacion = excluded.latencia_variacion''',
+                           (dispositivo.id, media, variacion))
+            conn.commit()
+
+    def registrar_fallo(self, dispositivo: Dispositivo, clase: str, ahora: float = None) -> float:
+        """Suma un fallo y programa el próximo intento. Devuelve el instante a partir del cual se reintenta"""
+        ahora = ahora or time.time()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT fallos_consecutivos FROM salud_dispositivos WHERE dispositivo_id = ?',
+                           (dispositivo.id,))
+            fila = cursor.fetchone()
+            fallos = (fila[0] if fila else 0) + 1
+            base = self.espera_base_auth if clase == ERROR_AUTH else self.espera_base
+            espera = min(base * 2 ** (fallos - 1), self.espera_maxima)
+            # Jitter: la mitad fija y la otra mitad al azar, para no reintentar todos a la vez
+            reintentar_despues = ahora + espera / 2 + random.uniform(0, espera / 2)
+            cursor.execute('''INSERT INTO salud_dispositivos (dispositivo_id, fallos_consecutivos, ultimo_error,
+                                  ultimo_fallo, reintentar_despues)
+                              VALUES (?, ?, ?, ?, ?)
+                              ON CONFLICT (dispositivo_id) DO UPDATE SET
+                                  fallos_consecutivos = excluded.fallos_consecutivos,
+                                  ultimo_error = excluded.ultimo_error, ultimo_fallo = excluded.ultimo_fallo,
+                                  reintentar_despues = excluded.reintentar_despues''',
+                           (dispositivo.id, fallos, clase, ahora, reintentar_despues))
+            conn.commit()
+        return reintentar_despues
+
+    def proximo_intento(self, dispositivo_id):
+        """Instante (epoch) a partir del cual se puede reintentar, o None si no hay espera pendiente"""
+        fila = self._leer(dispositivo_id)
+        return fila[1] if fila and fila[0] else None
+
+    def reiniciar(self, ids) -> None:
+        """Olvida los fallos de los dispositivos (p.ej. tras corregir sus credenciales); conserva las latencias"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''UPDATE salud_dispositivos
+                                  SET fallos_consecutivos = 0, ultimo_error = NULL, reintentar_despues = NULL
+                                  WHERE dispositivo_id = ? AND fallos_consecutivos > 0''', [(i,) for i in ids])
+            conn.commit()
+
+    def con_fallos(self) -> list[tuple]:
+        """Dispositivos con fallos seguidos como (dispositivo_id, fallos, ultimo_error, reintentar_despues)"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT dispositivo_id, fallos_consecutivos, ultimo_error, reintentar_despues
+                              FROM salud_dispositivos WHERE fallos_consecutivos > 0
+                              ORDER BY fallos_consecutivos DESC''')
+            return cursor.fetchall()
@@ -1,5 +1,12 @@
+import copy
+import csv
+import json
 import sqlite3
-from dataclasses import dataclass
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
 
 @dataclass
 class Dispositivo:
@@ -12,13 +19,91 @@ class Dispositivo:
     frecuencia_backup: str = ""
     puerto_ssh: int = 22  # Nuevo campo con valor por defecto 22
 
+# Columnas del inventario en los archivos de importación/exportación
+CAMPOS_INVENTARIO = [f.name for f in fields(Dispositivo) if f.name != "id"]
+# Columnas de la tabla, en el orden de los campos de Dispositivo
+COLUMNAS_DISPOSITIVO = tuple(f.name for f in fields(Dispositivo))
+# Lo que necesita un listado: sin credenciales
+COLUMNAS_LISTADO = ("id", "nombre", "ip", "puerto_ssh", "tipo", "frecuencia_backup")
+
+class FilaDispositivo:
+    """
+    Fila de una consulta con proyección: solo tiene las columnas pedidas (leer otra lanza
+    AttributeError) y, con __slots__, ocupa bastante menos que un Dispositivo
+    """
+    __slots__ = COLUMNAS_DISPOSITIVO
+    
+    def __init__(self, columnas, valores):
+        for columna, valor in zip(columnas, valores):
+            setattr(self, columna, valor)
+    
+    def __repr__(self):
+        valores = ", ".join(f"{c}={getattr(self, c)!r}" for c in self.__slots__ if hasattr(self, c))
+        return f"FilaDispositivo({valores})"
+
 class DispositivoDAO:
-    def __init__(self, db_path='dispositivos.db'):
+    def __init__(self, db_path='dispositivos.db', persistente=False, tamano_cache=4096):
+        """
+        Con persistente=True se mantiene una única conexión compartida entre hilos
+        (serializada con un lock) en lugar de abrir una conexión por operación, y
+        obtener_por_id recuerda los últimos `tamano_cache` dispositivos leídos
+        """
         self.db_path = db_path
+        self.persistente = persistente
+        self._conn = None
+        self._lock = threading.RLock()
+        # Caché LRU de obtener_por_id, protegida por el mismo lock que la conexión persistente
+        self.tamano_cache = tamano_cache if persistente else 0
+        self._cache = OrderedDict()
+        self._version_datos = None
+        if persistente:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            self._configurar(self._conn)
         self._crear_tabla()
+        self._seq_cache = self.ultimo_cambio()
+    
+    @staticmethod
+    def _configurar(conn):
+        # WAL permite leer mientras otro hilo o proceso escribe
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+    
+    @contextmanager
+    def _conexion(self):
+        """Conexión para una operación: confirma al terminar y deshace si hubo error"""
+        if self._conn is not None:
+            with self._lock:
+                try:
+                    yield self._conn
+                    self._conn.commit()
+                except BaseException:
+                    self._conn.rollback()
+                    raise
+            return
+        
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def cerrar(self):
+        """Cierra la conexión persistente, si la hay"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
     
     def _crear_tabla(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conexion() as conn:
+            if not self.persistente:
+                self._configurar(conn)
             cursor = conn.cursor()
             cursor.execute('''CREATE TABLE IF NOT EXISTS dispositivos (
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -30,10 +115,50 @@ class DispositivoDAO:
                                 frecuencia_backup TEXT NOT NULL,
                                 puerto_ssh INTEGER NOT NULL DEFAULT 22
                               )''')
+            # Último backup exitoso de cada dispositivo (lo usa el programador)
+            cursor.execute('''CREATE TABLE IF NOT EXISTS estado_backup (
+                                dispositivo_id INTEGER PRIMARY KEY,
+                                ultimo_exito REAL NOT NULL
+                              )''')
+            # Resultado del último barrido de alcanzabilidad de cada dispositivo
+            cursor.execute('''CREATE TABLE IF NOT EXISTS alcanzabilidad (
+                                dispositivo_id INTEGER PRIMARY KEY,
+                                fecha REAL NOT NULL,
+                                estado TEXT NOT NULL,
+                                latencia_ms REAL,
+                                detalle TEXT
+                              )''')
+            # Registro de cambios para que los consumidores lean solo lo modificado
+            cursor.execute('''CREATE TABLE IF NOT EXISTS cambios_dispositivos (
+                                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                                dispositivo_id INTEGER NOT NULL
+                              )''')
+            # Hasta dónde se ha limpiado el registro, para detectar lectores que se quedaron atrás
+            cursor.execute('''CREATE TABLE IF NOT EXISTS control_cambios (
+                                clave TEXT PRIMARY KEY,
+                                valor INTEGER NOT NULL
+                              )''')
+            for evento, fila in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS dispositivos_{evento.lower()}
+                                   AFTER {evento} ON dispositivos
+                                   BEGIN
+                                       INSERT INTO cambios_dispositivos (dispositivo_id) VALUES ({fila}.id);
+                                   END''')
+            # Índices para las búsquedas del listado (los rangos por prefijo usan los índices NOCASE)
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_dispositivos_nombre ON dispositivos (nombre COLLATE NOCASE)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_dispositivos_ip ON dispositivos (ip COLLATE NOCASE)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_dispositivos_tipo ON dispositivos (tipo)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_dispositivos_frecuencia ON dispositivos (frecuencia_backup)')
+            cursor.execute('''CREATE TRIGGER IF NOT EXISTS dispositivos_delete_estado
+                              AFTER DELETE ON dispositivos
+                              BEGIN
+                                  DELETE FROM estado_backup WHERE dispositivo_id = OLD.id;
+                                  DELETE FROM alcanzabilidad WHERE dispositivo_id = OLD.id;
+                              END''')
             conn.commit()
     
     def guardar(self, dispositivo):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conexion() as conn:
             cursor = conn.cursor()
             cursor.execute('''INSERT INTO dispositivos 
                               (nombre, ip, usuario, contraseña, tipo, frecuencia_backup, puerto_ssh)
@@ -45,7 +170,7 @@ class DispositivoDAO:
             conn.commit()
     
     def actualizar(self, dispositivo):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conexion() as conn:
             cursor = conn.cursor()
             cursor.execute('''UPDATE dispositivos SET
                                 nombre = ?,
@@ -61,48 +186,310 @@ class DispositivoDAO:
                             dispositivo.frecuencia_backup, dispositivo.puerto_ssh,
                             dispositivo.id))
             conn.commit()
+            self._cache.pop(dispositivo.id, None)
     
     def eliminar(self, dispositivo_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conexion() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM dispositivos WHERE id = ?', (dispositivo_id,))
             conn.commit()
+            self._cache.pop(dispositivo_id, None)
+    
+    def _validar_cache(self, conn):
+        """
+        Saca de la caché los dispositivos que modificó otra conexión (otro proceso). PRAGMA
+        data_version solo cambia cuando escribe otra conexión; entonces el registro de
+        cambios dice qué dispositivos invalidar, sin vaciar toda la caché
+        """
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._version_datos:
+            return
+        self._version_datos = version
+        ids, self._seq_cache = self.obtener_cambios_desde(self._seq_cache)
+        for dispositivo_id in ids:
+            self._cache.pop(dispositivo_id, None)
     
     def obtener_por_id(self, dispositivo_id):
-        with sqlite3.connect(self.db_path) as conn:
+        if self.tamano_cache:
+            with self._lock:
+                if self._conn is not None:
+                    self._validar_cache(self._conn)
+                    dispositivo = self._cache.get(dispositivo_id)
+                    if dispositivo is not None:
+                        self._cache.move_to_end(dispositivo_id)
+                        return copy.copy(dispositivo)  # Quien la recibe puede modificarla
+        
+        with self._conexion() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM dispositivos WHERE id = ?', (dispositivo_id,))
+            cursor.execute(f'SELECT {", ".join(COLUMNAS_DISPOSITIVO)} FROM dispositivos WHERE id = ?',
+                           (dispositivo_id,))
             row = cursor.fetchone()
-            
-            if row:
-                return Dispositivo(
-                    id=row[0],
-                    nombre=row[1],
-                    ip=row[2],
-                    usuario=row[3],
-                    contraseña=row[4],
-                    tipo=row[5],
-                    frecuencia_backup=row[6],
-                    puerto_ssh=row[7]  # Nuevo campo
-                )
-            return None
+            if not row:
+                return None
+            dispositivo = Dispositivo(*row)
+            if self.tamano_cache:
+                self._cache[dispositivo_id] = copy.copy(dispositivo)
+                if len(self._cache) > self.tamano_cache:
+                    self._cache.popitem(last=False)
+            return dispositivo
     
     def obtener_todos(self):
-        with sqlite3.connect(self.db_path) as conn:
+        """Todos los dispositivos completos, credenciales incluidas. Para recorrerlos, mejor iterar()"""
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT {", ".join(COLUMNAS_DISPOSITIVO)} FROM dispositivos')
+            return [Dispositivo(*row) for row in cursor.fetchall()]
+    
+    def iterar(self, columnas=COLUMNAS_LISTADO, tipo="", frecuencia="", tamano_lote=1000):
+        """
+        Genera los dispositivos por orden de id como FilaDispositivo con solo las columnas
+        indicadas. Lee por lotes (fetchmany) en una conexión de lectura propia: no carga
+        toda la tabla ni retiene la conexión compartida mientras se consume
+        """
+        columnas = tuple(columnas)
+        desconocidas = set(columnas) - set(COLUMNAS_DISPOSITIVO)
+        if desconocidas:
+            raise ValueError(f"Columnas desconocidas: {', '.join(sorted(desconocidas))}")
+        condiciones = ["1"]
+        parametros = []
+        if tipo:
+            condiciones.append("tipo = ?")
+            parametros.append(tipo)
+        if frecuencia:
+            condiciones.append("frecuencia_backup = ?")
+            parametros.append(frecuencia)
+        
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''SELECT {", ".join(columnas)} FROM dispositivos
+                               WHERE {' AND '.join(condiciones)} ORDER BY id''', parametros)
+            while filas := cursor.fetchmany(tamano_lote):
+                for fila in filas:
+                    yield FilaDispositivo(columnas, fila)
+        finally:
+            conn.close()
+    
+    def buscar(self, texto="", tipo="", frecuencia="", despues_de_id=0, limite=200, ids=None):
+        """
+        Página del listado de dispositivos como filas (id, nombre, ip, puerto_ssh, tipo, frecuencia_backup,
+        estado del último barrido), ordenadas por id. texto filtra por prefijo de nombre o IP; despues_de_id permite pedir la página siguiente
+        y ids restringe la búsqueda a esos dispositivos
+        """
+        condiciones = ["id > ?"]
+        parametros = [despues_de_id]
+        if texto:
+            # Un rango por columna, cada uno sobre su índice NOCASE, unidos con UNION: un LIKE con OR
+            # recorre la tabla entera. Todo lo que empieza por el prefijo queda por debajo de prefijo + U+10FFFF
+            condiciones.append('''id IN (SELECT id FROM dispositivos WHERE nombre >= ? COLLATE NOCASE
+                                                                     AND nombre < ? COLLATE NOCASE
+                                         UNION
+                                         SELECT id FROM dispositivos WHERE ip >= ? COLLATE NOCASE
+                                                                     AND ip < ? COLLATE NOCASE)''')
+            parametros += [texto, texto + "\U0010ffff"] * 2
+        if tipo:
+            condiciones.append("tipo = ?")
+            parametros.append(tipo)
+        if frecuencia:
+            condiciones.append("frecuencia_backup = ?")
+            parametros.append(frecuencia)
+        if ids is None:
+            return self._pagina(condiciones, parametros, limite)
+        
+        # Por tramos de ids ordenados para no superar el límite de parámetros de SQLite
+        ids = sorted(i for i in set(ids) if i > despues_de_id)
+        filas = []
+        for i in range(0, len(ids), 500):
+            if len(filas) >= limite:
+                break
+            tramo = ids[i:i + 500]
+            filas += self._pagina(condiciones + [f"id IN ({', '.join('?' * len(tramo))})"], parametros + tramo,
+                                  limite - len(filas))
+        return filas
+    
+    def _pagina(self, condiciones, parametros, limite):
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''SELECT id, nombre, ip, puerto_ssh, tipo, frecuencia_backup, COALESCE(estado, '')
+                               FROM dispositivos LEFT JOIN alcanzabilidad ON alcanzabilidad.dispositivo_id = id
+                               WHERE {' AND '.join(condiciones)} ORDER BY id LIMIT ?''', parametros + [limite])
+            return cursor.fetchall()
+    
+    def guardar_alcanzabilidad(self, resultados):
+        """Guarda resultados de barrido como (dispositivo_id, fecha, estado, latencia_ms, detalle)"""
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''INSERT OR REPLACE INTO alcanzabilidad
+                                  (dispositivo_id, fecha, estado, latencia_ms, detalle)
+                                  VALUES (?, ?, ?, ?, ?)''', resultados)
+    
+    def obtener_alcanzabilidad(self, ids):
+        """Devuelve {dispositivo_id: (estado, latencia_ms)} para los ids indicados"""
+        ids = list(ids)
+        resultado = {}
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            # Por tramos para no superar el límite de parámetros de SQLite
+            for i in range(0, len(ids), 500):
+                tramo = ids[i:i + 500]
+                cursor.execute(f'''SELECT dispositivo_id, estado, latencia_ms FROM alcanzabilidad
+                                   WHERE dispositivo_id IN ({', '.join('?' * len(tramo))})''', tramo)
+                resultado.update((row[0], row[1:]) for row in cursor.fetchall())
+        return resultado
+    
+    def registrar_backup_exitoso(self, dispositivo_id, instante=None):
+        """Guarda el instante (epoch) del último backup exitoso del dispositivo"""
+        with self._conexion() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM dispositivos')
+            cursor.execute('''INSERT OR REPLACE INTO estado_backup (dispositivo_id, ultimo_exito)
+                              VALUES (?, ?)''', (dispositivo_id, instante or time.time()))
+            conn.commit()
+    
+    def obtener_ultimo_exito(self, dispositivo_id):
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT ultimo_exito FROM estado_backup WHERE dispositivo_id = ?', (dispositivo_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+    
+    def obtener_ultimos_exitos(self):
+        """Devuelve {dispositivo_id: epoch del último backup exitoso}"""
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT dispositivo_id, ultimo_exito FROM estado_backup')
+            return dict(cursor.fetchall())
+    
+    def ultimo_cambio(self):
+        """Número de secuencia del último cambio registrado en la tabla de dispositivos"""
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios_dispositivos')
+            return cursor.fetchone()[0]
+    
+    def obtener_cambios_desde(self, seq):
+        """
+        Devuelve (ids de dispositivos modificados después de seq, nuevo seq).
+        Los ids pueden corresponder a dispositivos ya eliminados. Si limpiar_cambios ya
+        borró cambios posteriores a seq, devuelve todos los ids para resincronizar entero
+        """
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT seq, dispositivo_id FROM cambios_dispositivos
+                              WHERE seq > ? ORDER BY seq''', (seq,))
             rows = cursor.fetchall()
-            
-            dispositivos = []
+            if not rows:
+                return [], seq
+            if seq < self._primer_conservado(cursor) - 1:
+                # El lector se quedó atrás de una limpieza: no se sabe qué cambió, se releen todos
+                cursor.execute('SELECT id FROM dispositivos')
+                ids = list(dict.fromkeys([row[0] for row in cursor.fetchall()] + [row[1] for row in rows]))
+                return ids, rows[-1][0]
+            ids = list(dict.fromkeys(row[1] for row in rows))
+            return ids, rows[-1][0]
+    
+    def _primer_conservado(self, cursor):
+        """Menor seq que sobrevivió a la última limpieza del registro de cambios (0 si nunca se limpió)"""
+        cursor.execute("SELECT valor FROM control_cambios WHERE clave = 'primer_conservado'")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    
+    def limpiar_cambios(self, hasta_seq):
+        """
+        Borra del registro de cambios las entradas con seq <= hasta_seq para que la tabla no
+        crezca sin límite. Conserva siempre la última, de modo que ultimo_cambio no retrocede
+        """
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios_dispositivos')
+            hasta_seq = min(hasta_seq, cursor.fetchone()[0] - 1)
+            cursor.execute('DELETE FROM cambios_dispositivos WHERE seq <= ?', (hasta_seq,))
+            eliminados = cursor.rowcount
+            if eliminados:
+                cursor.execute('''INSERT INTO control_cambios (clave, valor) VALUES ('primer_conservado', ?)
+                                  ON CONFLICT (clave) DO UPDATE SET valor = MAX(valor, excluded.valor)''',
+                               (hasta_seq + 1,))
+            return eliminados
+    
+    def guardar_muchos(self, dispositivos):
+        """Inserta varios dispositivos en una sola transacción y les asigna su id"""
+        dispositivos = list(dispositivos)
+        if not dispositivos:
+            return
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            # Con el bloqueo de escritura tomado los ids AUTOINCREMENT quedan consecutivos
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.executemany('''INSERT INTO dispositivos
+                                  (nombre, ip, usuario, contraseña, tipo, frecuencia_backup, puerto_ssh)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                               [(d.nombre, d.ip, d.usuario, d.contraseña, d.tipo,
+                                 d.frecuencia_backup, d.puerto_ssh) for d in dispositivos])
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'dispositivos'")
+            ultimo_id = cursor.fetchone()[0]
+            for i, dispositivo in enumerate(dispositivos):
+                dispositivo.id = ultimo_id - len(dispositivos) + 1 + i
+    
+    def actualizar_muchos(self, dispositivos):
+        """Actualiza varios dispositivos en una sola transacción"""
+        dispositivos = list(dispositivos)
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''UPDATE dispositivos SET
+                                    nombre = ?, ip = ?, usuario = ?, contraseña = ?,
+                                    tipo = ?, frecuencia_backup = ?, puerto_ssh = ?
+                                  WHERE id = ?''',
+                               [(d.nombre, d.ip, d.usuario, d.contraseña, d.tipo,
+                                 d.frecuencia_backup, d.puerto_ssh, d.id) for d in dispositivos])
+            for d in dispositivos:
+                self._cache.pop(d.id, None)
+    
+    def exportar_csv(self, archivo):
+        """Escribe el inventario en un archivo de texto abierto (newline='') como CSV"""
+        escritor = csv.DictWriter(archivo, fieldnames=CAMPOS_INVENTARIO)
+        escritor.writeheader()
+        for dispositivo in self._iterar_todos():
+            escritor.writerow({campo: getattr(dispositivo, campo) for campo in CAMPOS_INVENTARIO})
+    
+    def exportar_json(self, archivo):
+        """Escribe el inventario como JSON Lines (un dispositivo por línea)"""
+        for dispositivo in self._iterar_todos():
+            fila = {campo: getattr(dispositivo, campo) for campo in CAMPOS_INVENTARIO}
+            archivo.write(json.dumps(fila, ensure_ascii=False) + "\n")
+    
+    def importar_csv(self, archivo, tamano_lote=1000):
+        """Importa dispositivos desde un CSV por lotes. Devuelve cuántos se importaron"""
+        return self._importar(csv.DictReader(archivo), tamano_lote)
+    
+    def importar_json(self, archivo, tamano_lote=1000):
+        """Importa dispositivos desde JSON Lines por lotes. Devuelve cuántos se importaron"""
+        return self._importar((json.loads(linea) for linea in archivo if linea.strip()), tamano_lote)
+    
+    def _importar(self, filas, tamano_lote):
+        total = 0
+        lote = []
+        for fila in filas:
+            datos = {campo: fila[campo] for campo in CAMPOS_INVENTARIO if campo in fila}
+            datos["puerto_ssh"] = int(datos.get("puerto_ssh") or 22)
+            lote.append(Dispositivo(**datos))
+            if len(lote) >= tamano_lote:
+                self.guardar_muchos(lote)
+                total += len(lote)
+                lote = []
+        self.guardar_muchos(lote)
+        return total + len(lote)
+    
+    def _iterar_todos(self, tamano_lote=1000):
+        """Recorre los dispositivos por lotes sin cargar toda la tabla en memoria"""
+        ultimo_id = 0
+        while True:
+            with self._conexion() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''SELECT id, nombre, ip, usuario, contraseña, tipo, frecuencia_backup, puerto_ssh
+                                  FROM dispositivos WHERE id > ? ORDER BY id LIMIT ?''', (ultimo_id, tamano_lote))
+                rows = cursor.fetchall()
+            if not rows:
+                return
             for row in rows:
-                dispositivos.append(Dispositivo(
-                    id=row[0],
-                    nombre=row[1],
-                    ip=row[2],
-                    usuario=row[3],
-                    contraseña=row[4],
-                    tipo=row[5],
-                    frecuencia_backup=row[6],
-                    puerto_ssh=row[7]  # Nuevo campo
-                ))
-            return dispositivos
+                yield Dispositivo(*row)
+            ultimo_id = rows[-1][0]
@@ -0,0 +1,241 @@
+import difflib
+import io
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from almacen_backups import normalizar_lineas
+from dispositivo import Dispositivo
+
+COMPLETA = "completa"
+DELTA = "delta"
+
+
+def calcular_delta(anteriores: list[str], nuevas: list[str]) -> list:
+    """
+    Delta por líneas de anteriores a nuevas: lista de ["c", i, j] (copiar las
+    líneas i..j de la versión anterior) y ["i", [líneas]] (insertar líneas nuevas)
+    """
+    operaciones = []
+    matcher = difflib.SequenceMatcher(None, anteriores, nuevas, autojunk=False)
+    for etiqueta, i1, i2, j1, j2 in matcher.get_opcodes():
+        if etiqueta == "equal":
+            operaciones.append(["c", i1, i2])
+        elif j2 > j1:  # replace o insert; los delete simplemente no se copian
+            operaciones.append(["i", nuevas[j1:j2]])
+    return operaciones
+
+
+def dividir_lineas(texto: str) -> list[str]:
+    """
+    Líneas sueltas (con su \n) del texto normalizado. normalizar_lineas agrupa las líneas
+    vacías con la siguiente, y los deltas deben calcularse sobre las mismas líneas que
+    se obtienen al leer una versión completa
+    """
+    return [linea + "\n" for linea in texto.split("\n")[:-1]]
+
+
+def aplicar_delta(anteriores: list[str], operaciones: list) -> list[str]:
+    resultado = []
+    for operacion in operaciones:
+        if operacion[0] == "c":
+            resultado.extend(anteriores[operacion[1]:operacion[2]])
+        else:
+            resultado.extend(operacion[1])
+    return resultado
+
+
+class HistorialDeltas:
+    """
+    Historial de configuraciones que guarda una versión completa cada
+    `intervalo_completa` versiones y, entre medias, solo los cambios por líneas
+    respecto a la versión anterior. Reconstruir cualquier versión aplica como
+    mucho intervalo_completa - 1 deltas
+    """
+
+    def __init__(self, db_path='dispositivos.db', intervalo_completa: int = 20):
+        if intervalo_completa < 1:
+            raise ValueError("intervalo_completa debe ser mayor que 0")
+        self.db_path = db_path
+        self.intervalo_completa = intervalo_completa
+        self._lock = threading.Lock()
+        self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS versiones_configuracion (
+                                dispositivo_id INTEGER NOT NULL,
+                                version INTEGER NOT NULL,
+                                fecha REAL NOT NULL,
+                                tipo TEXT NOT NULL,
+                                contenido BLOB NOT NULL,
+                                PRIMARY KEY (dispositivo_id, version)
+                              )''')
+            conn.commit()
+
+    def guardar(self, dispositivo: Dispositivo, configuracion: str, fecha: float = None) -> str:
+        """Añade una versión al historial del dispositivo. Devuelve una referencia a la versión"""
+        lineas = list(normalizar_lineas(io.StringIO(configuracion, newline=None)))
+        return self._guardar_lineas(dispositivo, lineas, fecha)
+
+    def guardar_archivo(self, dispositivo: Dispositivo, ruta_archivo: str, fecha: float = None) -> str:
+        with open(ruta_archivo, 'r', encoding='utf-8', errors='ignore') as f:
+            return self._guardar_lineas(dispositivo, list(normalizar_lineas(f)), fecha)
+
+    def _guardar_lineas(self, dispositivo, lineas, fecha):
+        lineas = dividir_lineas("".join(lineas))
+        with self._lock:
+            while True:
+                ultima = self._ultima_version(dispositivo.id)
+                # El delta se calcula fuera de la transacción para no retener el bloqueo de escritura
+                tipo, datos = self._codificar(dispositivo.id, ultima, lineas)
+                with self._transaccion() as cursor:
+                    # Otro proceso pudo guardar entre medias: la versión se asigna e inserta bajo el bloqueo
+                    cursor.execute('SELECT MAX(version) FROM versiones_configuracion WHERE dispositivo_id = ?',
+                                   (dispositivo.id,))
+                    vigente = cursor.fetchone()[0] == ultima
+                    if vigente:
+                        version = (ultima or 0) + 1
+                        cursor.execute('''INSERT INTO versiones_configuracion (dispositivo_id, version, fecha, tipo, contenido)
+                                          VALUES (?, ?, ?, ?, ?)''',
+                                       (dispositivo.id, version, fecha or time.time(), tipo, zlib.compress(datos)))
+                if vigente:
+                    return f"{self.db_path}#dispositivo={dispositivo.id}&version={version}"
+
+    def _codificar(self, dispositivo_id, ultima, lineas) -> tuple:
+        """(tipo, datos) de la versión siguiente a `ultima`: delta respecto a ella o versión completa"""
+        tipo, datos = COMPLETA, "".join(lineas).encode('utf-8')
+        ultima_completa = self._version_completa_base(dispositivo_id, ultima) if ultima else None
+        if ultima and ultima + 1 - ultima_completa < self.intervalo_completa:
+            delta = json.dumps(calcular_delta(self._reconstruir(dispositivo_id, ultima), lineas),
+                               ensure_ascii=False).encode('utf-8')
+            # Un cambio casi total ocupa más como delta que como versión completa
+            if len(delta) < len(datos):
+                tipo, datos = DELTA, delta
+        return tipo, datos
+
+    @contextmanager
+    def _transaccion(self):
+        """Transacción de escritura: BEGIN IMMEDIATE serializa, también entre procesos, la asignación de versiones"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn.cursor()
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def versiones(self, dispositivo_id) -> list[tuple]:
+        """Versiones del dispositivo como (version, fecha, tipo), de la más antigua a la más reciente"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT version, fecha, tipo FROM versiones_configuracion
+                              WHERE dispositivo_id = ? ORDER BY version''', (dispositivo_id,))
+            return cursor.fetchall()
+
+    def leer_version(self, dispositivo_id, version: int = None) -> str:
+        """Reconstruye la versión indicada (por defecto la última)"""
+        version = version or self._ultima_version(dispositivo_id)
+        if version is None:
+            return None
+        return "".join(self._reconstruir(dispositivo_id, version))
+
+    def diferencias(self, dispositivo_id, version_a: int, version_b: int) -> list[str]:
+        """
+        Diff unificado entre dos versiones. Si ambas comparten versión completa base,
+        se aplican una sola vez los deltas hasta la más reciente
+        """
+        primera, segunda = sorted((version_a, version_b))
+        base_primera = self._version_completa_base(dispositivo_id, primera)
+        base_segunda = self._version_completa_base(dispositivo_id, segunda)
+        if base_primera == base_segunda:
+            reconstruidas = self._reconstruir_cadena(dispositivo_id, base_primera, segunda, {primera, segunda})
+            lineas_primera, lineas_segunda = reconstruidas[primera], reconstruidas[segunda]
+        else:
+            lineas_primera = self._reconstruir(dispositivo_id, primera)
+            lineas_segunda = self._reconstruir(dispositivo_id, segunda)
+        if (version_a, version_b) != (primera, segunda):
+            lineas_primera, lineas_segunda = lineas_segunda, lineas_primera
+        return list(difflib.unified_diff(lineas_primera, lineas_segunda,
+                                         fromfile=f"version {version_a}", tofile=f"version {version_b}"))
+
+    def limpiar_antiguos(self, dispositivo: Dispositivo, dias_retencion: int = 30) -> int:
+        """
+        Borra las versiones vencidas. Se conservan las anteriores necesarias para
+        reconstruir la versión vigente más antigua (desde su versión completa base)
+        """
+        fecha_limite = (datetime.now() - timedelta(days=dias_retencion)).timestamp()
+        with self._lock:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''SELECT MIN(version) FROM versiones_configuracion
+                                  WHERE dispositivo_id = ? AND fecha >= ?''', (dispositivo.id, fecha_limite))
+                primera_vigente = cursor.fetchone()[0]
+            if primera_vigente is None:
+                # Nada vigente: se conserva al menos la última versión
+                primera_vigente = self._ultima_version(dispositivo.id)
+                if primera_vigente is None:
+                    return 0
+            base = self._version_completa_base(dispositivo.id, primera_vigente)
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM versiones_configuracion WHERE dispositivo_id = ? AND version < ?',
+                               (dispositivo.id, base))
+                eliminadas = cursor.rowcount
+                conn.commit()
+        return eliminadas
+
+    def _ultima_version(self, dispositivo_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(version) FROM versiones_configuracion WHERE dispositivo_id = ?',
+                           (dispositivo_id,))
+            return cursor.fetchone()[0]
+
+    def _version_completa_base(self, dispositivo_id, version: int) -> int:
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT MAX(version) FROM versiones_configuracion
+                              WHERE dispositivo_id = ? AND version <= ? AND tipo = ?''',
+                           (dispositivo_id, version, COMPLETA))
+            base = cursor.fetchone()[0]
+        if base is None:
+            raise Exception(f"No hay versión completa para reconstruir la versión {version}")
+        return base
+
+    def _reconstruir(self, dispositivo_id, version: int) -> list[str]:
+        base = self._version_completa_base(dispositivo_id, version)
+        return self._reconstruir_cadena(dispositivo_id, base, version, {version})[version]
+
+    def _reconstruir_cadena(self, dispositivo_id, base: int, hasta: int, pedidas: set) -> dict:
+        """Lee de una vez las filas base..hasta y devuelve las líneas de las versiones pedidas"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT version, tipo, contenido FROM versiones_configuracion
+                              WHERE dispositivo_id = ? AND version BETWEEN ? AND ? ORDER BY version''',
+                           (dispositivo_id, base, hasta))
+            filas = cursor.fetchall()
+
+        resultado = {}
+        lineas = []
+        for version, tipo, contenido in filas:
+            datos = zlib.decompress(contenido).decode('utf-8')
+            if tipo == COMPLETA:
+                # Las líneas normalizadas terminan siempre en \n
+                lineas = dividir_lineas(datos)
+            else:
+                lineas = aplicar_delta(lineas, json.loads(datos))
+            if version in pedidas:
+                resultado[version] = lineas
+        faltantes = pedidas - resultado.keys()
+        if faltantes:
+            raise Exception(f"Versiones inexistentes: {sorted(faltantes)}")
+        return resultado
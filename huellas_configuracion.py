@@ -0,0 +1,59 @@
+import hashlib
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+
+class HuellasConfiguracion:
+    """
+    Resultado de la sonda de cambios de cada dispositivo en su último backup completo.
+    Si la sonda devuelve lo mismo que entonces, la configuración no ha cambiado y no
+    hace falta descargarla otra vez. Pasados `dias_refresco` días se descarga igualmente,
+    para que la retención nunca se quede sin el último backup
+    """
+
+    def __init__(self, db_path='dispositivos.db', dias_refresco: int = 7):
+        self.db_path = db_path
+        self.dias_refresco = dias_refresco
+        self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS huellas_configuracion (
+                                dispositivo_id INTEGER PRIMARY KEY,
+                                sonda TEXT NOT NULL,
+                                huella TEXT NOT NULL,
+                                fecha REAL NOT NULL
+                              )''')
+            conn.commit()
+
+    @staticmethod
+    def calcular(salida: bytes) -> str:
+        """Huella de la salida de la sonda, sin retornos de carro ni espacios sobrantes"""
+        lineas = salida.replace(b"\r", b"").strip().splitlines()
+        return hashlib.sha256(b"\n".join(linea.rstrip() for linea in lineas)).hexdigest()
+
+    def sin_cambios(self, dispositivo_id, sonda: str, huella: str) -> bool:
+        """True si la sonda coincide con la del último backup completo y este no ha caducado"""
+        fecha_limite = (datetime.now() - timedelta(days=self.dias_refresco)).timestamp()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT 1 FROM huellas_configuracion
+                              WHERE dispositivo_id = ? AND sonda = ? AND huella = ? AND fecha >= ?''',
+                           (dispositivo_id, sonda, huella, fecha_limite))
+            return cursor.fetchone() is not None
+
+    def guardar(self, dispositivo_id, sonda: str, huella: str, fecha: float = None) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''INSERT OR REPLACE INTO huellas_configuracion (dispositivo_id, sonda, huella, fecha)
+                              VALUES (?, ?, ?, ?)''', (dispositivo_id, sonda, huella, fecha or time.time()))
+            conn.commit()
+
+    def olvidar(self, ids) -> None:
+        """Descarta las huellas (p.ej. si el dispositivo cambió de IP): el próximo backup será completo"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM huellas_configuracion WHERE dispositivo_id = ?', [(i,) for i in ids])
+            conn.commit()
@@ -0,0 +1,137 @@
+import argparse
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from dispositivo import Dispositivo, DispositivoDAO
+
+
+class IndiceConfiguraciones:
+    """
+    Índice de texto completo (SQLite FTS5) sobre las líneas de las configuraciones
+    respaldadas. Cada contenido distinto se indexa una sola vez; los backups sin
+    cambios solo añaden una fila que apunta al contenido ya indexado
+    """
+
+    def __init__(self, db_path='dispositivos.db'):
+        self.db_path = db_path
+        self._crear_tablas()
+
+    def _crear_tablas(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS contenidos_indexados (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                hash TEXT NOT NULL UNIQUE
+                              )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS backups_indexados (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                dispositivo_id INTEGER NOT NULL,
+                                fecha REAL NOT NULL,
+                                contenido_id INTEGER NOT NULL,
+                                ultimo INTEGER NOT NULL DEFAULT 1
+                              )''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_backups_indexados_dispositivo
+                              ON backups_indexados (dispositivo_id, fecha)''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_backups_indexados_contenido
+                              ON backups_indexados (contenido_id, ultimo)''')
+            # tokenchars mantiene juntas direcciones IP, nombres de interfaz y rutas
+            cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS lineas_config USING fts5(
+                                linea, contenido_id UNINDEXED, numero UNINDEXED,
+                                tokenize = "unicode61 tokenchars './:'"
+                              )''')
+            conn.commit()
+
+    def indexar_archivo(self, dispositivo: Dispositivo, ruta_archivo: str, hash_contenido: str,
+                        fecha: float = None) -> None:
+        """Registra un backup del dispositivo e indexa sus líneas si el contenido es nuevo"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM contenidos_indexados WHERE hash = ?', (hash_contenido,))
+            row = cursor.fetchone()
+            if row:
+                contenido_id = row[0]
+            else:
+                cursor.execute('INSERT INTO contenidos_indexados (hash) VALUES (?)', (hash_contenido,))
+                contenido_id = cursor.lastrowid
+                with open(ruta_archivo, 'r', encoding='utf-8', errors='ignore') as f:
+                    cursor.executemany('INSERT INTO lineas_config (linea, contenido_id, numero) VALUES (?, ?, ?)',
+                                       ((linea.rstrip("\r\n"), contenido_id, numero)
+                                        for numero, linea in enumerate(f, start=1) if linea.strip()))
+
+            cursor.execute('UPDATE backups_indexados SET ultimo = 0 WHERE dispositivo_id = ? AND ultimo = 1',
+                           (dispositivo.id,))
+            cursor.execute('''INSERT INTO backups_indexados (dispositivo_id, fecha, contenido_id, ultimo)
+                              VALUES (?, ?, ?, 1)''', (dispositivo.id, fecha or time.time(), contenido_id))
+            conn.commit()
+
+    def buscar(self, texto: str, solo_ultimo: bool = True, dispositivo_id=None, limite: int = 500,
+               consulta_fts: bool = False) -> list[tuple]:
+        """
+        Líneas que contienen el texto como (dispositivo_id, fecha, numero_linea, linea).
+        Por defecto solo en el último backup de cada dispositivo; con solo_ultimo=False
+        en todo el historial indexado. consulta_fts=True pasa el texto tal cual como consulta FTS5
+        """
+        consulta = texto if consulta_fts else '"' + texto.replace('"', '""') + '"'
+        condiciones = ["lineas_config MATCH ?"]
+        parametros = [consulta]
+        if solo_ultimo:
+            condiciones.append("b.ultimo = 1")
+        if dispositivo_id is not None:
+            condiciones.append("b.dispositivo_id = ?")
+            parametros.append(dispositivo_id)
+        parametros.append(limite)
+
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''SELECT b.dispositivo_id, b.fecha, lineas_config.numero, lineas_config.linea
+                               FROM lineas_config
+                               JOIN backups_indexados b ON b.contenido_id = lineas_config.contenido_id
+                               WHERE {' AND '.join(condiciones)}
+                               ORDER BY b.dispositivo_id, b.fecha DESC, lineas_config.numero
+                               LIMIT ?''', parametros)
+            return cursor.fetchall()
+
+    def limpiar_antiguos(self, dispositivo: Dispositivo, dias_retencion: int = 30) -> int:
+        """Quita del índice los backups vencidos (nunca el último) y los contenidos que dejan de usarse"""
+        fecha_limite = (datetime.now() - timedelta(days=dias_retencion)).timestamp()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT DISTINCT contenido_id FROM backups_indexados
+                              WHERE dispositivo_id = ? AND fecha < ? AND ultimo = 0''',
+                           (dispositivo.id, fecha_limite))
+            candidatos = [row[0] for row in cursor.fetchall()]
+            cursor.execute('''DELETE FROM backups_indexados
+                              WHERE dispositivo_id = ? AND fecha < ? AND ultimo = 0''',
+                           (dispositivo.id, fecha_limite))
+            eliminados = cursor.rowcount
+            for contenido_id in candidatos:
+                cursor.execute('SELECT 1 FROM backups_indexados WHERE contenido_id = ? LIMIT 1', (contenido_id,))
+                if cursor.fetchone() is None:
+                    cursor.execute('DELETE FROM lineas_config WHERE contenido_id = ?', (contenido_id,))
+                    cursor.execute('DELETE FROM contenidos_indexados WHERE id = ?', (contenido_id,))
+            conn.commit()
+        return eliminados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Busca texto en las configuraciones respaldadas")
+    parser.add_argument("texto", help='Texto a buscar, p.ej. "snmp-server community public"')
+    parser.add_argument("--historial", action="store_true", help="Busca en todo el historial, no solo el último backup")
+    parser.add_argument("--fts", action="store_true", help="Interpreta el texto como consulta FTS5 (AND, OR, NEAR, prefijo*)")
+    parser.add_argument("--limite", type=int, default=500)
+    parser.add_argument("--db", default="dispositivos.db", help="Ruta de la base de datos de dispositivos")
+    args = parser.parse_args()
+
+    dao = DispositivoDAO(args.db)
+    nombres = {}
+    resultados = IndiceConfiguraciones(args.db).buscar(args.texto, solo_ultimo=not args.historial,
+                                                        limite=args.limite, consulta_fts=args.fts)
+    for dispositivo_id, fecha, numero, linea in resultados:
+        if dispositivo_id not in nombres:
+            dispositivo = dao.obtener_por_id(dispositivo_id)
+            nombres[dispositivo_id] = dispositivo.nombre if dispositivo else f"#{dispositivo_id}"
+        print(f"{nombres[dispositivo_id]} [{datetime.fromtimestamp(fecha):%Y-%m-%d %H:%M}] {numero}: {linea}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import argparse
+import sys
+from dispositivo import DispositivoDAO
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa o exporta el inventario de dispositivos (CSV o JSON Lines)")
+    parser.add_argument("accion", choices=["importar", "exportar"])
+    parser.add_argument("archivo", help="Ruta del archivo, o - para stdin/stdout")
+    parser.add_argument("--formato", choices=["csv", "json"],
+                        help="Por defecto se deduce de la extensión (.csv o .jsonl/.json)")
+    parser.add_argument("--db", default="dispositivos.db", help="Ruta de la base de datos de dispositivos")
+    args = parser.parse_args()
+
+    formato = args.formato or ("csv" if args.archivo.lower().endswith(".csv") else "json")
+    dao = DispositivoDAO(args.db, persistente=True)
+    try:
+        if args.accion == "exportar":
+            archivo = sys.stdout if args.archivo == "-" else open(args.archivo, 'w', encoding='utf-8', newline='')
+            with archivo:
+                (dao.exportar_csv if formato == "csv" else dao.exportar_json)(archivo)
+        else:
+            archivo = sys.stdin if args.archivo == "-" else open(args.archivo, 'r', encoding='utf-8', newline='')
+            with archivo:
+                total = (dao.importar_csv if formato == "csv" else dao.importar_json)(archivo)
+            print(f"[*] {total} dispositivos importados")
+    finally:
+        dao.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,103 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from dispositivo import Dispositivo, DispositivoDAO
-from backup_manager import BackupManager
 import threading
-import ttkbootstrap as tb
-import paramiko
+import bisect
+import os
+import queue
+from collections import deque
+from concurrent.futures import Future
 import time
-from PIL import Image, ImageTk
+
+TIPOS = ["Router", "Switch", "Firewall", "Servidor", "Otro"]
+FRECUENCIAS = ["Diario", "Semanal", "Mensual", "Manual"]
+TAMANO_PAGINA = 200  # Filas que se cargan en el listado cada vez que se llega al final
+MAX_LINEAS_LOG = 1000  # Líneas que conserva el registro de actividades
+INTERVALO_LOG_MS = 100  # Cada cuánto se vuelca al registro lo que encolaron los hilos
+NIVELES_LOG = ["info", "warning", "error"]
+FILTROS_LOG = {"Todo": "info", "Advertencias": "warning", "Errores": "error"}
+LOGO = "logo.png"
+LOGO_CACHE = ".logo_splash.png"  # Logo ya redimensionado para el splash
+TAMANO_LOGO = (500, 500)
 
 class BackupApp:
-    def __init__(self, root):
+    def __init__(self, root, artefactos=False):
         self.root = root
+        # Con artefactos se capturan también los comandos adicionales del perfil en un shell interactivo
+        self.artefactos = artefactos
         self.root.title("Gestor de Backups de Red")
         self.root.state('zoomed')
 
-        self.dao = DispositivoDAO()
-        self.backup_manager = BackupManager()
+        self.dao = DispositivoDAO(persistente=True)
+        # paramiko y los módulos de backup se cargan en segundo plano mientras se construye la interfaz
+        self._servicios = Future()
+        threading.Thread(target=self._crear_servicios, daemon=True).start()
+        self.ejecucion = None
+        self._barrido_en_curso = False
+        self._estados_barrido = queue.SimpleQueue()
         self.dispositivo_actual = None
 
+        self._cola_log = queue.SimpleQueue()
+        self._lineas_log = deque(maxlen=MAX_LINEAS_LOG)
+        self._busqueda_pendiente = None
+        self._pagina_pendiente = False
+        self._lista_completa = True
         self.setup_ui()
         self.cargar_dispositivos()
+        self.root.after(5000, self._vigilar_cambios)
+        self.root.after(INTERVALO_LOG_MS, self._vaciar_log)
+
+    def _crear_servicios(self):
+        try:
+            from backup_manager import BackupManager
+            from barrido import BarridoAlcanzabilidad
+            from catalogo_backups import CatalogoBackups
+            from cortacircuitos import CortacircuitosDispositivos
+            from huellas_configuracion import HuellasConfiguracion
+            from indice_busqueda import IndiceConfiguraciones
+            from motor_backup import MotorBackup
+            from pool_ssh import PoolSesionesSSH
+            from transporte_ssh import TransporteDispositivos
+
+            artefactos = None
+            if self.artefactos:
+                from artefactos_backup import ArtefactosBackup
+                artefactos = ArtefactosBackup(self.dao.db_path)
+
+            pool_ssh = PoolSesionesSSH()
+            transporte = TransporteDispositivos(self.dao.db_path)
+            backup_manager = BackupManager(pool=pool_ssh, catalogo=CatalogoBackups(self.dao.db_path),
+                                           indice=IndiceConfiguraciones(self.dao.db_path),
+                                           artefactos=artefactos,
+                                           cortacircuitos=CortacircuitosDispositivos(self.dao.db_path),
+                                           huellas=HuellasConfiguracion(self.dao.db_path),
+                                           transporte=transporte)
+            motor = MotorBackup(backup_manager, self.dao, al_progresar=self._backup_masivo_progreso,
+                                al_terminar=self._backup_masivo_terminado)
+            self._servicios.set_result({"pool_ssh": pool_ssh, "backup_manager": backup_manager, "motor": motor,
+                                        "barrido": BarridoAlcanzabilidad(self.dao, pool=pool_ssh, transporte=transporte)})
+        except BaseException as e:
+            self._servicios.set_exception(e)
+
+    # Si se usan antes de terminar la carga en segundo plano, esperan a que termine
+    @property
+    def pool_ssh(self):
+        return self._servicios.result()["pool_ssh"]
+
+    @property
+    def backup_manager(self):
+        return self._servicios.result()["backup_manager"]
+
+    @property
+    def motor(self):
+        return self._servicios.result()["motor"]
+
+    @property
+    def barrido(self):
+        return self._servicios.result()["barrido"]
 
     def setup_ui(self):
+        import ttkbootstrap as tb
         estilo = tb.Style("minty")
 
         estilo.configure("info.TLabelframe.Label", font=("Segoe UI", 14, "bold"))
@@ -40,8 +116,8 @@ class BackupApp:
             ("Usuario", "usuario_entry"),
             ("Contraseña", "contraseña_entry"),
             ("Puerto SSH", "puerto_entry"),
-            ("Tipo", "tipo_combobox", ["Router", "Switch", "Firewall", "Servidor", "Otro"]),
-            ("Frecuencia Backup", "frecuencia_combobox", ["Diario", "Semanal", "Mensual", "Manual"])
+            ("Tipo", "tipo_combobox", TIPOS),
+            ("Frecuencia Backup", "frecuencia_combobox", FRECUENCIAS)
         ]
 
         self.campos = {}
@@ -72,10 +148,27 @@ class BackupApp:
         list_frame = ttk.LabelFrame(main_frame, text="Dispositivos Registrados", padding=10, style="info.TLabelframe")
         list_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=5, pady=5)
 
-        self.tree = ttk.Treeview(list_frame, columns=('Nombre', 'IP', 'Puerto', 'Tipo', 'Frecuencia'), show='headings', height=15)
-        for col, anchor in [('Nombre', 'w'), ('IP', 'center'), ('Puerto', 'center'), ('Tipo', 'center'), ('Frecuencia', 'center')]:
+        filtro_frame = ttk.Frame(list_frame)
+        filtro_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(filtro_frame, text="Buscar:", font=("Segoe UI", 12)).pack(side=tk.LEFT, padx=5)
+        self.busqueda_entry = ttk.Entry(filtro_frame, font=("Segoe UI", 12))
+        self.busqueda_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.busqueda_entry.bind("<KeyRelease>", self._programar_busqueda)
+        self.filtro_tipo = ttk.Combobox(filtro_frame, values=[""] + TIPOS, state="readonly", width=10)
+        self.filtro_frecuencia = ttk.Combobox(filtro_frame, values=[""] + FRECUENCIAS, state="readonly", width=10)
+        for filtro in (self.filtro_tipo, self.filtro_frecuencia):
+            filtro.pack(side=tk.LEFT, padx=5)
+            filtro.bind("<<ComboboxSelected>>", self._programar_busqueda)
+
+        tree_frame = ttk.Frame(list_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(tree_frame, columns=('Nombre', 'IP', 'Puerto', 'Tipo', 'Frecuencia', 'Estado'), show='headings', height=15)
+        for col, anchor in [('Nombre', 'w'), ('IP', 'center'), ('Puerto', 'center'), ('Tipo', 'center'), ('Frecuencia', 'center'), ('Estado', 'center')]:
             self.tree.heading(col, text=col)
             self.tree.column(col, anchor=anchor, width=120)
+        self.tree_scroll = ttk.Scrollbar(tree_frame, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._al_desplazar_lista)
+        self.tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
         self.tree.pack(fill=tk.BOTH, expand=True)
 
         btn_frame = ttk.Frame(list_frame)
@@ -85,7 +178,10 @@ class BackupApp:
             ("✏️ Editar", self.editar_dispositivo, "primary.Outline.TButton"),
             ("🗑️ Eliminar", self.eliminar_dispositivo, "danger.Outline.TButton"),
             ("💾 Backup", self.realizar_backup_seleccionado, "success.Outline.TButton"),
-            ("🔍 Probar SSH", self.probar_conexion_ssh, "info.Outline.TButton")
+            ("📦 Backup Todos", self.realizar_backup_todos, "success.Outline.TButton"),
+            ("⏹ Detener", self.detener_backups, "warning.Outline.TButton"),
+            ("🔍 Probar SSH", self.probar_conexion_ssh, "info.Outline.TButton"),
+            ("📡 Barrido", self.barrer_alcanzabilidad, "info.Outline.TButton")
         ]
 
         for text, cmd, style in action_buttons:
@@ -96,7 +192,17 @@ class BackupApp:
         log_frame = ttk.LabelFrame(self.root, text="Registro de Actividades", padding=10, style="primary.TLabelframe")
         log_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0,10))
 
+        log_filtro_frame = ttk.Frame(log_frame)
+        log_filtro_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(log_filtro_frame, text="Mostrar:", font=("Segoe UI", 11)).pack(side=tk.LEFT, padx=5)
+        self.filtro_log = ttk.Combobox(log_filtro_frame, values=list(FILTROS_LOG), state="readonly", width=14)
+        self.filtro_log.set("Todo")
+        self.filtro_log.pack(side=tk.LEFT, padx=5)
+        self.filtro_log.bind("<<ComboboxSelected>>", lambda e: self._redibujar_log())
+
         self.log_text = tk.Text(log_frame, height=8, state=tk.DISABLED, wrap=tk.WORD, bg="#1e1e1e", fg="#d4d4d4", font=("Consolas", 11), insertbackground="white", relief=tk.SUNKEN, borderwidth=2)
+        self.log_text.tag_configure("warning", foreground="#e5c07b")
+        self.log_text.tag_configure("error", foreground="#f14c4c")
         scrollbar = ttk.Scrollbar(log_frame, command=self.log_text.yview)
         self.log_text.configure(yscrollcommand=scrollbar.set)
 
@@ -104,11 +210,78 @@ class BackupApp:
         self.log_text.pack(fill=tk.BOTH, expand=True)
         
     def cargar_dispositivos(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        dispositivos = self.dao.obtener_todos()
-        for d in dispositivos:
-            self.tree.insert('', tk.END, values=(d.nombre, d.ip, d.puerto_ssh, d.tipo, d.frecuencia_backup), iid=d.id)
+        """Recarga el listado desde la primera página con el filtro actual"""
+        self.tree.delete(*self.tree.get_children())
+        self._ultimo_id_cargado = 0
+        self._lista_completa = False
+        self._seq_cambios = self.dao.ultimo_cambio()
+        self._cargar_pagina()
+
+    def _filtro_actual(self):
+        return dict(texto=self.busqueda_entry.get().strip(), tipo=self.filtro_tipo.get(),
+                    frecuencia=self.filtro_frecuencia.get())
+
+    def _cargar_pagina(self):
+        self._pagina_pendiente = False
+        if self._lista_completa:
+            return
+        filas = self.dao.buscar(**self._filtro_actual(), despues_de_id=self._ultimo_id_cargado, limite=TAMANO_PAGINA)
+        for id_dispositivo, *valores in filas:
+            self.tree.insert('', tk.END, values=valores, iid=id_dispositivo)
+        if filas:
+            self._ultimo_id_cargado = filas[-1][0]
+        self._lista_completa = len(filas) < TAMANO_PAGINA
+
+    def _al_desplazar_lista(self, primero, ultimo):
+        self.tree_scroll.set(primero, ultimo)
+        # Cerca del final se pide la página siguiente (fuera del callback para no anidar inserciones)
+        if float(ultimo) > 0.9 and not self._lista_completa and not self._pagina_pendiente:
+            self._pagina_pendiente = True
+            self.root.after_idle(self._cargar_pagina)
+
+    def _programar_busqueda(self, event=None):
+        if self._busqueda_pendiente:
+            self.root.after_cancel(self._busqueda_pendiente)
+        self._busqueda_pendiente = self.root.after(300, self._buscar)
+
+    def _buscar(self):
+        self._busqueda_pendiente = None
+        self.cargar_dispositivos()
+
+    def aplicar_cambios(self):
+        """Actualiza en el listado solo las filas creadas, editadas o eliminadas desde la última carga"""
+        ids, seq = self.dao.obtener_cambios_desde(self._seq_cambios)
+        if not ids:
+            return
+        if len(ids) > TAMANO_PAGINA:
+            # Tras una importación masiva es más barato recargar desde la primera página
+            self.cargar_dispositivos()
+            return
+        vigentes = {fila[0]: fila[1:] for fila in self.dao.buscar(**self._filtro_actual(), ids=ids, limite=len(ids))}
+        # Solo se avanza una vez leídos: si la consulta falla, los cambios se reintentan en la próxima vuelta
+        self._seq_cambios = seq
+        for id_dispositivo in ids:
+            if id_dispositivo not in vigentes:
+                if self.tree.exists(id_dispositivo):
+                    self.tree.delete(id_dispositivo)
+            elif self.tree.exists(id_dispositivo):
+                self.tree.item(id_dispositivo, values=vigentes[id_dispositivo])
+            elif id_dispositivo < self._ultimo_id_cargado:
+                # Dentro del tramo ya cargado: se inserta en su posición según el id
+                cargados = [int(iid) for iid in self.tree.get_children()]
+                posicion = bisect.bisect(cargados, id_dispositivo)
+                self.tree.insert('', posicion, values=vigentes[id_dispositivo], iid=id_dispositivo)
+            elif self._lista_completa:
+                self.tree.insert('', tk.END, values=vigentes[id_dispositivo], iid=id_dispositivo)
+                self._ultimo_id_cargado = id_dispositivo
+            # Si no, aparecerá al cargar las páginas siguientes
+
+    def _vigilar_cambios(self):
+        """Recoge periódicamente cambios hechos por otros procesos (importaciones, programador)"""
+        try:
+            self.aplicar_cambios()
+        finally:
+            self.root.after(5000, self._vigilar_cambios)
 
     def mostrar_formulario(self, dispositivo=None):
         self.limpiar_formulario()
@@ -152,12 +325,16 @@ class BackupApp:
             if self.dispositivo_actual:
                 dispositivo.id = self.dispositivo_actual.id
                 self.dao.actualizar(dispositivo)
+                self.pool_ssh.invalidar(self.dispositivo_actual)
+                self.backup_manager.cortacircuitos.reiniciar([dispositivo.id])
+                self.backup_manager.huellas.olvidar([dispositivo.id])
+                self.backup_manager.transporte.olvidar_rendimiento([dispositivo.id])
                 self.log(f"Dispositivo actualizado: {nombre} ({ip}:{puerto})")
             else:
                 self.dao.guardar(dispositivo)
                 self.log(f"Dispositivo agregado: {nombre} ({ip}:{puerto})")
 
-            self.cargar_dispositivos()
+            self.aplicar_cambios()
             self.limpiar_formulario()
 
         except ValueError as e:
@@ -177,27 +354,55 @@ class BackupApp:
             dispositivo = self.dao.obtener_por_id(int(seleccionado[0]))
             if messagebox.askyesno("Confirmar eliminación", f"¿Está seguro de eliminar el dispositivo:\n\n{dispositivo.nombre} ({dispositivo.ip})?", icon='warning'):
                 self.dao.eliminar(dispositivo.id)
+                self.pool_ssh.invalidar(dispositivo)
                 self.log(f"Dispositivo eliminado: {dispositivo.nombre}")
-                self.cargar_dispositivos()
+                self.aplicar_cambios()
         else:
             messagebox.showwarning("Selección requerida", "Por favor seleccione un dispositivo de la lista")
 
     def realizar_backup_seleccionado(self):
-        if seleccionado := self.tree.selection():
+        if len(seleccionado := self.tree.selection()) > 1:
+            self._iniciar_backup_masivo(lambda: self.motor.respaldar_seleccion(int(i) for i in seleccionado))
+        elif seleccionado:
             dispositivo = self.dao.obtener_por_id(int(seleccionado[0]))
             self.log(f"Iniciando backup de {dispositivo.nombre}...")
             threading.Thread(target=self._realizar_backup, args=(dispositivo,), daemon=True).start()
         else:
             messagebox.showwarning("Selección requerida", "Por favor seleccione un dispositivo de la lista")
 
+    def realizar_backup_todos(self):
+        self._iniciar_backup_masivo(self.motor.respaldar_todos)
+
+    def _iniciar_backup_masivo(self, lanzar):
+        if self.ejecucion and not self.ejecucion.resumen.fin:
+            messagebox.showwarning("Backup en curso", "Ya hay una ejecución de backups en curso")
+            return
+        self.ejecucion = lanzar()
+        self.log(f"Iniciando backup de {self.ejecucion.resumen.total} dispositivos...")
+
+    def detener_backups(self):
+        if self.ejecucion and not self.ejecucion.resumen.fin:
+            self.ejecucion.cancelar()
+            self.log("Cancelando backups pendientes...", "warning")
+
+    def _backup_masivo_progreso(self, dispositivo, estado, resumen):
+        from backup_manager import EXITOSO, OMITIDO, SIN_CAMBIOS
+        nivel = "info" if estado in (EXITOSO, SIN_CAMBIOS) else "warning" if estado == OMITIDO else "error"
+        self.log(f"[{resumen.procesados}/{resumen.total}] {dispositivo.nombre}: {estado}", nivel)
+
+    def _backup_masivo_terminado(self, resumen):
+        self.log(f"Backup masivo finalizado: {resumen}")
+
     def _realizar_backup(self, dispositivo):
         try:
-            if self.backup_manager.realizar_backup(dispositivo):
+            # Un backup pedido a mano se intenta aunque el dispositivo esté en espera por fallos
+            if self.backup_manager.realizar_backup(dispositivo, forzar=True):
+                self.dao.registrar_backup_exitoso(dispositivo.id)
                 self.log(f"✓ Backup completado: {dispositivo.nombre}")
             else:
-                self.log(f"✗ Falló backup: {dispositivo.nombre}")
+                self.log(f"✗ Falló backup: {dispositivo.nombre}", "error")
         except Exception as e:
-            self.log(f"⚠ Error durante backup: {str(e)}")
+            self.log(f"⚠ Error durante backup: {str(e)}", "error")
 
     def probar_conexion_ssh(self):
         if seleccionado := self.tree.selection():
@@ -209,20 +414,100 @@ class BackupApp:
 
     def _probar_conexion_ssh(self, dispositivo):
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(hostname=dispositivo.ip, port=dispositivo.puerto_ssh, username=dispositivo.usuario, password=dispositivo.contraseña, timeout=5, look_for_keys=False, allow_agent=False)
-            ssh.close()
+            with self.pool_ssh.sesion(dispositivo, timeout=5,
+                                      ajustes=self.backup_manager.transporte.ajustes(dispositivo.id)):
+                pass
             self.log(f"✓ Conexión SSH exitosa: {dispositivo.nombre} ({dispositivo.ip}:{dispositivo.puerto_ssh})")
         except Exception as e:
-            self.log(f"✗ Falló conexión SSH: {str(e)}")
+            self.log(f"✗ Falló conexión SSH: {str(e)}", "error")
+
+    def barrer_alcanzabilidad(self):
+        """Comprueba la alcanzabilidad de los dispositivos seleccionados, o de todos si no hay selección"""
+        if self._barrido_en_curso:
+            messagebox.showwarning("Barrido en curso", "Ya hay un barrido de alcanzabilidad en curso")
+            return
+        ids = [int(i) for i in self.tree.selection()]
+        self._barrido_en_curso = True
+        self.log(f"Iniciando barrido de alcanzabilidad de {len(ids) if ids else 'todos los'} dispositivos...")
+        threading.Thread(target=self._barrer_alcanzabilidad, args=(ids,), daemon=True).start()
+
+    def _barrer_alcanzabilidad(self, ids):
+        try:
+            dispositivos = [d for d in map(self.dao.obtener_por_id, ids) if d] if ids else None
+            inicio = time.monotonic()
+            resultados = self.barrido.ejecutar(
+                dispositivos, al_progresar=lambda d, estado, latencia: self._estados_barrido.put((d.id, estado)))
+            from barrido import SSH_OK
+            correctos = sum(1 for estado, _, _ in resultados.values() if estado == SSH_OK)
+            self.log(f"Barrido finalizado: {correctos}/{len(resultados)} con SSH correcto "
+                     f"({time.monotonic() - inicio:.1f}s)")
+        except Exception as e:
+            self.log(f"⚠ Error durante el barrido: {str(e)}", "error")
+        finally:
+            self._barrido_en_curso = False
 
-    def log(self, mensaje):
+    def _aplicar_estados_barrido(self):
+        try:
+            while True:
+                id_dispositivo, estado = self._estados_barrido.get_nowait()
+                if self.tree.exists(id_dispositivo):
+                    self.tree.set(id_dispositivo, 'Estado', estado)
+        except queue.Empty:
+            pass
+
+    def log(self, mensaje, nivel="info"):
+        """Encola un mensaje para el registro; se puede llamar desde cualquier hilo"""
+        self._cola_log.put((nivel, mensaje))
+
+    def _vaciar_log(self):
+        """Vuelca al widget, en un solo lote, los mensajes encolados desde la última vuelta"""
+        lote = []
+        try:
+            while len(lote) < MAX_LINEAS_LOG:
+                lote.append(self._cola_log.get_nowait())
+        except queue.Empty:
+            pass
+        if lote:
+            self._lineas_log.extend(lote)
+            self._escribir_log([linea for linea in lote if self._nivel_visible(linea[0])])
+        self._aplicar_estados_barrido()
+        self.root.after(INTERVALO_LOG_MS, self._vaciar_log)
+
+    def _nivel_visible(self, nivel):
+        minimo = FILTROS_LOG.get(self.filtro_log.get(), "info")
+        return NIVELES_LOG.index(nivel) >= NIVELES_LOG.index(minimo)
+
+    def _redibujar_log(self):
+        self._escribir_log([linea for linea in self._lineas_log if self._nivel_visible(linea[0])], reemplazar=True)
+
+    def _escribir_log(self, lineas, reemplazar=False):
+        if not lineas and not reemplazar:
+            return
         self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, mensaje + "\n")
+        if reemplazar:
+            self.log_text.delete("1.0", tk.END)
+        for nivel, mensaje in lineas:
+            self.log_text.insert(tk.END, mensaje + "\n", nivel)
+        # Se conservan solo las últimas MAX_LINEAS_LOG líneas
+        exceso = int(self.log_text.index("end-1c").split(".")[0]) - 1 - MAX_LINEAS_LOG
+        if exceso > 0:
+            self.log_text.delete("1.0", f"{exceso + 1}.0")
         self.log_text.config(state=tk.DISABLED)
         self.log_text.see(tk.END)
 
+def cargar_logo():
+    """
+    Logo del splash. El redimensionado con PIL se hace una sola vez y se guarda en
+    LOGO_CACHE; los arranques siguientes lo cargan directamente con Tk
+    """
+    if not os.path.exists(LOGO):
+        return None
+    if not os.path.exists(LOGO_CACHE) or os.path.getmtime(LOGO_CACHE) < os.path.getmtime(LOGO):
+        from PIL import Image
+        with Image.open(LOGO) as img:
+            img.resize(TAMANO_LOGO, Image.Resampling.LANCZOS).save(LOGO_CACHE, format="PNG")
+    return tk.PhotoImage(file=LOGO_CACHE)
+
 def mostrar_splash(root):
     splash = tk.Toplevel()
     splash.overrideredirect(True)
@@ -231,28 +516,36 @@ def mostrar_splash(root):
     splash.geometry(f"{screen_width}x{screen_height}+0+0")
     splash.configure(bg="white")
 
-    img = Image.open("logo.png")
-    img = img.resize((500, 500), Image.Resampling.LANCZOS)
-    logo = ImageTk.PhotoImage(img)
-    splash.logo = logo
-
-    tk.Label(splash, image=logo, bg="white").place(relx=0.5, rely=0.35, anchor=tk.CENTER)
+    logo = cargar_logo()
+    if logo:
+        splash.logo = logo
+        tk.Label(splash, image=logo, bg="white").place(relx=0.5, rely=0.35, anchor=tk.CENTER)
     tk.Label(splash, text="Cargando RedSafe...", font=("Segoe UI", 18, "bold"), bg="white").place(relx=0.5, rely=0.6, anchor=tk.CENTER)
 
     progress = ttk.Progressbar(splash, mode='indeterminate', length=200)
     progress.place(relx=0.5, rely=0.7, anchor=tk.CENTER)
     progress.start()
+    return splash
 
-    def cerrar_y_mostrar():
-        splash.destroy()
-        app = BackupApp(root)
-        root.deiconify()
-
-    splash.after(2000, cerrar_y_mostrar)
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Gestor de backups de red")
+    parser.add_argument("--artefactos", action="store_true",
+                        help="Captura también los comandos adicionales del perfil (show version, show inventory...) "
+                             "en un shell interactivo; sin esta opción solo se ejecuta el comando de la configuración")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
+    import ttkbootstrap as tb
     root = tb.Window(themename="minty")
     root.state('zoomed')
     root.withdraw()
-    mostrar_splash(root)
+    splash = mostrar_splash(root)
+    # El splash se pinta antes de construir la aplicación y se cierra en cuanto está lista
+    splash.update()
+    BackupApp(root, artefactos=args.artefactos)
+    splash.destroy()
+    root.deiconify()
     root.mainloop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import argparse
+import bisect
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from dispositivo import Dispositivo
+
+# Límites superiores (segundos) de los buckets de los histogramas
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MAX_PENDIENTES = 500  # Filas acumuladas antes de escribirlas en SQLite
+
+
+class Histograma:
+    __slots__ = ("buckets", "conteos", "suma", "cuenta")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.conteos = [0] * len(buckets)
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor: float) -> None:
+        indice = bisect.bisect_left(self.buckets, valor)
+        if indice < len(self.conteos):
+            self.conteos[indice] += 1
+        self.suma += valor
+        self.cuenta += 1
+
+    def acumulados(self):
+        """(límite, conteo acumulado) de cada bucket, como los espera Prometheus"""
+        total = 0
+        for limite, conteo in zip(self.buckets, self.conteos):
+            total += conteo
+            yield limite, total
+
+
+class MetricasBackup:
+    """
+    Tiempos por fase de cada backup (tcp, negociacion_ssh o sesion_pool, sonda, comando,
+    transferencia, postproceso, escritura, indexado, retencion y total). Se agregan en
+    histogramas por tipo de dispositivo y por dispositivo, se exportan en formato
+    de texto de Prometheus y se guardan en SQLite para consultar tendencias
+    """
+
+    def __init__(self, db_path: str = None, archivo_prometheus: str = None, buckets=BUCKETS,
+                 intervalo_exportacion: float = 15):
+        self.db_path = db_path
+        self.archivo_prometheus = archivo_prometheus
+        self.buckets = buckets
+        self.intervalo_exportacion = intervalo_exportacion
+        self._por_tipo = {}  # (fase, tipo) -> Histograma
+        self._por_dispositivo = {}  # (fase, dispositivo_id) -> Histograma
+        self._nombres = {}  # dispositivo_id -> último nombre visto, solo para la etiqueta
+        self._backups = {}  # (tipo, estado) -> total
+        self._pendientes = []
+        self._ultima_exportacion = 0.0
+        self._lock = threading.Lock()
+        if db_path:
+            self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS tiempos_backup (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                fecha REAL NOT NULL,
+                                dispositivo_id INTEGER,
+                                tipo TEXT,
+                                fase TEXT NOT NULL,
+                                duracion REAL NOT NULL,
+                                estado TEXT
+                              )''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_tiempos_backup_fase_fecha
+                              ON tiempos_backup (fase, fecha)''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS idx_tiempos_backup_dispositivo
+                              ON tiempos_backup (dispositivo_id, fecha)''')
+            conn.commit()
+
+    @contextmanager
+    def medir(self, fase: str, dispositivo: Dispositivo):
+        """Mide la duración del bloque como la fase indicada, aunque el bloque falle"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(fase, dispositivo, time.perf_counter() - inicio)
+
+    def registrar(self, fase: str, dispositivo: Dispositivo, segundos: float, estado: str = None) -> None:
+        with self._lock:
+            for histogramas, clave in ((self._por_tipo, (fase, dispositivo.tipo)),
+                                       (self._por_dispositivo, (fase, dispositivo.id))):
+                histograma = histogramas.get(clave)
+                if histograma is None:
+                    histograma = histogramas[clave] = Histograma(self.buckets)
+                histograma.observar(segundos)
+            self._nombres[dispositivo.id] = dispositivo.nombre
+            if self.db_path:
+                self._pendientes.append((time.time(), dispositivo.id, dispositivo.tipo, fase, segundos, estado))
+
+    def finalizar_backup(self, dispositivo: Dispositivo, estado: str, segundos: float) -> None:
+        """Registra la duración total y el estado del backup; vuelca a SQLite y al archivo si toca"""
+        self.registrar("total", dispositivo, segundos, estado)
+        with self._lock:
+            clave = (dispositivo.tipo, estado)
+            self._backups[clave] = self._backups.get(clave, 0) + 1
+            volcar = len(self._pendientes) >= MAX_PENDIENTES
+            exportar = (self.archivo_prometheus
+                        and time.monotonic() - self._ultima_exportacion >= self.intervalo_exportacion)
+        if volcar:
+            self.volcar()
+        if exportar:
+            self.exportar()
+
+    def volcar(self) -> None:
+        """Escribe en SQLite los tiempos pendientes"""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, []
+        if not pendientes or not self.db_path:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''INSERT INTO tiempos_backup (fecha, dispositivo_id, tipo, fase, duracion, estado)
+                                  VALUES (?, ?, ?, ?, ?, ?)''', pendientes)
+            conn.commit()
+
+    def texto_prometheus(self) -> str:
+        """
+        Métricas en formato de texto de Prometheus. Por tipo se exportan los buckets
+        completos; por dispositivo solo suma y cuenta para no disparar la cardinalidad
+        """
+        with self._lock:
+            por_tipo = [(clave, h.cuenta, h.suma, list(h.acumulados())) for clave, h in sorted(self._por_tipo.items())]
+            por_dispositivo = [((fase, dispositivo_id, self._nombres.get(dispositivo_id)), h.cuenta, h.suma)
+                               for (fase, dispositivo_id), h in sorted(self._por_dispositivo.items(),
+                                                                       key=lambda item: (item[0][0], item[0][1] or 0))]
+            backups = sorted(self._backups.items())
+
+        lineas = ["# HELP backup_fase_segundos Duración de cada fase del backup por tipo de dispositivo",
+                  "# TYPE backup_fase_segundos histogram"]
+        for (fase, tipo), cuenta, suma, acumulados in por_tipo:
+            etiquetas = f'fase="{_escapar(fase)}",tipo="{_escapar(tipo)}"'
+            for limite, total in acumulados:
+                lineas.append(f'backup_fase_segundos_bucket{{{etiquetas},le="{limite}"}} {total}')
+            lineas.append(f'backup_fase_segundos_bucket{{{etiquetas},le="+Inf"}} {cuenta}')
+            lineas.append(f"backup_fase_segundos_sum{{{etiquetas}}} {suma}")
+            lineas.append(f"backup_fase_segundos_count{{{etiquetas}}} {cuenta}")
+
+        lineas += ["# HELP backup_fase_dispositivo_segundos Duración de cada fase del backup por dispositivo",
+                   "# TYPE backup_fase_dispositivo_segundos summary"]
+        for (fase, dispositivo_id, nombre), cuenta, suma in por_dispositivo:
+            dispositivo_id = "" if dispositivo_id is None else dispositivo_id
+            etiquetas = (f'fase="{_escapar(fase)}",dispositivo_id="{dispositivo_id}",'
+                         f'dispositivo="{_escapar(nombre)}"')
+            lineas.append(f"backup_fase_dispositivo_segundos_sum{{{etiquetas}}} {suma}")
+            lineas.append(f"backup_fase_dispositivo_segundos_count{{{etiquetas}}} {cuenta}")
+
+        lineas += ["# HELP backups_total Backups realizados por tipo de dispositivo y estado",
+                   "# TYPE backups_total counter"]
+        for (tipo, estado), total in backups:
+            lineas.append(f'backups_total{{tipo="{_escapar(tipo)}",estado="{_escapar(estado)}"}} {total}')
+        return "\n".join(lineas) + "\n"
+
+    def exportar(self, ruta: str = None) -> None:
+        """Escribe el archivo de Prometheus (p.ej. para el textfile collector de node_exporter) de forma atómica"""
+        ruta = ruta or self.archivo_prometheus
+        self._ultima_exportacion = time.monotonic()
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(ruta)), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+                f.write(self.texto_prometheus())
+            os.replace(temporal, ruta)
+        except BaseException:
+            os.remove(temporal)
+            raise
+
+    def tendencia(self, fase: str = "total", dias: int = 30, tipo: str = None, dispositivo_id=None) -> list[tuple]:
+        """Por día: (dia, cuenta, media, máximo) de la duración de la fase en los últimos días"""
+        self.volcar()
+        condiciones = ["fase = ?", "fecha >= ?"]
+        parametros = [fase, (datetime.now() - timedelta(days=dias)).timestamp()]
+        if tipo:
+            condiciones.append("tipo = ?")
+            parametros.append(tipo)
+        if dispositivo_id is not None:
+            condiciones.append("dispositivo_id = ?")
+            parametros.append(dispositivo_id)
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''SELECT date(fecha, 'unixepoch', 'localtime') AS dia, COUNT(*), AVG(duracion), MAX(duracion)
+                               FROM tiempos_backup WHERE {' AND '.join(condiciones)}
+                               GROUP BY dia ORDER BY dia''', parametros)
+            return cursor.fetchall()
+
+    def limpiar_antiguos(self, dias_retencion: int = 90) -> int:
+        """Borra de SQLite los tiempos de más de dias_retencion días; lo llama el programador cada día"""
+        if not self.db_path:
+            return 0
+        fecha_limite = (datetime.now() - timedelta(days=dias_retencion)).timestamp()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM tiempos_backup WHERE fecha < ?', (fecha_limite,))
+            conn.commit()
+            return cursor.rowcount
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tendencia diaria de la duración de una fase de los backups")
+    parser.add_argument("--fase", default="total",
+                        help="tcp, negociacion_ssh, sesion_pool, sonda, comando, transferencia, postproceso, "
+                             "escritura, indexado, retencion o total")
+    parser.add_argument("--dias", type=int, default=30)
+    parser.add_argument("--tipo", help="Solo dispositivos de este tipo")
+    parser.add_argument("--dispositivo", type=int, help="Solo el dispositivo con este id")
+    parser.add_argument("--db", default="dispositivos.db", help="Ruta de la base de datos de dispositivos")
+    args = parser.parse_args()
+
+    for dia, cuenta, media, maximo in MetricasBackup(args.db).tendencia(args.fase, args.dias, args.tipo,
+                                                                        args.dispositivo):
+        print(f"{dia}  {cuenta:>6} backups  media {media:8.3f}s  máx {maximo:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
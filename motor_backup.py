@@ -0,0 +1,282 @@
+import ipaddress
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from backup_manager import BackupManager, EXITOSO, FALLIDO, OMITIDO, SIN_CAMBIOS, TIMEOUT
+from dispositivo import Dispositivo, DispositivoDAO
+
+CANCELADO = "cancelado"
+
+
+@dataclass
+class ResumenBackup:
+    total: int = 0
+    exitosos: int = 0
+    sin_cambios: int = 0  # La sonda de cambios evitó descargar la configuración
+    fallidos: int = 0
+    timeouts: int = 0
+    cancelados: int = 0
+    omitidos: int = 0  # En espera por el cortacircuitos
+    inicio: float = field(default_factory=time.monotonic)
+    fin: float = None
+
+    @property
+    def procesados(self) -> int:
+        return self.exitosos + self.sin_cambios + self.fallidos + self.timeouts + self.cancelados + self.omitidos
+
+    @property
+    def duracion(self) -> float:
+        return (self.fin or time.monotonic()) - self.inicio
+
+    @property
+    def dispositivos_por_minuto(self) -> float:
+        duracion = self.duracion
+        return self.procesados * 60 / duracion if duracion > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.procesados}/{self.total} procesados - "
+                f"{self.exitosos} descargados, {self.sin_cambios} sin cambios, {self.fallidos} fallidos, "
+                f"{self.timeouts} timeouts, {self.cancelados} cancelados, {self.omitidos} omitidos "
+                f"({self.duracion:.1f}s, {self.dispositivos_por_minuto:.0f} disp/min)")
+
+
+class EjecucionBackup:
+    """Una ejecución de backups sobre un conjunto de dispositivos"""
+
+    def __init__(self, motor, dispositivos, al_progresar=None):
+        self._motor = motor
+        self._al_progresar = al_progresar or motor.al_progresar
+        self._cola = queue.Queue()
+        self._cancelado = threading.Event()
+        self._lock = threading.Lock()
+        self._terminado = threading.Event()
+        self._aparcados = 0  # Dispositivos esperando en la lista de su subred
+        self.resumen = ResumenBackup(total=len(dispositivos))
+
+        for dispositivo in dispositivos:
+            self._cola.put(dispositivo)
+
+        num_trabajadores = min(motor.max_trabajadores, len(dispositivos))
+        # Trabajadores vivos más backups descargados que aún se están guardando
+        self._activos = num_trabajadores
+        if num_trabajadores == 0:
+            self._finalizar()
+        for i in range(num_trabajadores):
+            threading.Thread(target=self._trabajador, name=f"backup-{i}", daemon=True).start()
+
+    def cancelar(self) -> None:
+        """Detiene la ejecución: los backups en curso terminan, los pendientes se descartan"""
+        self._cancelado.set()
+        # Los aparcados ya no van a ocupar hueco: vuelven a la cola para descartarlos
+        self._motor._reanudar_aparcados(self)
+
+    @property
+    def cancelada(self) -> bool:
+        return self._cancelado.is_set()
+
+    def esperar(self, timeout: float = None) -> ResumenBackup:
+        """Bloquea hasta que termine la ejecución y devuelve el resumen"""
+        self._terminado.wait(timeout)
+        return self.resumen
+
+    def _trabajador(self):
+        try:
+            while True:
+                dispositivo = self._siguiente()
+                if dispositivo is None:
+                    return
+
+                if self._cancelado.is_set():
+                    self._registrar(dispositivo, CANCELADO)
+                    continue
+
+                # El motor tiene como mucho max_trabajadores backups en curso entre todas sus ejecuciones
+                cupos = self._motor._cupos
+                cupos.acquire()
+                if not self._motor._reservar_subred(self, dispositivo):
+                    # Subred saturada: espera en su lista hasta que termine un backup de esa subred
+                    cupos.release()
+                    continue
+                with self._lock:
+                    self._activos += 1
+                try:
+                    # Vuelve al terminar la descarga: el guardado puede seguir en el postproceso
+                    futuro = self._motor.backup_manager.iniciar_backup(dispositivo)
+                except Exception:
+                    futuro = None
+                finally:
+                    cupos.release()
+                    self._motor._liberar_subred(dispositivo.ip)
+                if futuro is None:
+                    self._terminar_backup(dispositivo, None)
+                else:
+                    futuro.add_done_callback(lambda f, d=dispositivo: self._terminar_backup(d, f))
+        finally:
+            self._soltar()
+
+    def _siguiente(self):
+        """
+        Siguiente dispositivo de la cola, o None cuando ya no queda nada. Mientras haya
+        dispositivos aparcados el trabajador espera en la cola a que su subred los devuelva
+        """
+        while True:
+            with self._lock:
+                if self._cola.empty() and not self._aparcados:
+                    # Despierta a otro trabajador bloqueado en la cola para que también termine
+                    self._cola.put(None)
+                    return None
+            dispositivo = self._cola.get()
+            if dispositivo is not None:
+                return dispositivo
+
+    def _aparcar(self):
+        with self._lock:
+            self._aparcados += 1
+
+    def _reanudar(self, dispositivo):
+        """Devuelve a la cola un dispositivo aparcado porque su subred ya tiene un hueco"""
+        with self._lock:
+            self._aparcados -= 1
+            self._cola.put(dispositivo)
+
+    def _terminar_backup(self, dispositivo, futuro):
+        try:
+            estado = futuro.result() if futuro else FALLIDO
+        except Exception:
+            estado = FALLIDO
+        if estado in (EXITOSO, SIN_CAMBIOS) and dispositivo.id is not None:
+            try:
+                self._motor.dao.registrar_backup_exitoso(dispositivo.id)
+            except Exception:
+                pass
+        self._registrar(dispositivo, estado)
+        self._soltar()
+
+    def _soltar(self):
+        with self._lock:
+            self._activos -= 1
+            ultimo = self._activos == 0
+        if ultimo:
+            self._finalizar()
+
+    def _registrar(self, dispositivo, estado):
+        with self._lock:
+            if estado == EXITOSO:
+                self.resumen.exitosos += 1
+            elif estado == SIN_CAMBIOS:
+                self.resumen.sin_cambios += 1
+            elif estado == TIMEOUT:
+                self.resumen.timeouts += 1
+            elif estado == CANCELADO:
+                self.resumen.cancelados += 1
+            elif estado == OMITIDO:
+                self.resumen.omitidos += 1
+            else:
+                self.resumen.fallidos += 1
+        if self._al_progresar:
+            try:
+                self._al_progresar(dispositivo, estado, self.resumen)
+            except Exception:
+                pass
+
+    def _finalizar(self):
+        self.resumen.fin = time.monotonic()
+        self._terminado.set()
+        if self._motor.al_terminar:
+            try:
+                self._motor.al_terminar(self.resumen)
+            except Exception:
+                pass
+
+
+class MotorBackup:
+    """
+    Ejecuta backups de muchos dispositivos con un pool acotado de hilos,
+    limitando además cuántas conexiones simultáneas se abren por subred.
+    max_trabajadores vale para todo el motor: varias ejecuciones a la vez se reparten los cupos
+    """
+
+    def __init__(self, backup_manager: BackupManager = None, dao: DispositivoDAO = None,
+                 max_trabajadores: int = 32, max_por_subred: int = 8, prefijo_subred: int = 24,
+                 al_progresar=None, al_terminar=None):
+        if max_trabajadores < 1 or max_por_subred < 1:
+            raise ValueError("Los límites de concurrencia deben ser mayores que 0")
+        self.backup_manager = backup_manager or BackupManager()
+        self.dao = dao or DispositivoDAO()
+        self.max_trabajadores = max_trabajadores
+        self.max_por_subred = max_por_subred
+        self.prefijo_subred = prefijo_subred
+        self.al_progresar = al_progresar
+        self.al_terminar = al_terminar
+        self._en_curso_subred = {}  # clave de subred -> backups en curso
+        self._en_espera = {}  # clave de subred -> deque de (ejecución, dispositivo) esperando hueco
+        self._lock = threading.Lock()
+        self._cupos = threading.BoundedSemaphore(max_trabajadores)
+
+    def respaldar_todos(self) -> EjecucionBackup:
+        """Lanza el backup de todos los dispositivos registrados"""
+        return self.respaldar(self.dao.obtener_todos())
+
+    def respaldar_seleccion(self, ids) -> EjecucionBackup:
+        """Lanza el backup de los dispositivos con los ids indicados"""
+        dispositivos = [d for d in (self.dao.obtener_por_id(i) for i in ids) if d]
+        return self.respaldar(dispositivos)
+
+    def respaldar(self, dispositivos: list[Dispositivo], al_progresar=None) -> EjecucionBackup:
+        """
+        Encola los dispositivos indicados y devuelve la ejecución en curso.
+        al_progresar(dispositivo, estado, resumen) reemplaza al callback del motor para esta ejecución
+        """
+        return EjecucionBackup(self, list(dispositivos), al_progresar)
+
+    def _clave_subred(self, ip: str) -> str:
+        try:
+            red = ipaddress.ip_network(f"{ip}/{self.prefijo_subred}", strict=False)
+            return str(red)
+        except ValueError:
+            # Los nombres de host forman su propio grupo
+            return ip
+
+    def _reservar_subred(self, ejecucion: EjecucionBackup, dispositivo: Dispositivo) -> bool:
+        """Ocupa un hueco de la subred del dispositivo o, si está llena, lo deja en su lista de espera"""
+        clave = self._clave_subred(dispositivo.ip)
+        with self._lock:
+            en_curso = self._en_curso_subred.get(clave, 0)
+            if en_curso >= self.max_por_subred:
+                if ejecucion.cancelada:
+                    ejecucion._cola.put(dispositivo)  # Se descarta al sacarlo de nuevo
+                else:
+                    self._en_espera.setdefault(clave, deque()).append((ejecucion, dispositivo))
+                    ejecucion._aparcar()
+                return False
+            self._en_curso_subred[clave] = en_curso + 1
+            return True
+
+    def _liberar_subred(self, ip: str) -> None:
+        """Libera el hueco y devuelve a su ejecución el dispositivo que más tiempo lleva esperando en la subred"""
+        clave = self._clave_subred(ip)
+        with self._lock:
+            en_curso = self._en_curso_subred[clave] - 1
+            if en_curso:
+                self._en_curso_subred[clave] = en_curso
+            else:
+                del self._en_curso_subred[clave]
+            espera = self._en_espera.get(clave)
+            if espera:
+                ejecucion, dispositivo = espera.popleft()
+                if not espera:
+                    del self._en_espera[clave]
+                ejecucion._reanudar(dispositivo)
+
+    def _reanudar_aparcados(self, ejecucion: EjecucionBackup) -> None:
+        """Saca de las listas de espera todos los dispositivos de la ejecución y los devuelve a su cola"""
+        with self._lock:
+            for clave in list(self._en_espera):
+                espera = self._en_espera[clave]
+                for entrada in [e for e in espera if e[0] is ejecucion]:
+                    espera.remove(entrada)
+                    ejecucion._reanudar(entrada[1])
+                if not espera:
+                    del self._en_espera[clave]
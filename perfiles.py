@@ -0,0 +1,93 @@
+import re
+from dataclasses import dataclass, field
+from dispositivo import Dispositivo
+
+# Prompt típico de CLI: "router#", "switch>", "user@fw>", "[admin@MikroTik] >", "user@host:~$"
+PROMPT_GENERICO = r"^[\w.\-@()\[\]/:~ ]*[#>$%]\s*$"
+PAGINADOR_GENERICO = r"-+\s*\(?More\)?\s*-+|<--- More --->"
+
+
+@dataclass
+class PerfilDispositivo:
+    """
+    Cómo respaldar una familia de equipos. La salida del primer comando es la
+    configuración; la de los demás se guarda como artefactos aparte. Con más de un
+    comando se ejecutan todos en un único shell interactivo de la misma sesión SSH,
+    desactivando antes la paginación. La sonda de cambios es un comando cuya salida
+    cambia cuando cambia la configuración (fecha del último cambio, contador de
+    commits, checksum): si coincide con la del último backup no se descarga nada.
+    Lo que se ahorra siempre es la transferencia y el guardado; el trabajo del equipo
+    solo si la sonda no genera la configuración entera (ver cisco_ios).
+    Las líneas volátiles (marcas de tiempo, contadores) se quitan de la configuración
+    al normalizarla, para que dos backups de la misma configuración sean idénticos
+    """
+    nombre: str
+    comandos: list[str]
+    desactivar_paginacion: str = None
+    prompt: str = PROMPT_GENERICO
+    paginador: str = PAGINADOR_GENERICO  # Si aun así aparece un "--More--" se avanza con un espacio
+    sonda_cambios: str = None
+    lineas_volatiles: list[str] = field(default_factory=list)
+    patron_prompt: re.Pattern = field(init=False, repr=False, compare=False)
+    patron_paginador: re.Pattern = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not self.comandos:
+            raise ValueError("El perfil debe tener al menos un comando")
+        self.patron_prompt = re.compile(self.prompt)
+        self.patron_paginador = re.compile(self.paginador)
+
+    @property
+    def comando_principal(self) -> str:
+        return self.comandos[0]
+
+
+PERFILES = {
+    "cisco_ios": PerfilDispositivo("cisco_ios", ["show running-config", "show version", "show inventory"],
+                                   desactivar_paginacion="terminal length 0",
+                                   # El equipo genera la configuración completa para filtrarla: solo se ahorra
+                                   # la transferencia. IOS no tiene un contador más barato sin configurar nada
+                                   # (show archive solo cambia con "archive" y "write-memory" configurados)
+                                   sonda_cambios="show running-config | include ^! Last configuration change",
+                                   lineas_volatiles=[r"^Building configuration\.\.\.", r"^Current configuration : \d+ bytes",
+                                                     r"^! Last configuration change at ", r"^! NVRAM config last updated at ",
+                                                     r"^ntp clock-period "]),
+    "mikrotik": PerfilDispositivo("mikrotik", ["/export compact"], sonda_cambios="/system history print detail",
+                                  lineas_volatiles=[r"^# \S+ \S+ by RouterOS "]),
+    "junos": PerfilDispositivo("junos", ["show configuration", "show version"],
+                               desactivar_paginacion="set cli screen-length 0",
+                               sonda_cambios='show system commit | match "^0 "',
+                               lineas_volatiles=[r"^## Last commit: "]),
+    "linux": PerfilDispositivo("linux", ["cat /etc/network/interfaces"],
+                               sonda_cambios="sha256sum /etc/network/interfaces"),
+    "generico": PerfilDispositivo("generico", ["show configuration"]),
+}
+
+# Perfil según tipo de dispositivo, y pistas en el nombre que tienen prioridad sobre el tipo
+PERFIL_POR_TIPO = {
+    "Router": "cisco_ios",
+    "Switch": "cisco_ios",
+    "Firewall": "junos",
+    "Servidor": "linux",
+    "Otro": "generico",
+}
+PISTAS_NOMBRE = {
+    "mikrotik": "mikrotik",
+}
+
+
+def registrar_perfil(perfil: PerfilDispositivo, tipos=(), pista_nombre: str = None) -> None:
+    """Añade o reemplaza un perfil y, opcionalmente, lo asocia a tipos de dispositivo o a una pista en el nombre"""
+    PERFILES[perfil.nombre] = perfil
+    for tipo in tipos:
+        PERFIL_POR_TIPO[tipo] = perfil.nombre
+    if pista_nombre:
+        PISTAS_NOMBRE[pista_nombre.lower()] = perfil.nombre
+
+
+def perfil_para(dispositivo: Dispositivo) -> PerfilDispositivo:
+    nombre = dispositivo.nombre.lower()
+    for pista, perfil in PISTAS_NOMBRE.items():
+        if pista in nombre:
+            return PERFILES[perfil]
+    return PERFILES[PERFIL_POR_TIPO.get(dispositivo.tipo, "cisco_ios")]
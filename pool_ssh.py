@@ -0,0 +1,186 @@
+import threading
+import time
+from contextlib import contextmanager
+import paramiko
+from dispositivo import Dispositivo
+from transporte_ssh import AjustesTransporte, conectar
+
+
+class PoolAgotado(Exception):
+    """No quedó cupo en el pool dentro del plazo: es saturación local, no un fallo del dispositivo"""
+
+
+class PoolSesionesSSH:
+    """
+    Mantiene sesiones SSH abiertas por (ip, puerto_ssh, usuario, ajustes de transporte)
+    para que operaciones repetidas sobre el mismo dispositivo reutilicen el transporte
+    en lugar de repetir conexión TCP, intercambio de claves y autenticación
+    """
+
+    def __init__(self, max_sesiones: int = 64, tiempo_inactividad: float = 300,
+                 intervalo_keepalive: int = 30, timeout_conexion: float = 15):
+        if max_sesiones < 1:
+            raise ValueError("max_sesiones debe ser mayor que 0")
+        self.max_sesiones = max_sesiones
+        self.tiempo_inactividad = tiempo_inactividad
+        self.intervalo_keepalive = intervalo_keepalive
+        self.timeout_conexion = timeout_conexion
+        self._libres = {}  # clave -> lista de (cliente, instante de último uso)
+        self._total = 0
+        self._condicion = threading.Condition()
+
+    @staticmethod
+    def _clave(dispositivo: Dispositivo, ajustes: AjustesTransporte = None) -> tuple:
+        return (dispositivo.ip, dispositivo.puerto_ssh, dispositivo.usuario, ajustes or AjustesTransporte())
+
+    @contextmanager
+    def sesion(self, dispositivo: Dispositivo, timeout: float = None, ajustes: AjustesTransporte = None):
+        """
+        Presta un cliente SSH conectado y autenticado al dispositivo, con sus ajustes de transporte.
+        Si el bloque lanza una excepción la sesión se descarta en vez de devolverse al pool
+        """
+        clave = self._clave(dispositivo, ajustes)
+        cliente = self._tomar(clave, timeout)
+        if cliente is None:
+            try:
+                cliente = self._conectar(dispositivo, timeout or self.timeout_conexion, ajustes)
+            except BaseException:
+                self._liberar_cupo()
+                raise
+        try:
+            yield cliente
+        except BaseException:
+            self._descartar(cliente)
+            raise
+        else:
+            self._devolver(clave, cliente)
+
+    def invalidar(self, dispositivo: Dispositivo) -> None:
+        """Cierra las sesiones libres del dispositivo (p.ej. tras cambiar sus credenciales)"""
+        destino = self._clave(dispositivo)[:3]
+        with self._condicion:
+            sesiones = [sesion for clave in [c for c in self._libres if c[:3] == destino]
+                        for sesion in self._libres.pop(clave)]
+            self._total -= len(sesiones)
+            self._condicion.notify_all()
+        for cliente, _ in sesiones:
+            self._cerrar(cliente)
+
+    def cerrar_todo(self) -> None:
+        """Cierra todas las sesiones libres del pool"""
+        with self._condicion:
+            sesiones = [s for lista in self._libres.values() for s in lista]
+            self._libres.clear()
+            self._total -= len(sesiones)
+            self._condicion.notify_all()
+        for cliente, _ in sesiones:
+            self._cerrar(cliente)
+
+    def _tomar(self, clave, timeout):
+        """Devuelve una sesión libre y sana, o None tras reservar cupo para abrir una nueva"""
+        limite = time.monotonic() + (timeout or self.timeout_conexion)
+        descartar = []
+        try:
+            with self._condicion:
+                while True:
+                    expiradas = self._expirar_inactivas()
+                    self._total -= len(expiradas)
+                    descartar.extend(expiradas)
+                    libres = self._libres.get(clave)
+                    while libres:
+                        cliente, _ = libres.pop()
+                        if self._sesion_sana(cliente):
+                            return cliente
+                        self._total -= 1
+                        descartar.append((cliente, None))
+                    if self._total < self.max_sesiones:
+                        self._total += 1
+                        return None
+                    # Sin cupo: se cierra la sesión libre más antigua de otro dispositivo
+                    antigua = self._sesion_libre_mas_antigua()
+                    if antigua is not None:
+                        self._total -= 1
+                        descartar.append(antigua)
+                        continue
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise PoolAgotado("No hay sesiones SSH disponibles en el pool")
+                    self._condicion.wait(restante)
+        finally:
+            for cliente, _ in descartar:
+                self._cerrar(cliente)
+
+    def _devolver(self, clave, cliente):
+        with self._condicion:
+            self._libres.setdefault(clave, []).append((cliente, time.monotonic()))
+            self._condicion.notify()
+
+    def _descartar(self, cliente):
+        self._cerrar(cliente)
+        self._liberar_cupo()
+
+    @staticmethod
+    def _cerrar(cliente):
+        try:
+            cliente.close()
+        except Exception:
+            pass
+
+    def _liberar_cupo(self):
+        with self._condicion:
+            self._total -= 1
+            self._condicion.notify()
+
+    def _expirar_inactivas(self):
+        """Quita del pool las sesiones libres que superaron el tiempo de inactividad (con el lock tomado)"""
+        limite = time.monotonic() - self.tiempo_inactividad
+        expiradas = []
+        for clave in list(self._libres):
+            vigentes = []
+            for cliente, ultimo_uso in self._libres[clave]:
+                (vigentes if ultimo_uso >= limite else expiradas).append((cliente, ultimo_uso))
+            if vigentes:
+                self._libres[clave] = vigentes
+            else:
+                del self._libres[clave]
+        return expiradas
+
+    def _sesion_libre_mas_antigua(self):
+        """Quita del pool la sesión libre usada hace más tiempo (con el lock tomado)"""
+        candidata = None
+        for clave, lista in self._libres.items():
+            for i, (_, ultimo_uso) in enumerate(lista):
+                if candidata is None or ultimo_uso < candidata[2]:
+                    candidata = (clave, i, ultimo_uso)
+        if candidata is None:
+            return None
+        clave, i, _ = candidata
+        sesion = self._libres[clave].pop(i)
+        if not self._libres[clave]:
+            del self._libres[clave]
+        return sesion
+
+    @staticmethod
+    def _sesion_sana(cliente) -> bool:
+        """Comprueba que el transporte sigue activo antes de reutilizarlo"""
+        transporte = cliente.get_transport()
+        if transporte is None or not transporte.is_active() or not transporte.is_authenticated():
+            return False
+        try:
+            transporte.send_ignore()
+            return True
+        except Exception:
+            return False
+
+    def _conectar(self, dispositivo: Dispositivo, timeout: float, ajustes: AjustesTransporte = None):
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        inicio = time.monotonic()
+        try:
+            conectar(ssh, dispositivo, ajustes, timeout, intervalo_keepalive=self.intervalo_keepalive)
+        except BaseException:
+            ssh.close()
+            raise
+        # Lo recoge quien use la sesión por primera vez (p.ej. para ajustar timeouts)
+        ssh.duracion_conexion = time.monotonic() - inicio
+        return ssh
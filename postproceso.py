@@ -0,0 +1,119 @@
+import functools
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from almacen_backups import normalizar_lineas
+from almacen_comprimido import CODECS, TAMANO_BLOQUE
+
+
+@functools.lru_cache(maxsize=64)
+def _patron_volatiles(volatiles: tuple):
+    return re.compile("|".join(f"(?:{expresion})" for expresion in volatiles)) if volatiles else None
+
+
+def procesar_captura(ruta: str, volatiles: tuple = (), codec: str = None) -> tuple[str, int, str, str]:
+    """
+    Quita las líneas volátiles de la configuración capturada, la normaliza, calcula su
+    hash y, con un codec, la comprime también. Los resultados van a temporales junto a
+    la captura. Devuelve (ruta normalizada, bytes, sha256, ruta comprimida o None)
+    """
+    patron = _patron_volatiles(volatiles)
+    directorio = os.path.dirname(ruta) or "."
+    digest = hashlib.sha256()
+    tamano = 0
+    descriptor, normalizada = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    comprimida = None
+    try:
+        compresor = None
+        if codec:
+            descriptor_comprimida, comprimida = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+            compresor = CODECS[codec].compresor()
+        with open(ruta, 'r', encoding='utf-8', errors='ignore') as entrada, os.fdopen(descriptor, 'wb') as f, \
+                (os.fdopen(descriptor_comprimida, 'wb') if codec else open(os.devnull, 'wb')) as z:
+            lineas = (linea for linea in entrada if not patron.search(linea)) if patron else entrada
+            pendiente = bytearray()
+            for linea in normalizar_lineas(lineas):
+                pendiente += linea.encode('utf-8')
+                if len(pendiente) >= TAMANO_BLOQUE:
+                    digest.update(pendiente)
+                    f.write(pendiente)
+                    if compresor:
+                        z.write(compresor.compress(bytes(pendiente)))
+                    tamano += len(pendiente)
+                    pendiente.clear()
+            digest.update(pendiente)
+            f.write(pendiente)
+            tamano += len(pendiente)
+            if compresor:
+                z.write(compresor.compress(bytes(pendiente)))
+                z.write(compresor.flush())
+        return normalizada, tamano, digest.hexdigest(), comprimida
+    except BaseException:
+        for temporal in (normalizada, comprimida):
+            if temporal and os.path.exists(temporal):
+                os.remove(temporal)
+        raise
+
+
+class PostprocesadorBackups:
+    """
+    Normalización, hash y compresión de las configuraciones capturadas en un pool de
+    procesos, fuera del GIL que comparten los hilos de paramiko. Los hilos de captura no
+    esperan al resultado: lo recoge un hilo de escritura, que termina el backup. Como
+    mucho hay `max_pendientes` capturas en proceso o por guardar; con más, enviar() espera
+    un hueco (sin retener el GIL), así el disco y la memoria no crecen si la CPU no da abasto
+    """
+
+    def __init__(self, procesos: int = None, max_pendientes: int = None):
+        self.procesos = procesos or os.cpu_count() or 1
+        self._huecos = threading.BoundedSemaphore(max_pendientes or 2 * self.procesos)
+        self._lock = threading.Lock()
+        self._executor = self._crear_executor()
+        # Guardar es disco y SQLite: ni en los hilos de captura ni en el que gestiona el pool
+        self._escritores = ThreadPoolExecutor(self.procesos, thread_name_prefix="postproceso")
+
+    def _crear_executor(self) -> ProcessPoolExecutor:
+        # spawn: un fork con los hilos de paramiko en marcha podría heredar locks tomados
+        return ProcessPoolExecutor(self.procesos, mp_context=multiprocessing.get_context("spawn"))
+
+    def enviar(self, ruta: str, volatiles: tuple, codec: str, continuar) -> None:
+        """
+        Manda la captura al pool y vuelve sin esperar al resultado. Al terminar, un hilo de
+        escritura llama a continuar(obtener): obtener() devuelve lo mismo que procesar_captura
+        o lanza su excepción
+        """
+        argumentos = (ruta, volatiles, codec)
+        self._huecos.acquire()
+        executor = self._executor
+        try:
+            futuro = executor.submit(procesar_captura, *argumentos)
+        except BrokenProcessPool:
+            self._escritores.submit(self._continuar, executor, None, argumentos, continuar)
+            return
+        futuro.add_done_callback(
+            lambda f: self._escritores.submit(self._continuar, executor, f, argumentos, continuar))
+
+    def _continuar(self, executor, futuro, argumentos, continuar):
+        try:
+            if futuro is None or isinstance(futuro.exception(), BrokenProcessPool):
+                # Un proceso murió (p.ej. sin memoria): el pool ya no sirve, se crea otro para
+                # las siguientes capturas y esta se procesa en el hilo de escritura
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = self._crear_executor()
+                        executor.shutdown(wait=False)
+                continuar(functools.partial(procesar_captura, *argumentos))
+            else:
+                continuar(futuro.result)
+        finally:
+            self._huecos.release()
+
+    def cerrar(self) -> None:
+        """Espera a que se procesen y se guarden las capturas pendientes"""
+        self._executor.shutdown()
+        self._escritores.shutdown()
@@ -0,0 +1,324 @@
+import argparse
+import heapq
+import logging
+import os
+import queue
+import re
+import signal
+import threading
+import time
+import zlib
+from almacen_backups import AlmacenDeduplicado
+from almacen_comprimido import CODECS, AlmacenComprimido
+from artefactos_backup import ArtefactosBackup
+from backup_manager import BackupManager, EXITOSO, SIN_CAMBIOS
+from catalogo_backups import CatalogoBackups
+from cortacircuitos import CortacircuitosDispositivos
+from historial_deltas import HistorialDeltas
+from huellas_configuracion import HuellasConfiguracion
+from indice_busqueda import IndiceConfiguraciones
+from metricas import MetricasBackup
+from dispositivo import Dispositivo, DispositivoDAO
+from motor_backup import MotorBackup
+from pool_ssh import PoolSesionesSSH
+from registro import configurar_registro
+from postproceso import PostprocesadorBackups
+from transporte_ssh import TransporteDispositivos
+
+# Intervalo entre backups según frecuencia_backup, en segundos ("Manual" no se programa)
+INTERVALOS = {
+    "Diario": 24 * 3600,
+    "Semanal": 7 * 24 * 3600,
+    "Mensual": 30 * 24 * 3600,
+}
+INTERVALO_LIMPIEZA = 24 * 3600  # Cada cuánto se purgan los registros vencidos (tiempos de backup, cola)
+
+
+class ProgramadorBackups:
+    """
+    Lanza los backups según frecuencia_backup sin necesidad de la interfaz gráfica.
+    Mantiene un min-heap con el próximo vencimiento de cada dispositivo y duerme
+    hasta el siguiente, leyendo solo los dispositivos modificados desde la última vuelta
+    """
+
+    def __init__(self, dao: DispositivoDAO, motor: MotorBackup, ventana_dispersion: float = 3600,
+                 intervalo_cambios: float = 60, espera_reintento: float = 900):
+        self.dao = dao
+        self.motor = motor
+        self.ventana_dispersion = ventana_dispersion
+        self.intervalo_cambios = intervalo_cambios
+        self.espera_reintento = espera_reintento
+        self.logger = logging.getLogger(__name__)
+        self._heap = []  # (vencimiento, dispositivo_id)
+        self._vencimientos = {}  # dispositivo_id -> vencimiento vigente
+        self._en_curso = set()
+        self._ejecuciones = []
+        self._seq = 0
+        self._completados = queue.Queue()
+        self._despertar = threading.Event()
+        self._detenido = False
+        self._ultima_limpieza = None
+        self._seq_limpieza = None  # Cambios ya leídos en la limpieza anterior
+
+    def cargar(self) -> None:
+        """Carga inicial de todos los dispositivos y sus últimos backups"""
+        self._seq = self.dao.ultimo_cambio()
+        ultimos = self.dao.obtener_ultimos_exitos()
+        self._heap = []
+        self._vencimientos = {}
+        # Para programar basta con el id y la frecuencia, sin cargar credenciales
+        for dispositivo in self.dao.iterar(("id", "frecuencia_backup")):
+            self._programar(dispositivo, ultimos.get(dispositivo.id))
+        self.logger.info(f"{len(self._vencimientos)} dispositivos programados")
+
+    def ejecutar(self) -> None:
+        """
+        Bucle principal: duerme hasta el próximo vencimiento o cambio y lanza los backups debidos.
+        Al detener() descarta los pendientes y espera a que terminen los backups en curso
+        """
+        self.cargar()
+        while not self._detenido:
+            self._procesar_completados()
+            self._aplicar_cambios()
+            self._limpiar_antiguos()
+
+            vencidos = self._extraer_vencidos(time.time())
+            if vencidos:
+                self.logger.info(f"Lanzando backup de {len(vencidos)} dispositivos")
+                self._en_curso.update(d.id for d in vencidos)
+                # Todas las tandas comparten los cupos del motor: nunca hay más de max_trabajadores en curso
+                self._ejecuciones = [e for e in self._ejecuciones if not e.resumen.fin]
+                self._ejecuciones.append(self.motor.respaldar(vencidos, al_progresar=self._al_completar))
+
+            self._despertar.wait(self._tiempo_espera())
+            self._despertar.clear()
+
+        for ejecucion in self._ejecuciones:
+            ejecucion.cancelar()
+        for ejecucion in self._ejecuciones:
+            ejecucion.esperar()
+
+    def detener(self) -> None:
+        self._detenido = True
+        self._despertar.set()
+
+    def proximo_vencimiento(self):
+        """Instante (epoch) del próximo backup programado, o None si no hay ninguno"""
+        self._limpiar_cima()
+        return self._heap[0][0] if self._heap else None
+
+    def calcular_vencimiento(self, dispositivo: Dispositivo, ultimo_exito: float = None, ahora: float = None):
+        """
+        Próximo instante de backup del dispositivo, o None si no se programa.
+        Cada dispositivo tiene una fase fija dentro de la ventana de dispersión para
+        repartir los vencimientos en lugar de concentrarlos en el mismo instante
+        """
+        intervalo = INTERVALOS.get(dispositivo.frecuencia_backup)
+        if intervalo is None:
+            return None
+        ahora = ahora or time.time()
+        ventana = self.ventana_dispersion
+        fase = zlib.crc32(str(dispositivo.id).encode()) % ventana if ventana else 0
+
+        if ultimo_exito is None:
+            # Nunca respaldado: se reparte dentro de la próxima ventana
+            return ahora + (fase - ahora) % ventana if ventana else ahora
+        base = ultimo_exito + intervalo
+        # Se alinea a la fase del dispositivo sin pasarse del vencimiento,
+        # así el retraso de cada ejecución no se acumula de un ciclo al siguiente
+        return base - (base - fase) % ventana if ventana else base
+
+    def _programar(self, dispositivo: Dispositivo, ultimo_exito: float = None, vencimiento: float = None):
+        if vencimiento is None:
+            vencimiento = self.calcular_vencimiento(dispositivo, ultimo_exito)
+        if vencimiento is None:
+            self._vencimientos.pop(dispositivo.id, None)
+            return
+        self._vencimientos[dispositivo.id] = vencimiento
+        heapq.heappush(self._heap, (vencimiento, dispositivo.id))
+
+    def _limpiar_cima(self):
+        """Descarta entradas obsoletas (reprogramadas o eliminadas) de la cima del heap"""
+        while self._heap and self._vencimientos.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _extraer_vencidos(self, ahora: float) -> list[Dispositivo]:
+        vencidos = []
+        while True:
+            self._limpiar_cima()
+            if not self._heap or self._heap[0][0] > ahora:
+                return vencidos
+            _, dispositivo_id = heapq.heappop(self._heap)
+            del self._vencimientos[dispositivo_id]
+            if dispositivo := self.dao.obtener_por_id(dispositivo_id):
+                vencidos.append(dispositivo)
+
+    def _aplicar_cambios(self):
+        """Reprograma solo los dispositivos creados, editados o eliminados desde la última lectura"""
+        ids, self._seq = self.dao.obtener_cambios_desde(self._seq)
+        for dispositivo_id in ids:
+            if dispositivo_id in self._en_curso:
+                continue  # se reprograma al terminar con los datos vigentes
+            dispositivo = self.dao.obtener_por_id(dispositivo_id)
+            if dispositivo is None:
+                self._vencimientos.pop(dispositivo_id, None)
+            else:
+                self._programar(dispositivo, self.dao.obtener_ultimo_exito(dispositivo_id))
+        if ids and self._cortacircuitos:
+            # Un dispositivo editado (credenciales, IP, puerto) merece un intento sin esperar
+            self._cortacircuitos.reiniciar(ids)
+        if ids and self.motor.backup_manager.huellas:
+            self.motor.backup_manager.huellas.olvidar(ids)
+        if ids and self.motor.backup_manager.transporte:
+            # Con otra IP o puerto las medidas anteriores ya no valen: el autoajuste vuelve a empezar
+            self.motor.backup_manager.transporte.olvidar_rendimiento(ids)
+        if ids:
+            self.logger.info(f"{len(ids)} dispositivos reprogramados por cambios")
+
+    def _limpiar_antiguos(self):
+        """Una vez al día purga los tiempos de backup vencidos y el registro de cambios ya leído"""
+        if self._ultima_limpieza is not None and time.monotonic() - self._ultima_limpieza < INTERVALO_LIMPIEZA:
+            return
+        self._ultima_limpieza = time.monotonic()
+        if self._seq_limpieza is not None:
+            # Lo que ya se había leído hace un día también lo leyeron la GUI y los demás consumidores
+            try:
+                eliminados = self.dao.limpiar_cambios(self._seq_limpieza)
+                if eliminados:
+                    self.logger.info(f"{eliminados} cambios de dispositivos antiguos eliminados")
+            except Exception as e:
+                self.logger.error(f"Error limpiando el registro de cambios: {str(e)}")
+        self._seq_limpieza = self._seq
+        metricas = self.motor.backup_manager.metricas
+        if metricas:
+            try:
+                eliminados = metricas.limpiar_antiguos()
+                if eliminados:
+                    self.logger.info(f"{eliminados} tiempos de backup antiguos eliminados")
+            except Exception as e:
+                self.logger.error(f"Error limpiando métricas antiguas: {str(e)}")
+
+    def _al_completar(self, dispositivo, estado, resumen):
+        # Se ejecuta en los hilos del motor: se delega al bucle principal
+        self._completados.put((dispositivo.id, estado))
+        self._despertar.set()
+
+    def _procesar_completados(self):
+        while True:
+            try:
+                dispositivo_id, estado = self._completados.get_nowait()
+            except queue.Empty:
+                return
+            self._en_curso.discard(dispositivo_id)
+            dispositivo = self.dao.obtener_por_id(dispositivo_id)
+            if dispositivo is None:
+                continue
+            if estado in (EXITOSO, SIN_CAMBIOS):
+                self._programar(dispositivo, self.dao.obtener_ultimo_exito(dispositivo_id))
+            elif dispositivo.frecuencia_backup in INTERVALOS:
+                proximo = self._cortacircuitos and self._cortacircuitos.proximo_intento(dispositivo_id)
+                self._programar(dispositivo, vencimiento=proximo or time.time() + self.espera_reintento)
+
+    @property
+    def _cortacircuitos(self):
+        return self.motor.backup_manager.cortacircuitos
+
+    def _tiempo_espera(self) -> float:
+        espera = self.intervalo_cambios
+        proximo = self.proximo_vencimiento()
+        if proximo is not None:
+            espera = min(espera, proximo - time.time())
+        return max(espera, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Programador de backups sin interfaz gráfica")
+    parser.add_argument("--db", default="dispositivos.db", help="Ruta de la base de datos de dispositivos")
+    parser.add_argument("--trabajadores", type=int, default=32, help="Backups simultáneos como máximo")
+    parser.add_argument("--por-subred", type=int, default=8, help="Backups simultáneos por subred /24")
+    parser.add_argument("--ventana", type=float, default=3600,
+                        help="Segundos sobre los que se reparten los backups que vencen a la vez")
+    parser.add_argument("--intervalo-cambios", type=float, default=60,
+                        help="Cada cuántos segundos se revisan los dispositivos modificados")
+    parser.add_argument("--almacen", choices=["plano", "deduplicado", "comprimido", "deltas"], default="plano",
+                        help="Archivos .cfg por backup, almacén direccionado por contenido, "
+                             "paquetes comprimidos o versiones completas más deltas")
+    parser.add_argument("--codec", choices=sorted(CODECS), default="zlib",
+                        help="Codec del almacén comprimido")
+    parser.add_argument("--metricas", action="store_true",
+                        help="Guarda en la base de datos los tiempos de cada fase de los backups")
+    parser.add_argument("--prometheus", metavar="ARCHIVO",
+                        help="Exporta también las métricas a este archivo de texto de Prometheus (implica --metricas)")
+    parser.add_argument("--artefactos", action="store_true",
+                        help="Captura también los comandos adicionales del perfil (show version, show inventory...) "
+                             "en un shell interactivo; sin esta opción solo se ejecuta el comando de la configuración")
+    parser.add_argument("--descargar-siempre", action="store_true",
+                        help="Descarga la configuración completa aunque la sonda de cambios del perfil no detecte cambios")
+    parser.add_argument("--procesos", type=int, default=0,
+                        help="Procesos que normalizan (quitando líneas volátiles), calculan el hash y comprimen "
+                             "las configuraciones fuera de los hilos de captura (0 = en los propios hilos)")
+    parser.add_argument("--autoajuste-ssh", action="store_true",
+                        help="Elige compresión y ventana SSH por el rendimiento medido de cada dispositivo "
+                             "(salvo los que lo indiquen con transporte_ssh.py)")
+    parser.add_argument("--cola", action="store_true",
+                        help="Reparte los backups con los demás colectores que usan la misma base de datos, "
+                             "mediante la cola de trabajos con arriendos (SQLite: solo procesos del mismo equipo)")
+    parser.add_argument("--nodo", help="Nombre de este colector en la cola (por defecto equipo:pid)")
+    parser.add_argument("--arriendo", type=float, default=300,
+                        help="Segundos de validez de un trabajo reclamado si el colector deja de renovarlo")
+    parser.add_argument("--log", help="Archivo de registro en JSON Lines, de un solo proceso (por defecto backup.log; "
+                                      "con --cola, backup-<nodo>.log o backup-<pid>.log)")
+    parser.add_argument("--log-max-mb", type=float, default=10, help="Tamaño a partir del cual se rota el registro")
+    parser.add_argument("--log-copias", type=int, default=5, help="Archivos de registro rotados que se conservan")
+    parser.add_argument("--log-diario", action="store_true", help="Rota el registro cada medianoche en lugar de por tamaño")
+    parser.add_argument("--sin-consola", action="store_true", help="No repite los mensajes del registro por consola")
+    parser.add_argument("--debug", action="store_true", help="Registra también la duración de cada fase de cada backup")
+    args = parser.parse_args()
+
+    if args.log is None:
+        # Cada colector escribe y rota su propio archivo: varios procesos rotando el mismo se pisan
+        nombre = re.sub(r"[^\w.-]", "_", args.nodo or str(os.getpid()))
+        args.log = f"backup-{nombre}.log" if args.cola else "backup.log"
+    configurar_registro(args.log, max_bytes=int(args.log_max_mb * 1024 * 1024), copias=args.log_copias,
+                        rotar_cada="midnight" if args.log_diario else None, consola=not args.sin_consola,
+                        nivel=logging.DEBUG if args.debug else logging.INFO)
+    dao = DispositivoDAO(args.db, persistente=True)
+    almacen = None
+    catalogo = CatalogoBackups(args.db)
+    if args.almacen == "deduplicado":
+        almacen = AlmacenDeduplicado(args.db)
+    elif args.almacen == "comprimido":
+        almacen = AlmacenComprimido(codec=args.codec)
+    elif args.almacen == "deltas":
+        almacen = HistorialDeltas(args.db)
+    metricas = MetricasBackup(args.db, args.prometheus) if args.metricas or args.prometheus else None
+    backup_manager = BackupManager(pool=PoolSesionesSSH(), almacen=almacen, catalogo=catalogo,
+                                   indice=IndiceConfiguraciones(args.db), metricas=metricas,
+                                   artefactos=ArtefactosBackup(args.db) if args.artefactos else None,
+                                   cortacircuitos=CortacircuitosDispositivos(args.db),
+                                   huellas=None if args.descargar_siempre else HuellasConfiguracion(args.db),
+                                   postproceso=PostprocesadorBackups(args.procesos) if args.procesos else None,
+                                   transporte=TransporteDispositivos(args.db, autoajuste=args.autoajuste_ssh))
+    motor = MotorBackup(backup_manager, dao, max_trabajadores=args.trabajadores, max_por_subred=args.por_subred)
+    if args.cola:
+        # Importado aquí: cola_trabajos usa INTERVALOS de este módulo
+        from cola_trabajos import ColaTrabajos, ColectorCola
+        cola = ColaTrabajos(args.db, duracion_arriendo=args.arriendo, ventana_dispersion=args.ventana)
+        programador = ColectorCola(cola, dao, motor, nodo=args.nodo, intervalo_encolar=args.intervalo_cambios)
+    else:
+        programador = ProgramadorBackups(dao, motor, ventana_dispersion=args.ventana,
+                                         intervalo_cambios=args.intervalo_cambios)
+
+    signal.signal(signal.SIGINT, lambda *_: programador.detener())
+    signal.signal(signal.SIGTERM, lambda *_: programador.detener())
+    programador.ejecutar()
+    if backup_manager.postproceso:
+        backup_manager.postproceso.cerrar()
+    if metricas:
+        metricas.volcar()
+        if args.prometheus:
+            metricas.exportar()
+
+
+if __name__ == "__main__":
+    main()
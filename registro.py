@@ -0,0 +1,105 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime
+
+# Campos opcionales de cada registro (logger.info(..., extra={...})) que se copian al JSON
+CAMPOS = ("dispositivo_id", "dispositivo", "fase", "duracion", "estado")
+
+# Dispositivo cuyo backup se está haciendo en este hilo: se anota en todos sus registros
+dispositivo_actual = contextvars.ContextVar("dispositivo_actual", default=None)
+
+_listener = None
+_manejador_cola = None
+
+
+class FormatoJSON(logging.Formatter):
+    """Un objeto JSON por línea, listo para un recolector de logs"""
+
+    def format(self, record):
+        datos = {
+            "fecha": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "origen": record.name,
+            "mensaje": record.getMessage(),
+        }
+        for campo in CAMPOS:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                datos[campo] = valor
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class FormatoConsola(logging.Formatter):
+    """El formato de siempre en consola: [*] para información, [!] para errores"""
+
+    def format(self, record):
+        return f"{'[!]' if record.levelno >= logging.ERROR else '[*]'} {record.getMessage()}"
+
+
+def _anotar_dispositivo(record) -> bool:
+    dispositivo = dispositivo_actual.get()
+    if dispositivo is not None and getattr(record, "dispositivo_id", None) is None:
+        record.dispositivo_id = dispositivo.id
+        record.dispositivo = dispositivo.nombre
+    return True
+
+
+def _sin_ruido_paramiko(record) -> bool:
+    return record.levelno >= logging.WARNING or not record.name.startswith("paramiko")
+
+
+def configurar_registro(archivo: str = 'backup.log', max_bytes: int = 10 * 1024 * 1024, copias: int = 5,
+                        rotar_cada: str = None, consola: bool = True, nivel: int = logging.INFO):
+    """
+    Envía los registros a una cola que vacía un hilo aparte: quien registra solo encola.
+    El hilo escribe JSON Lines en `archivo`, rotándolo al superar `max_bytes` o, con
+    rotar_cada (p.ej. "midnight"), por tiempo, y con consola=True repite los mensajes
+    por la salida estándar. Solo la primera llamada configura; devuelve el QueueListener.
+    Cada archivo debe tener un único proceso escritor: la rotación no se coordina entre
+    procesos, y dos que roten el mismo archivo pierden o mezclan registros
+    """
+    global _listener, _manejador_cola
+    if _listener is not None:
+        return _listener
+
+    if rotar_cada:
+        manejador_archivo = logging.handlers.TimedRotatingFileHandler(archivo, when=rotar_cada, backupCount=copias,
+                                                                      encoding='utf-8')
+    else:
+        manejador_archivo = logging.handlers.RotatingFileHandler(archivo, maxBytes=max_bytes, backupCount=copias,
+                                                                 encoding='utf-8')
+    manejador_archivo.setFormatter(FormatoJSON())
+    manejadores = [manejador_archivo]
+    # Sin consola (pythonw) sys.stdout es None
+    if consola and sys.stdout is not None:
+        manejador_consola = logging.StreamHandler(sys.stdout)
+        manejador_consola.setFormatter(FormatoConsola())
+        manejador_consola.setLevel(max(nivel, logging.INFO))  # El detalle por fase solo va al archivo
+        manejador_consola.addFilter(_sin_ruido_paramiko)
+        manejadores.append(manejador_consola)
+
+    cola = queue.SimpleQueue()
+    _manejador_cola = logging.handlers.QueueHandler(cola)
+    _manejador_cola.addFilter(_anotar_dispositivo)
+    raiz = logging.getLogger()
+    raiz.addHandler(_manejador_cola)
+    raiz.setLevel(nivel)
+
+    _listener = logging.handlers.QueueListener(cola, *manejadores, respect_handler_level=True)
+    _listener.start()
+    atexit.register(detener_registro)
+    return _listener
+
+
+def detener_registro() -> None:
+    """Escribe los registros pendientes y detiene el hilo del registro"""
+    global _listener, _manejador_cola
+    if _listener is not None:
+        logging.getLogger().removeHandler(_manejador_cola)
+        _listener.stop()
+        _listener = _manejador_cola = None
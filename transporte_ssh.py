@@ -0,0 +1,268 @@
+import argparse
+import sqlite3
+import time
+from dataclasses import dataclass, replace
+import paramiko
+from dispositivo import Dispositivo, DispositivoDAO
+
+# Algoritmos que admite paramiko, en su orden de preferencia
+CIFRADOS = paramiko.Transport._preferred_ciphers
+KEX = paramiko.Transport._preferred_kex
+
+VENTANA_GRANDE = 16 * 1024 * 1024  # Bytes; la de paramiko es de 2 MiB y se queda corta en enlaces con mucho retardo
+# Lo que debe superar una variante a otra más sencilla para desplazarla (evita cambios por ruido)
+MARGEN_MEJORA = 0.1
+
+
+@dataclass(frozen=True)
+class AjustesTransporte:
+    """Ajustes de la conexión SSH de un dispositivo. Los valores por defecto conectan como siempre"""
+    compresion: bool = False
+    cifrados: tuple = ()  # Cifrados permitidos; vacío para todos los de paramiko
+    kex: tuple = ()  # Intercambios de claves permitidos; vacío para todos los de paramiko
+    intervalo_keepalive: int = 0  # Segundos; 0 para el del pool
+    tamano_ventana: int = 0  # Bytes; 0 para el de paramiko
+    tamano_paquete: int = 0  # Bytes; 0 para el de paramiko
+    clave_privada: str = ""  # Archivo de clave; si el equipo la rechaza se prueba la contraseña
+
+    @property
+    def variante(self) -> str:
+        """Lo que distingue a los candidatos del autoajuste"""
+        return f"compresion={int(self.compresion)},ventana={self.tamano_ventana}"
+
+    def algoritmos_desactivados(self) -> dict:
+        desactivados = {}
+        if self.cifrados:
+            desactivados["ciphers"] = [c for c in CIFRADOS if c not in self.cifrados]
+        if self.kex:
+            desactivados["kex"] = [k for k in KEX if k not in self.kex]
+        return desactivados
+
+
+def conectar(ssh: paramiko.SSHClient, dispositivo: Dispositivo, ajustes: AjustesTransporte = None,
+             timeout: float = 15, sock=None, intervalo_keepalive: int = 0) -> None:
+    """Conecta el cliente al dispositivo aplicando sus ajustes de transporte"""
+    ajustes = ajustes or AjustesTransporte()
+    ssh.connect(
+        hostname=dispositivo.ip,
+        port=dispositivo.puerto_ssh,
+        username=dispositivo.usuario,
+        password=dispositivo.contraseña,
+        timeout=timeout,
+        key_filename=ajustes.clave_privada or None,
+        look_for_keys=False,
+        allow_agent=False,
+        compress=ajustes.compresion,
+        disabled_algorithms=ajustes.algoritmos_desactivados() or None,
+        sock=sock
+    )
+    transporte = ssh.get_transport()
+    # Se aplican a los canales que se abran a partir de ahora (exec o shell)
+    if ajustes.tamano_ventana:
+        transporte.default_window_size = ajustes.tamano_ventana
+    if ajustes.tamano_paquete:
+        transporte.default_max_packet_size = ajustes.tamano_paquete
+    if ajustes.intervalo_keepalive or intervalo_keepalive:
+        transporte.set_keepalive(ajustes.intervalo_keepalive or intervalo_keepalive)
+
+
+class TransporteDispositivos:
+    """
+    Ajustes de transporte SSH de cada dispositivo y el rendimiento medido con cada
+    variante. Con autoajuste se prueban las combinaciones de compresión y ventana
+    hasta tener `muestras_minimas` descargas de cada una y después se usa la más
+    rápida; la media se sigue actualizando, así que si empeora se cambia de variante.
+    `autoajuste` vale para los dispositivos que no lo indiquen expresamente
+    """
+
+    def __init__(self, db_path='dispositivos.db', autoajuste: bool = False, muestras_minimas: int = 2,
+                 peso_muestra: float = 0.3):
+        self.db_path = db_path
+        self.autoajuste = autoajuste
+        self.muestras_minimas = muestras_minimas
+        self.peso_muestra = peso_muestra  # Peso de cada descarga nueva en la media exponencial
+        self._crear_tabla()
+
+    def _crear_tabla(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS transporte_dispositivos (
+                                dispositivo_id INTEGER PRIMARY KEY,
+                                compresion INTEGER NOT NULL DEFAULT 0,
+                                cifrados TEXT NOT NULL DEFAULT '',
+                                kex TEXT NOT NULL DEFAULT '',
+                                intervalo_keepalive INTEGER NOT NULL DEFAULT 0,
+                                tamano_ventana INTEGER NOT NULL DEFAULT 0,
+                                tamano_paquete INTEGER NOT NULL DEFAULT 0,
+                                clave_privada TEXT NOT NULL DEFAULT '',
+                                autoajuste INTEGER
+                              )''')
+            # Bytes por segundo de las descargas con cada variante (media exponencial)
+            cursor.execute('''CREATE TABLE IF NOT EXISTS rendimiento_transporte (
+                                dispositivo_id INTEGER NOT NULL,
+                                variante TEXT NOT NULL,
+                                muestras INTEGER NOT NULL,
+                                bytes_por_segundo REAL NOT NULL,
+                                fecha REAL NOT NULL,
+                                PRIMARY KEY (dispositivo_id, variante)
+                              )''')
+            conn.commit()
+
+    def _leer(self, dispositivo_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT compresion, cifrados, kex, intervalo_keepalive, tamano_ventana, tamano_paquete,
+                                     clave_privada, autoajuste
+                              FROM transporte_dispositivos WHERE dispositivo_id = ?''', (dispositivo_id,))
+            return cursor.fetchone()
+
+    @staticmethod
+    def _ajustes(fila) -> AjustesTransporte:
+        if not fila:
+            return AjustesTransporte()
+        compresion, cifrados, kex, keepalive, ventana, paquete, clave, _ = fila
+        return AjustesTransporte(bool(compresion), tuple(filter(None, cifrados.split(","))),
+                                 tuple(filter(None, kex.split(","))), keepalive, ventana, paquete, clave)
+
+    def ajustes(self, dispositivo_id) -> AjustesTransporte:
+        """Ajustes configurados para el dispositivo (los de siempre si no tiene)"""
+        return self._ajustes(self._leer(dispositivo_id))
+
+    def autoajuste_configurado(self, dispositivo_id):
+        """True o False si el dispositivo lo indica expresamente; None si decide el colector"""
+        fila = self._leer(dispositivo_id)
+        return None if not fila or fila[7] is None else bool(fila[7])
+
+    def guardar(self, dispositivo_id, ajustes: AjustesTransporte, autoajuste: bool = None) -> None:
+        """Guarda los ajustes del dispositivo; autoajuste=None deja que decida el colector"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''INSERT OR REPLACE INTO transporte_dispositivos
+                                (dispositivo_id, compresion, cifrados, kex, intervalo_keepalive, tamano_ventana,
+                                 tamano_paquete, clave_privada, autoajuste)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                           (dispositivo_id, int(ajustes.compresion), ",".join(ajustes.cifrados), ",".join(ajustes.kex),
+                            ajustes.intervalo_keepalive, ajustes.tamano_ventana, ajustes.tamano_paquete,
+                            ajustes.clave_privada, None if autoajuste is None else int(autoajuste)))
+            conn.commit()
+
+    def candidatos(self, ajustes: AjustesTransporte) -> list[AjustesTransporte]:
+        """Variantes que compara el autoajuste: con y sin compresión, con la ventana configurada y con una grande"""
+        ventanas = dict.fromkeys([ajustes.tamano_ventana, VENTANA_GRANDE])
+        return [replace(ajustes, compresion=compresion, tamano_ventana=ventana)
+                for ventana in ventanas for compresion in (False, True)]
+
+    def elegir(self, dispositivo: Dispositivo) -> AjustesTransporte:
+        """Ajustes para el próximo backup: los configurados o, con autoajuste, la variante que toca probar o la mejor"""
+        fila = self._leer(dispositivo.id)
+        ajustes = self._ajustes(fila)
+        if not (self.autoajuste if not fila or fila[7] is None else fila[7]):
+            return ajustes
+        medidas = {variante: (muestras, bytes_por_segundo)
+                   for variante, muestras, bytes_por_segundo, _ in self.rendimiento(dispositivo.id)}
+        candidatos = self.candidatos(ajustes)
+        for candidato in candidatos:
+            if medidas.get(candidato.variante, (0, 0))[0] < self.muestras_minimas:
+                return candidato
+        # Los candidatos van de más sencillo a más complejo
+        mejor = candidatos[0]
+        for candidato in candidatos[1:]:
+            if medidas[candidato.variante][1] > medidas[mejor.variante][1] * (1 + MARGEN_MEJORA):
+                mejor = candidato
+        return mejor
+
+    def registrar(self, dispositivo_id, ajustes: AjustesTransporte, bytes_descargados: int, segundos: float) -> None:
+        """Incorpora a la media de la variante el rendimiento de una descarga"""
+        if not bytes_descargados or segundos <= 0:
+            return
+        ajustes = ajustes or AjustesTransporte()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''INSERT INTO rendimiento_transporte
+                                (dispositivo_id, variante, muestras, bytes_por_segundo, fecha)
+                              VALUES (?, ?, 1, ?, ?)
+                              ON CONFLICT (dispositivo_id, variante) DO UPDATE SET
+                                muestras = muestras + 1,
+                                bytes_por_segundo = bytes_por_segundo + ? * (excluded.bytes_por_segundo - bytes_por_segundo),
+                                fecha = excluded.fecha''',
+                           (dispositivo_id, ajustes.variante, bytes_descargados / segundos, time.time(),
+                            self.peso_muestra))
+            conn.commit()
+
+    def rendimiento(self, dispositivo_id) -> list[tuple]:
+        """(variante, muestras, bytes por segundo, fecha) medidos para el dispositivo"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT variante, muestras, bytes_por_segundo, fecha FROM rendimiento_transporte
+                              WHERE dispositivo_id = ? ORDER BY bytes_por_segundo DESC''', (dispositivo_id,))
+            return cursor.fetchall()
+
+    def olvidar_rendimiento(self, ids) -> None:
+        """Descarta las medidas (p.ej. si el dispositivo cambió de IP): el autoajuste vuelve a empezar"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM rendimiento_transporte WHERE dispositivo_id = ?', [(i,) for i in ids])
+            conn.commit()
+
+
+def _lista(texto: str, admitidos: tuple) -> tuple:
+    valores = tuple(filter(None, (v.strip() for v in texto.split(","))))
+    desconocidos = [v for v in valores if v not in admitidos]
+    if desconocidos:
+        raise argparse.ArgumentTypeError(f"No admitidos: {', '.join(desconocidos)}. Opciones: {', '.join(admitidos)}")
+    return valores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consulta o cambia los ajustes de transporte SSH de los dispositivos")
+    parser.add_argument("accion", choices=["ver", "ajustar", "reiniciar"],
+                        help="reiniciar descarta el rendimiento medido para que el autoajuste vuelva a probar")
+    parser.add_argument("ids", type=int, nargs="+", help="Ids de los dispositivos")
+    parser.add_argument("--db", default="dispositivos.db", help="Ruta de la base de datos de dispositivos")
+    parser.add_argument("--compresion", action=argparse.BooleanOptionalAction, help="Compresión zlib del transporte")
+    parser.add_argument("--cifrados", type=lambda texto: _lista(texto, CIFRADOS),
+                        help="Cifrados permitidos, separados por comas (vacío para todos)")
+    parser.add_argument("--kex", type=lambda texto: _lista(texto, KEX),
+                        help="Intercambios de claves permitidos, separados por comas (vacío para todos)")
+    parser.add_argument("--keepalive", type=int, help="Segundos entre keepalives (0 para el del pool)")
+    parser.add_argument("--ventana", type=int, help="Ventana de los canales en bytes (0 para la de paramiko)")
+    parser.add_argument("--paquete", type=int, help="Tamaño máximo de paquete en bytes (0 para el de paramiko)")
+    parser.add_argument("--clave", help="Archivo de clave privada (vacío para usar solo la contraseña)")
+    parser.add_argument("--autoajuste", choices=["si", "no", "colector"],
+                        help="Elegir compresión y ventana por rendimiento medido, o lo que diga el colector")
+    args = parser.parse_args()
+
+    dao = DispositivoDAO(args.db)
+    transporte = TransporteDispositivos(args.db)
+    for dispositivo_id in args.ids:
+        dispositivo = dao.obtener_por_id(dispositivo_id)
+        if not dispositivo:
+            print(f"[!] No existe el dispositivo {dispositivo_id}")
+            continue
+        if args.accion == "reiniciar":
+            transporte.olvidar_rendimiento([dispositivo_id])
+            print(f"[*] Rendimiento de {dispositivo.nombre} descartado")
+            continue
+        ajustes = transporte.ajustes(dispositivo_id)
+        autoajuste = transporte.autoajuste_configurado(dispositivo_id)
+        if args.accion == "ajustar":
+            cambios = {campo: valor for campo, valor in (
+                ("compresion", args.compresion), ("cifrados", args.cifrados), ("kex", args.kex),
+                ("intervalo_keepalive", args.keepalive), ("tamano_ventana", args.ventana),
+                ("tamano_paquete", args.paquete), ("clave_privada", args.clave)) if valor is not None}
+            ajustes = replace(ajustes, **cambios)
+            if args.autoajuste:
+                autoajuste = {"si": True, "no": False, "colector": None}[args.autoajuste]
+            transporte.guardar(dispositivo_id, ajustes, autoajuste)
+        print(f"{dispositivo.nombre} ({dispositivo.ip}:{dispositivo.puerto_ssh})")
+        print(f"  compresión: {'sí' if ajustes.compresion else 'no'}  cifrados: {','.join(ajustes.cifrados) or 'todos'}"
+              f"  kex: {','.join(ajustes.kex) or 'todos'}")
+        print(f"  keepalive: {ajustes.intervalo_keepalive or 'pool'}  ventana: {ajustes.tamano_ventana or 'paramiko'}"
+              f"  paquete: {ajustes.tamano_paquete or 'paramiko'}  clave: {ajustes.clave_privada or '-'}"
+              f"  autoajuste: {'colector' if autoajuste is None else 'sí' if autoajuste else 'no'}")
+        for variante, muestras, bytes_por_segundo, _ in transporte.rendimiento(dispositivo_id):
+            print(f"  {variante:<40} {muestras:>5} descargas {bytes_por_segundo / 1024:>10.1f} KiB/s")
+
+
+if __name__ == "__main__":
+    main()